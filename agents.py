@@ -1,16 +1,150 @@
-"""Module with agents"""
+"""Module with agents that are made when they are needed the first time"""
 
 import os.path
+import threading
+import time
+from configparser import ConfigParser
+from typing import Optional, Dict
 
+import json_manager
+import logger
+import metrics
+import persistence
+import text_processing
+from language_pack import LanguagePack
 from texting_ai import RatingLearningAgent, RatingRandomReplyAgent, NounsFindingAgent, ConversationController, \
-    AgentPipeline
+    AgentPipeline, TextCallChecker, SQLiteRatingLearningAgent
 
+LOGGER = logger.get_logger(__file__)
+
+CONFIG_PATH = os.path.join('data', 'config.ini')
 AGENT_LANGUAGE_PATH = os.path.join('data', 'language')
-RANDOM_REPLY_AGENT = RatingRandomReplyAgent(os.path.join(AGENT_LANGUAGE_PATH, 'sentences.json'))
-NOUNS_FINDING_AGENT = NounsFindingAgent(os.path.join(AGENT_LANGUAGE_PATH, 'sentences.json'),
-                                        os.path.join(AGENT_LANGUAGE_PATH, 'nouns.json'))
-LEARNING_AGENT = RatingLearningAgent(os.path.join('data', 'rated_learning_model.json'),
-                                     os.path.join('data',
-                                                  'learning_model.json'))
-AGENTS_PIPELINE = AgentPipeline(LEARNING_AGENT, NOUNS_FINDING_AGENT, RANDOM_REPLY_AGENT)
-CONVERSATION_CONTROLLER = ConversationController(AGENTS_PIPELINE)
+RATED_LEARNING_MODEL_PATH = os.path.join('data', 'rated_learning_model.json')
+LEARNING_MODEL_PATH = os.path.join('data', 'learning_model.json')
+RATED_LEARNING_DATABASE_PATH = os.path.join('data', 'rated_learning_model.sqlite3')
+LANGUAGE_PACK_NAME = 'language.pack'
+
+
+def read_config(config_path: str = CONFIG_PATH) -> ConfigParser:
+    """
+    Reads config of the bot
+    :param config_path: path to the config
+    :return: config
+    """
+    config = ConfigParser()
+    config.read(config_path)
+    return config
+
+
+class Agents:
+    """
+    Agents of the bot that are made together and work in one pipeline
+    """
+
+    def __init__(self, config: ConfigParser, language_path: str = AGENT_LANGUAGE_PATH,
+                 rated_model_path: str = RATED_LEARNING_MODEL_PATH, model_path: str = LEARNING_MODEL_PATH,
+                 database_path: str = RATED_LEARNING_DATABASE_PATH):
+        """
+        :param config: config of the bot
+        :param language_path: path to directory with sentences.json, nouns.json, names.json
+        and language.pack that is used instead of json files if it's enabled in the config
+        :param rated_model_path: path to RatingLearningAgent's knowledge base
+        :param model_path: path to LearningAgent's knowledge base
+        :param database_path: path to SQLite knowledge base that is used if storage is sqlite in the config
+        """
+        # one pack is shared by agents
+        self.language_pack: Optional[LanguagePack] = None
+        if config.getboolean('language', 'pack', fallback=False):
+            pack_path = os.path.join(language_path, LANGUAGE_PACK_NAME)
+            try:
+                self.language_pack = LanguagePack(pack_path)
+            except (OSError, ValueError) as error:
+                LOGGER.error(f'json files are used because language pack {pack_path} is not loaded: {error}')
+        if not self.language_pack:
+            text_processing.seed_caches(os.path.join(language_path, 'nouns.json'))
+
+        self.random_reply_agent = RatingRandomReplyAgent(os.path.join(language_path, 'sentences.json'),
+                                                         config.getboolean('replying', 'vectorized', fallback=False),
+                                                         self.language_pack)
+        self.nouns_finding_agent = NounsFindingAgent(os.path.join(language_path, 'sentences.json'),
+                                                     os.path.join(language_path, 'nouns.json'),
+                                                     self.language_pack)
+        top_rated_replies = config.getint('replying', 'top rated replies', fallback=0) or None
+        if config.get('learning', 'storage', fallback='json') == 'sqlite':
+            self.learning_agent = SQLiteRatingLearningAgent(database_path, rated_model_path, model_path,
+                                                            top_rated_replies)
+        else:
+            self.learning_agent = RatingLearningAgent(
+                rated_model_path, model_path,
+                journal_compaction_period=config.getint('learning', 'journal compaction period', fallback=1000),
+                flush_period=config.getfloat('learning', 'flush period', fallback=30)
+                if config.getboolean('learning', 'background flush', fallback=False) else None,
+                flush_changes=config.getint('learning', 'flush changes', fallback=100),
+                top_rated_replies=top_rated_replies)
+        self.pipeline = AgentPipeline(self.learning_agent, self.nouns_finding_agent, self.random_reply_agent)
+        self.call_checker = TextCallChecker(os.path.join(language_path, 'names.json'))
+        self.conversation_controller = ConversationController(self.pipeline, self.call_checker)
+
+        self.compaction_policy = persistence.CompactionPolicy(
+            config.getboolean('compaction', 'drop zero ratings', fallback=True),
+            config.getint('compaction', 'max replies', fallback=0) or None,
+            config.getint('compaction', 'max patterns', fallback=0) or None,
+            self.random_reply_agent.has_phrase
+            if config.getboolean('compaction', 'remove unknown replies', fallback=True) else None)
+
+    def compact_knowledge_base(self) -> Dict[str, int]:
+        """
+        Removes knowledge of learning agent by the compaction policy from the config
+        :return: numbers of removed patterns, ratings, replies and bytes
+        """
+        return self.learning_agent.compact_knowledge_base(self.compaction_policy)
+
+    def apply_language_diff(self, diff_json_path: str) -> None:
+        """
+        Applies changes of language data files made by dataset_processing to the agents
+        :param diff_json_path: path to json with added and removed sentences and nouns
+        :return: None
+        """
+        diff = json_manager.read(diff_json_path)
+        self.random_reply_agent.apply_diff(diff)
+        self.nouns_finding_agent.apply_diff(diff)
+
+
+# agents of the bot made from default paths by get_agents()
+_AGENTS: Optional[Agents] = None
+_AGENTS_LOCK = threading.Lock()
+
+
+def get_agents() -> Agents:
+    """
+    Gets agents of the bot making them the first time it's called
+    :return: agents
+    """
+    global _AGENTS
+    if _AGENTS is None:
+        with _AGENTS_LOCK:
+            if _AGENTS is None:
+                start_time = time.perf_counter()
+                loaded_agents = Agents(read_config())
+                metrics.Gauge('knowledge_base_patterns', 'Number of patterns learned by learning agent',
+                              loaded_agents.learning_agent.get_patterns_num)
+                LOGGER.info(f'agents are made in {time.perf_counter() - start_time:.2f} seconds')
+                _AGENTS = loaded_agents
+    return _AGENTS
+
+
+def apply_language_diff(diff_json_path: str) -> bool:
+    """
+    Applies changes of language data files made by dataset_processing to running agents,
+    agents that aren't made yet read the changed files when they are made
+    :param diff_json_path: path to json with added and removed sentences and nouns
+    :return: True if the changes are applied else False if agents aren't made yet
+    """
+    with _AGENTS_LOCK:
+        loaded_agents = _AGENTS
+    if loaded_agents is None:
+        LOGGER.info(f'diff {diff_json_path} is not applied because agents are not made yet')
+        return False
+
+    loaded_agents.apply_language_diff(diff_json_path)
+    return True
@@ -0,0 +1,238 @@
+"""
+Module for benchmarking replying of agents on messages from test files
+"""
+
+import argparse
+import logging
+import os.path
+import platform
+import random
+import tempfile
+import time
+from typing import List, Dict, Callable, Optional
+
+import numpy
+
+import json_manager
+import persistence
+import text_processing
+from texting_ai import RatingLearningAgent, RatingRandomReplyAgent, NounsFindingAgent, ConversationController, \
+    AgentPipeline, TextCallChecker
+
+AGENT_LANGUAGE_PATH = os.path.join('data', 'language')
+
+# percentiles of latency that are reported
+PERCENTILES = [50, 95, 99]
+
+
+class Timer:
+    """
+    Collects durations of calls of a function
+    """
+
+    def __init__(self):
+        self.durations: List[float] = list()
+
+    def wrap(self, function: Callable) -> Callable:
+        """
+        Makes function that measures durations of the given one
+        :param function: function to measure
+        :return: wrapped function
+        """
+        def timed_function(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.durations.append(time.perf_counter() - start_time)
+
+        return timed_function
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Gets statistics of collected durations
+        :return: number of calls, latency percentiles and mean in milliseconds, calls per second
+        """
+        if not self.durations:
+            return {'calls': 0}
+
+        durations = numpy.array(self.durations) * 1000
+        stats = {'calls': len(durations), 'mean': float(durations.mean())}
+        for percentile in PERCENTILES:
+            stats[f'p{percentile}'] = float(numpy.percentile(durations, percentile))
+        stats['max'] = float(durations.max())
+        stats['throughput'] = len(durations) / (durations.sum() / 1000) if durations.sum() else 0.0
+        return stats
+
+
+def read_messages(messages_files_names: List[str]) -> List[str]:
+    """
+    Reads messages from test files with one message per line
+    :param messages_files_names: names of files with messages
+    :return: not empty messages
+    """
+    messages = list()
+    for file_name in messages_files_names:
+        with open(file_name, 'r', encoding='utf-8-sig') as file:
+            messages.extend(line.strip() for line in file if line.strip())
+    return messages
+
+
+def make_knowledge_base(patterns_num: int, stems: List[str], replies: List[str],
+                        pattern_delimiter: str = '.* ', replies_per_pattern: int = 3) -> Dict[str, Dict[str, int]]:
+    """
+    Makes synthetic knowledge base of RatingLearningAgent
+    :param patterns_num: number of patterns
+    :param stems: stems that patterns are made of
+    :param replies: replies that patterns are rated with
+    :param pattern_delimiter: string that joins stems in patterns
+    :param replies_per_pattern: maximum number of replies of a pattern
+    :return: knowledge base with patterns, replies and ratings
+    """
+    knowledge_base: Dict[str, Dict[str, int]] = dict()
+    # there can't be more patterns of 1-3 stems than combinations of stems
+    patterns_num = min(patterns_num, len(stems) + len(stems) ** 2 + len(stems) ** 3)
+
+    while len(knowledge_base) < patterns_num:
+        pattern = pattern_delimiter.join(random.choices(stems, k=random.randint(1, 3)))
+        knowledge_base[pattern] = {reply: random.randint(-10, 10)
+                                   for reply in random.sample(replies, min(len(replies),
+                                                                          random.randint(1, replies_per_pattern)))}
+
+    return knowledge_base
+
+
+def run_benchmark(messages: List[str], patterns_num: int, sentences_json_path: str, nouns_json_path: str,
+                  names_json_path: Optional[str] = None, seed: int = 0, vectorized: bool = False,
+                  top_rated_replies: Optional[int] = None) -> Dict:
+    """
+    Replies on messages by ConversationController with agents
+    using synthetic knowledge base and measures durations of replying
+    :param messages: messages to reply on
+    :param patterns_num: number of patterns in the knowledge base
+    :param sentences_json_path: path to json with sentences and their nouns
+    :param nouns_json_path: path to json with nouns and their stemmed forms
+    :param names_json_path: path to json with names of the bot
+    :param seed: seed of random numbers generators
+    :param vectorized: if True then RatingRandomReplyAgent chooses replies using arrays
+    :param top_rated_replies: maximum number of replies with non-negative rating got by RatingLearningAgent
+    :return: statistics of durations of replying on the whole and by each of agents
+    """
+    random.seed(seed)
+    numpy.random.seed(seed)
+
+    sentences = list(json_manager.read(sentences_json_path).keys())
+    # patterns are made of stems from messages so part of them is found
+    stems = sorted({stem for message in messages[:1000]
+                    for stem in text_processing.analyze(message).stems if len(stem) >= 3}
+                   | set(json_manager.read(nouns_json_path).values()))
+
+    with tempfile.TemporaryDirectory() as directory:
+        knowledge_base_path = os.path.join(directory, 'rated_learning_model.json')
+        persistence.write_json(persistence.RatedKnowledgeBase(
+            make_knowledge_base(patterns_num, stems, sentences)).to_json(), knowledge_base_path, indent=None)
+
+        learning_agent = RatingLearningAgent(knowledge_base_path, top_rated_replies=top_rated_replies)
+        nouns_finding_agent = NounsFindingAgent(sentences_json_path, nouns_json_path)
+        random_reply_agent = RatingRandomReplyAgent(sentences_json_path, vectorized)
+        controller = ConversationController(AgentPipeline(learning_agent, nouns_finding_agent, random_reply_agent),
+                                            TextCallChecker(names_json_path))
+
+        # agents' methods are replaced in instances so the pipeline calls measured ones
+        timers = {'analysis': Timer(), 'end-to-end': Timer()}
+        for agent, method_name in [(learning_agent, 'get_rated_replies'),
+                                   (nouns_finding_agent, 'get_replies'),
+                                   (random_reply_agent, 'get_rated_reply')]:
+            timers[type(agent).__name__] = Timer()
+            setattr(agent, method_name, timers[type(agent).__name__].wrap(getattr(agent, method_name)))
+
+        def analyze(text: str) -> text_processing.AnalyzedMessage:
+            # everything that agents use is computed before they are called
+            return text_processing.AnalyzedMessage(text).precompute()
+
+        replies_num = 0
+        for message in messages:
+            start_time = time.perf_counter()
+            analyzed_message = timers['analysis'].wrap(analyze)(message)
+            if controller.proceed_input_message(analyzed_message, True, False):
+                replies_num += 1
+            timers['end-to-end'].durations.append(time.perf_counter() - start_time)
+
+        learning_agent.close()
+
+    result = {name: timer.get_stats() for name, timer in timers.items()}
+    result['patterns'] = len(learning_agent.knowledge_base)
+    result['replies'] = replies_num
+    return result
+
+
+def compare_results(results: Dict, baseline: Dict) -> None:
+    """
+    Prints changes of latencies relatively to results of another run
+    :param results: results of this run
+    :param baseline: results of the run to compare with
+    :return: None
+    """
+    for size, stages in results['results'].items():
+        for stage, stats in stages.items():
+            baseline_stats = baseline['results'].get(size, dict()).get(stage)
+            if not isinstance(stats, dict) or not isinstance(baseline_stats, dict):
+                continue
+            changes = [f'p{x} {stats[f"p{x}"] / baseline_stats[f"p{x}"] - 1:+.1%}'
+                       for x in PERCENTILES if baseline_stats.get(f'p{x}') and f'p{x}' in stats]
+            print(f'{size:>8} {stage:<24} {", ".join(changes)}')
+
+
+def print_results(results: Dict) -> None:
+    """
+    Prints latencies and throughput
+    :param results: results of benchmark
+    :return: None
+    """
+    for size, stages in results['results'].items():
+        print(f'{stages["patterns"]} patterns, {stages["replies"]} replies on {results["messages"]} messages')
+        for stage, stats in stages.items():
+            if isinstance(stats, dict) and stats.get('calls'):
+                print(f'    {stage:<24} ' + ', '.join(f'p{x} {stats[f"p{x}"]:.2f} ms' for x in PERCENTILES)
+                      + f', {stats["throughput"]:.0f} per second')
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Benchmarks replying on messages from test files')
+    PARSER.add_argument('messages', nargs='*', help='files with one message per line',
+                        default=[os.path.join('data', 'tests', f'test{x}.txt') for x in range(3)])
+    PARSER.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='numbers of patterns in synthetic knowledge bases')
+    PARSER.add_argument('--seed', type=int, default=0, help='seed of random numbers generators')
+    PARSER.add_argument('--sentences', default=os.path.join(AGENT_LANGUAGE_PATH, 'sentences.json'),
+                        help='json file with sentences and nouns')
+    PARSER.add_argument('--nouns', default=os.path.join(AGENT_LANGUAGE_PATH, 'nouns.json'),
+                        help='json file with nouns and their stemmed forms')
+    PARSER.add_argument('--names', default=os.path.join(AGENT_LANGUAGE_PATH, 'names.json'),
+                        help='json file with names of the bot')
+    PARSER.add_argument('--vectorized', action='store_true', help='choose replies using arrays')
+    PARSER.add_argument('--top-rated', type=int, default=0,
+                        help='number of replies with the highest ratings got on a message, 0 for all of them')
+    PARSER.add_argument('--output', default='benchmark.json', help='output json file with results')
+    PARSER.add_argument('--baseline', default=None, help='json file with results of another run to compare with')
+    ARGS = PARSER.parse_args()
+
+    # logging of each found pattern would be measured instead of agents
+    logging.disable(logging.INFO)
+
+    MESSAGES = read_messages(ARGS.messages)
+    RESULTS = {
+        'seed': ARGS.seed,
+        'messages': len(MESSAGES),
+        'vectorized': ARGS.vectorized,
+        'top rated': ARGS.top_rated,
+        'python': platform.python_version(),
+        'results': {str(size): run_benchmark(MESSAGES, size, ARGS.sentences, ARGS.nouns, ARGS.names,
+                                             ARGS.seed, ARGS.vectorized, ARGS.top_rated or None)
+                    for size in ARGS.sizes}
+    }
+    json_manager.write(RESULTS, ARGS.output)
+
+    print_results(RESULTS)
+    if ARGS.baseline:
+        compare_results(RESULTS, json_manager.read(ARGS.baseline))
@@ -2,11 +2,19 @@
 Telegram bot module
 """
 
+import asyncio
+import json
+import signal
 import time
 import os.path
 import ssl
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, Future
 from configparser import ConfigParser
-from typing import Callable
+from functools import partial
+from typing import Callable, Dict, List, Optional, Coroutine, Set
+
+import aiohttp
 
 import telebot
 import emoji
@@ -14,7 +22,11 @@ from aiohttp import web
 
 import logger
 import messages
+import metrics
 import agents
+import persistence
+import telegram_client
+import text_processing
 
 CONFIG = ConfigParser()
 CONFIG.read(os.path.join('data', 'config.ini'))
@@ -27,10 +39,8 @@ telebot.logger = logger.get_logger(__file__)
 
 LOGGER = telebot.logger
 
-BOT = telebot.TeleBot(CONFIG['telegram bot']['token'])
-
-# server that will listen for new messages
-APP = web.Application()
+# handlers are called by the updates worker so telebot's own threads aren't used
+BOT = telebot.TeleBot(CONFIG['telegram bot']['token'], threaded=False)
 
 # time for bot to be "typing" in seconds
 TYPING_TIME: int = 2
@@ -40,6 +50,85 @@ TYPING = 'typing'
 DOWN_VOTE = 'down vote'
 UP_VOTE = 'up vote'
 
+# maximum number of received updates that are waiting for processing
+UPDATES_QUEUE_SIZE = CONFIG.getint('server', 'updates queue size', fallback=1000)
+# [seconds] processing lag that is reported as a warning
+UPDATES_LAG_WARNING = 10
+
+# updates received by webhook with time of receiving that are waiting for processing
+UPDATES_QUEUE: Optional[asyncio.Queue] = None
+# event loop of the server for scheduling sending of replies from the processing thread
+LOOP: Optional[asyncio.AbstractEventLoop] = None
+# updates are processed one by one in one thread so agents are not used simultaneously
+# and the event loop is not blocked by processing
+PROCESSING_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
+# statistics of updates processing
+UPDATES_STATS = {
+    'received': 0,
+    'dropped': 0,
+    'processed': 0,
+    'failed': 0,
+    'last lag': 0.0,
+    'max lag': 0.0
+}
+
+# [seconds] period while votes are collected before the keyboard with their numbers is updated
+KEYBOARD_UPDATE_DELAY = 1
+
+# statistics of updating keyboards with votes
+KEYBOARD_STATS = {
+    'votes': 0,
+    'edits': 0,
+    'saved edits': 0
+}
+
+# [seconds] period without votes after which votes for a message are learned
+VOTES_QUIET_PERIOD = CONFIG.getfloat('grading', 'votes quiet period', fallback=10)
+
+# tasks that wait for the end of votes bursts, they are cancelled when the server shuts down
+VOTES_LEARNING_TASKS: Set[asyncio.Task] = set()
+
+# statistics of learning votes
+VOTES_LEARNING_STATS = {
+    'learned': 0,
+    # votes cancelled each other or were already learned
+    'skipped': 0
+}
+
+# messages sent by the bot that can be graded by users,
+# votes that are not learned yet are learned when a message stops being gradable
+GRADING_MESSAGES = messages.GradingRegistry(
+    CONFIG.getint('grading', 'max messages', fallback=1000),
+    CONFIG.getfloat('grading', 'message lifetime', fallback=24 * 60 * 60),
+    lambda grading_message: PROCESSING_EXECUTOR.submit(learn_votes, grading_message))
+
+# statistics of compactions of learning agent's knowledge base
+COMPACTION_STATS = {
+    'compactions': 0,
+    'failed': 0,
+    # numbers of patterns, ratings, replies and bytes removed by the last compaction
+    'last removed': dict()
+}
+
+# json with changes of language data that is applied to running agents
+LANGUAGE_DIFF_PATH = CONFIG.get('language', 'diff', fallback=os.path.join(agents.AGENT_LANGUAGE_PATH, 'diff.json'))
+
+# statistics of applying changes of language data
+LANGUAGE_DIFF_STATS = {
+    'applied': 0,
+    'failed': 0
+}
+
+# id of the bot user that is requested once when it's needed the first time
+BOT_USER_ID: Optional[int] = None
+
+# [seconds] durations of the bot start from START_DATE
+STARTUP_STATS = {
+    'agents ready': None,
+    'first reply': None
+}
+
 # date of the bot start
 START_DATE = time.time()
 MESSAGE_ACTUALITY_PERIOD = 6*60*60*60  # six hours in seconds
@@ -59,11 +148,42 @@ def set_proxy() -> None:
             telebot.apihelper.proxy = {'http': f'http://{address}:{port}'}
         elif proxy_type == 'socks5':
             user = CONFIG['proxy']['user']
-            password = CONFIG['proxy']['port']
+            password = CONFIG['proxy']['password']
             telebot.apihelper.proxy = {'https': f'socks5://{user}:{password}@{address}:{port}'}
 
 
-set_proxy()
+def make_telegram_client() -> telegram_client.TelegramClient:
+    """
+    Makes asynchronous client of Telegram Bot API with the proxy from the config
+    :return: client
+    """
+    proxy = None
+    proxy_auth = None
+    if CONFIG.getboolean('proxy', 'enabled'):
+        address = CONFIG['proxy']['address']
+        port = CONFIG['proxy']['port']
+        proxy_type = CONFIG['proxy']['type']
+        user = CONFIG.get('proxy', 'user', fallback='')
+        password = CONFIG.get('proxy', 'password', fallback='')
+        if proxy_type == 'http':
+            proxy = f'http://{address}:{port}'
+            if user:
+                proxy_auth = aiohttp.BasicAuth(user, password)
+        elif proxy_type == 'socks5':
+            credentials = f'{urllib.parse.quote(user, safe="")}:{urllib.parse.quote(password, safe="")}@' \
+                if user else ''
+            proxy = f'socks5://{credentials}{address}:{port}'
+        else:
+            # calls are never sent bypassing the enabled proxy
+            raise ValueError(f'{proxy_type} proxy is not supported, http or socks5 proxy should be used')
+
+    return telegram_client.TelegramClient(CONFIG['telegram bot']['token'],
+                                          CONFIG.get('telegram bot', 'api url', fallback=telegram_client.API_URL),
+                                          proxy, proxy_auth)
+
+
+# client for all calls that the bot makes while it's working
+TELEGRAM = make_telegram_client()
 
 
 async def handle(request: web.Request) -> web.Response:
@@ -75,14 +195,314 @@ async def handle(request: web.Request) -> web.Response:
     if request.match_info.get('token') == BOT.token:
         request_body_dict = await request.json()
         update = telebot.types.Update.de_json(request_body_dict)
-        BOT.process_new_updates([update])
+        UPDATES_STATS['received'] += 1
+
+        # the update is acknowledged immediately and processed later
+        try:
+            UPDATES_QUEUE.put_nowait((update, time.time()))
+        except asyncio.QueueFull:
+            # Telegram would send it again and again if it was not acknowledged
+            UPDATES_STATS['dropped'] += 1
+            LOGGER.error(f'update {update.update_id} is dropped because the updates queue is full')
+
         response = web.Response()
     else:
         response = web.Response(status=403)
 
     return response
 
-APP.router.add_post('/{token}/', handle)
+
+def get_updates_stats() -> Dict:
+    """
+    Gets statistics of updates processing
+    :return: numbers of updates, lags of processing and current size of the updates queue
+    """
+    stats = dict(UPDATES_STATS)
+    stats['queue depth'] = UPDATES_QUEUE.qsize() if UPDATES_QUEUE else 0
+    return stats
+
+
+async def handle_stats(request: web.Request) -> web.Response:
+    """
+    Gives statistics of updates processing
+    :param request: request to handle
+    :return: response with statistics in json
+    """
+    if request.match_info.get('token') != BOT.token:
+        return web.Response(status=403)
+
+    return web.json_response({
+        'updates': get_updates_stats(),
+        'api calls': TELEGRAM.stats,
+        'keyboards': KEYBOARD_STATS,
+        'votes learning': VOTES_LEARNING_STATS,
+        'startup': STARTUP_STATS,
+        'compaction': COMPACTION_STATS,
+        'language diff': LANGUAGE_DIFF_STATS
+    })
+
+
+metrics.Gauge('updates_queue_depth', 'Number of updates waiting for processing',
+              lambda: UPDATES_QUEUE.qsize() if UPDATES_QUEUE else 0)
+metrics.Gauge('updates_last_lag_seconds', 'Time between receiving and processing of the last update',
+              lambda: UPDATES_STATS['last lag'])
+for _name in ['received', 'dropped', 'processed', 'failed']:
+    metrics.Gauge(f'updates_{_name}_total', f'Number of {_name} updates',
+                  partial(UPDATES_STATS.get, _name), is_counter=True)
+for _name in ['agents ready', 'first reply']:
+    metrics.Gauge(f'startup_{_name.replace(" ", "_")}_seconds', f'Time from the bot start until {_name}',
+                  lambda name=_name: STARTUP_STATS[name] if STARTUP_STATS[name] is not None else float('nan'))
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """
+    Gives metrics of the bot in Prometheus text format
+    :param request: request to handle
+    :return: response with metrics
+    """
+    if request.match_info.get('token') != BOT.token:
+        return web.Response(status=403)
+
+    return web.Response(body=metrics.REGISTRY.render().encode('utf8'),
+                        headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+async def process_updates() -> None:
+    """
+    Worker that processes updates from the updates queue one by one
+    :return: None
+    """
+    while True:
+        update, receiving_time = await UPDATES_QUEUE.get()
+
+        lag = time.time() - receiving_time
+        UPDATES_STATS['last lag'] = lag
+        UPDATES_STATS['max lag'] = max(UPDATES_STATS['max lag'], lag)
+        if lag > UPDATES_LAG_WARNING:
+            LOGGER.warning(f'update {update.update_id} is processed {lag:.1f} seconds after receiving, '
+                           f'{UPDATES_QUEUE.qsize()} updates are waiting')
+
+        try:
+            await LOOP.run_in_executor(PROCESSING_EXECUTOR, BOT.process_new_updates, [update])
+            UPDATES_STATS['processed'] += 1
+        except Exception as error:
+            UPDATES_STATS['failed'] += 1
+            LOGGER.error(f'update {update.update_id} is not processed: {error}')
+        finally:
+            UPDATES_QUEUE.task_done()
+
+
+async def start_updates_worker(app: web.Application) -> None:
+    """
+    Creates the updates queue and starts the worker that processes updates
+    :param app: server application
+    :return: None
+    """
+    global UPDATES_QUEUE, LOOP
+    LOOP = asyncio.get_event_loop()
+    UPDATES_QUEUE = asyncio.Queue(maxsize=UPDATES_QUEUE_SIZE)
+    app['updates worker'] = LOOP.create_task(process_updates())
+
+
+async def stop_updates_worker(app: web.Application) -> None:
+    """
+    Stops the worker that processes updates
+    :param app: server application
+    :return: None
+    """
+    app['updates worker'].cancel()
+
+    # votes that are not learned yet are submitted at once by removing their messages
+    # instead of waiting for the end of their bursts
+    for task in VOTES_LEARNING_TASKS:
+        task.cancel()
+    await asyncio.gather(*VOTES_LEARNING_TASKS, return_exceptions=True)
+    GRADING_MESSAGES.clear()
+
+    # the event loop isn't blocked while the processing thread finishes submitted work
+    await LOOP.run_in_executor(None, PROCESSING_EXECUTOR.shutdown)
+
+
+def get_bot_user_id() -> int:
+    """
+    Gets id of the bot user that is needed for each text message,
+    it's requested until a request succeeds, so a failed request doesn't stop the server.
+    Must be called in the processing thread
+    :return: id of the bot user
+    """
+    global BOT_USER_ID
+    if BOT_USER_ID is None:
+        BOT_USER_ID = schedule(TELEGRAM.get_me()).result()['id']
+    return BOT_USER_ID
+
+
+def prewarm() -> None:
+    """
+    Makes agents, loads NLTK models and requests the bot user before the first update needs them.
+    Must be called in the processing thread
+    :return: None
+    """
+    agents.get_agents()
+    STARTUP_STATS['agents ready'] = time.time() - START_DATE
+
+    start_time = time.perf_counter()
+    text_processing.prewarm()
+    LOGGER.info(f'agents are ready {STARTUP_STATS["agents ready"]:.2f} seconds after the start, '
+                f'NLTK models are loaded in {time.perf_counter() - start_time:.2f} seconds')
+
+    try:
+        get_bot_user_id()
+    except Exception as error:
+        LOGGER.warning(f'bot user is not requested, it will be requested with the first message: {error}')
+
+
+async def start_prewarm(app: web.Application) -> None:
+    """
+    Starts prewarming in the processing thread so updates wait for it instead of making agents themselves
+    :param app: server application
+    :return: None
+    """
+    if CONFIG.getboolean('server', 'prewarm', fallback=True):
+        PROCESSING_EXECUTOR.submit(prewarm)
+
+
+async def compact_knowledge_base_periodically(period: float) -> None:
+    """
+    Compacts knowledge base of learning agent every period in a separate thread,
+    so updates are processed while it's compacted
+    :param period: [seconds] period between compactions
+    :return: None
+    """
+    while True:
+        await asyncio.sleep(period)
+        try:
+            COMPACTION_STATS['last removed'] = await LOOP.run_in_executor(
+                None, lambda: agents.get_agents().compact_knowledge_base())
+            COMPACTION_STATS['compactions'] += 1
+        except Exception as error:
+            COMPACTION_STATS['failed'] += 1
+            LOGGER.error(f'knowledge base is not compacted: {error}')
+
+
+async def start_compaction(app: web.Application) -> None:
+    """
+    Starts periodic compaction of knowledge base if it's enabled in the config
+    :param app: server application
+    :return: None
+    """
+    if CONFIG.getboolean('compaction', 'enabled', fallback=False):
+        app['compaction'] = LOOP.create_task(compact_knowledge_base_periodically(
+            CONFIG.getfloat('compaction', 'period', fallback=24 * 60 * 60)))
+
+
+async def stop_compaction(app: web.Application) -> None:
+    """
+    Stops periodic compaction of knowledge base
+    :param app: server application
+    :return: None
+    """
+    if 'compaction' in app:
+        app['compaction'].cancel()
+
+
+async def apply_language_diff() -> bool:
+    """
+    Applies changes of language data from the diff file to agents in the processing thread,
+    so they aren't changed while updates are processed
+    :return: True if the changes are applied else False
+    """
+    try:
+        applied = await LOOP.run_in_executor(PROCESSING_EXECUTOR, agents.apply_language_diff, LANGUAGE_DIFF_PATH)
+    except Exception as error:
+        LANGUAGE_DIFF_STATS['failed'] += 1
+        LOGGER.error(f'diff {LANGUAGE_DIFF_PATH} is not applied: {error}')
+        return False
+
+    if applied:
+        LANGUAGE_DIFF_STATS['applied'] += 1
+        LOGGER.info(f'diff {LANGUAGE_DIFF_PATH} is applied')
+    return applied
+
+
+async def handle_language_diff(request: web.Request) -> web.Response:
+    """
+    Applies changes of language data to running agents
+    :param request: request to handle
+    :return: response with result of applying in json
+    """
+    if request.match_info.get('token') != BOT.token:
+        return web.Response(status=403)
+
+    return web.json_response({'applied': await apply_language_diff()})
+
+
+async def start_language_diff_signal(app: web.Application) -> None:
+    """
+    Makes SIGHUP apply changes of language data to running agents
+    :param app: server application
+    :return: None
+    """
+    try:
+        LOOP.add_signal_handler(signal.SIGHUP, lambda: LOOP.create_task(apply_language_diff()))
+    except (AttributeError, NotImplementedError):
+        # there are no such signals on Windows
+        LOGGER.info('changes of language data can be applied only by request because SIGHUP is not supported')
+
+
+async def close_telegram_client(app: web.Application) -> None:
+    """
+    Closes connections of Telegram client
+    :param app: server application
+    :return: None
+    """
+    await TELEGRAM.close()
+
+
+def schedule(coroutine: Coroutine) -> Future:
+    """
+    Schedules coroutine in the event loop from the processing thread, its errors are logged
+    :param coroutine: coroutine to be run
+    :return: future with result of the coroutine
+    """
+    def log_error(future: Future) -> None:
+        if not future.cancelled() and future.exception():
+            LOGGER.error(future.exception())
+
+    future = asyncio.run_coroutine_threadsafe(coroutine, LOOP)
+    future.add_done_callback(log_error)
+    return future
+
+
+async def drain_learned_knowledge(app: web.Application) -> None:
+    """
+    Writes learned knowledge that is not written yet when the server shuts down
+    :param app: server application
+    :return: None
+    """
+    persistence.drain_all()
+
+
+def create_app() -> web.Application:
+    """
+    Makes server application that listens for updates,
+    agents are made in background when the server starts or when the first update needs them
+    :return: server application
+    """
+    app = web.Application()
+    app.router.add_post('/{token}/', handle)
+    app.router.add_get('/{token}/stats', handle_stats)
+    app.router.add_get('/{token}/metrics', handle_metrics)
+    app.router.add_post('/{token}/language', handle_language_diff)
+
+    app.on_startup.append(start_updates_worker)
+    app.on_startup.append(start_prewarm)
+    app.on_startup.append(start_compaction)
+    app.on_startup.append(start_language_diff_signal)
+    app.on_shutdown.append(stop_compaction)
+    app.on_shutdown.append(stop_updates_worker)
+    app.on_shutdown.append(drain_learned_knowledge)
+    app.on_cleanup.append(close_telegram_client)
+    return app
 
 
 def check_message_actuality(actuality_period: int) -> Callable:
@@ -124,10 +544,11 @@ def command_reply(message: telebot.types.Message) -> None:
     # TODO for /ask implement replying on previous message
 
     is_private = message.chat.type == PRIVATE_MESSAGE
+    analyzed_message = text_processing.AnalyzedMessage(message.text)
     reply_message(message,
-                  agents.CONVERSATION_CONTROLLER.proceed_input_message(message.text,
-                                                                       is_private, True),
-                  not is_private)
+                  agents.get_agents().conversation_controller.proceed_input_message(analyzed_message,
+                                                                                    is_private, True),
+                  not is_private, analyzed_message)
 
 
 @BOT.message_handler(func=lambda message: True, content_types=['text'])
@@ -140,7 +561,7 @@ def text_reply(message: telebot.types.Message) -> None:
     """
     text = message.text
     is_private = message.chat.type == PRIVATE_MESSAGE
-    is_reply = check_reply(BOT.get_me().id, message)
+    is_reply = check_reply(get_bot_user_id(), message)
     as_reply = True if not is_private else False
     # indicates if the message is directed to the bot
     is_directed = is_private or is_reply
@@ -150,9 +571,10 @@ def text_reply(message: telebot.types.Message) -> None:
     if not is_directed and message.date < START_DATE:
         return
 
-    reply = agents.CONVERSATION_CONTROLLER.proceed_input_message(text, is_directed, False)
+    analyzed_message = text_processing.AnalyzedMessage(text)
+    reply = agents.get_agents().conversation_controller.proceed_input_message(analyzed_message, is_directed, False)
     if reply:
-        reply_message(message, reply, as_reply)
+        reply_message(message, reply, as_reply, analyzed_message)
 
 
 def check_reply(_id: int, message: telebot.types.Message) -> bool:
@@ -168,7 +590,7 @@ def check_reply(_id: int, message: telebot.types.Message) -> bool:
     return False
 
 
-def make_voting_keyboard(likes: int, dislikes: int) -> telebot.types.InlineKeyboardMarkup:
+def make_voting_keyboard(likes: int, dislikes: int) -> Dict:
     """
     Makes inline keyboard for grading message by likes and dislikes
     :param likes: number of likes to display
@@ -184,10 +606,10 @@ def make_voting_keyboard(likes: int, dislikes: int) -> telebot.types.InlineKeybo
         callback_data=UP_VOTE)
     keyboard.row(callback_button_dislike, callback_button_like)
 
-    return keyboard
+    return json.loads(keyboard.to_json())
 
 
-def remove_inline_keyboard(message: telebot.types.Message) -> None:
+async def remove_inline_keyboard(message: telebot.types.Message) -> None:
     """
     Removes inline keyboard from message
     :param message: the message a keyboard to be removed from
@@ -195,18 +617,20 @@ def remove_inline_keyboard(message: telebot.types.Message) -> None:
     """
     # handling connection errors
     try:
-        BOT.edit_message_reply_markup(chat_id=message.chat.id,
-                                      message_id=message.message_id, reply_markup=None)
+        await TELEGRAM.edit_message_reply_markup(message.chat.id, message.message_id)
     except Exception as error:
         LOGGER.error(error)
 
 
-def reply_message(message: telebot.types.Message, reply: str, is_reply: bool) -> None:
+def reply_message(message: telebot.types.Message, reply: str, is_reply: bool,
+                  analyzed_message: text_processing.AnalyzedMessage = None) -> None:
     """
-    Sends reply on message
+    Schedules sending of reply on message in the event loop,
+    so the processing thread doesn't wait while the bot is "typing"
     :param message: input message
     :param reply: text reply on message
     :param is_reply: True if reply_to() method should be used or False if send_message()
+    :param analyzed_message: analysis of input message text to be reused for making patterns
     :return: None
     """
 
@@ -214,22 +638,115 @@ def reply_message(message: telebot.types.Message, reply: str, is_reply: bool) ->
         LOGGER.error("empty reply in reply_message()")
         return
 
-    # removing keyboard from previous message
-    if messages.CURRENT_GRADING_MESSAGE:
-        old_message: telebot.types.Message = messages.CURRENT_GRADING_MESSAGE.message
-        remove_inline_keyboard(old_message)
+    # patterns are made while the analysis is at hand, so gradable messages don't keep it
+    patterns = agents.get_agents().learning_agent.make_patterns(analyzed_message or message.text)
+    schedule(send_reply(message, reply, is_reply, patterns))
 
-    BOT.send_chat_action(message.chat.id, TYPING)
-    time.sleep(TYPING_TIME)
 
-    keyboard = make_voting_keyboard(0, 0)
+async def send_reply(message: telebot.types.Message, reply: str, is_reply: bool, patterns: List[str]) -> None:
+    """
+    Sends reply on message
+    :param message: input message
+    :param reply: text reply on message
+    :param is_reply: True if reply_to() method should be used or False if send_message()
+    :param patterns: patterns of input message that are learned with votes for the reply
+    :return: None
+    """
 
-    if is_reply:
-        new_message = BOT.reply_to(message, reply, reply_markup=keyboard)
-    else:
-        new_message = BOT.send_message(message.chat.id, reply, reply_markup=keyboard)
+    try:
+        await TELEGRAM.send_chat_action(message.chat.id, TYPING)
+        await asyncio.sleep(TYPING_TIME)
 
-    messages.CURRENT_GRADING_MESSAGE = messages.GradableMessage(new_message, message.text)
+        keyboard = make_voting_keyboard(0, 0)
+
+        new_message = telebot.types.Message.de_json(await TELEGRAM.send_message(
+            message.chat.id, reply, message.message_id if is_reply else None, keyboard))
+    except Exception as error:
+        LOGGER.error(f'reply "{reply}" is not sent: {error}')
+        return
+
+    if STARTUP_STATS['first reply'] is None:
+        STARTUP_STATS['first reply'] = time.time() - START_DATE
+        LOGGER.info(f'the first reply is sent {STARTUP_STATS["first reply"]:.2f} seconds after the start')
+
+    # keyboards of messages that are not gradable anymore are removed when they are pressed
+    GRADING_MESSAGES.add(messages.GradableMessage(new_message, message.text, patterns))
+
+
+async def update_voting_keyboard(grading_message: messages.GradableMessage) -> None:
+    """
+    Updates keyboard of grading message after votes are collected for a while,
+    so a burst of votes costs only one edit with the latest numbers
+    :param grading_message: voted message
+    :return: None
+    """
+    # the keyboard is going to be updated with the latest numbers anyway
+    if grading_message.keyboard_update_pending:
+        KEYBOARD_STATS['saved edits'] += 1
+        return
+
+    grading_message.keyboard_update_pending = True
+    try:
+        await asyncio.sleep(KEYBOARD_UPDATE_DELAY)
+    finally:
+        grading_message.keyboard_update_pending = False
+
+    votes = grading_message.get_likes_num(), grading_message.get_dislikes_num()
+
+    # the keyboard was removed or it already shows these numbers
+    if not GRADING_MESSAGES.contains(grading_message) or votes == grading_message.shown_votes:
+        KEYBOARD_STATS['saved edits'] += 1
+        return
+
+    grading_message.shown_votes = votes
+    KEYBOARD_STATS['edits'] += 1
+    await TELEGRAM.edit_message_reply_markup(grading_message.chat_id, grading_message.message_id,
+                                             make_voting_keyboard(*votes))
+
+
+def learn_votes(grading_message: messages.GradableMessage) -> None:
+    """
+    Learns net rating change of votes for message that are not learned yet.
+    Must be called in the processing thread
+    :param grading_message: voted message
+    :return: None
+    """
+    rating_change = grading_message.take_rating_change()
+    if not rating_change:
+        VOTES_LEARNING_STATS['skipped'] += 1
+        return
+
+    learning_agent = agents.get_agents().learning_agent
+    learning_agent.rating_learn_patterns(grading_message.patterns, grading_message.reply_message, rating_change)
+    VOTES_LEARNING_STATS['learned'] += 1
+
+
+async def learn_votes_later(grading_message: messages.GradableMessage) -> None:
+    """
+    Learns votes for message when there were no votes for it for a while,
+    so a burst of votes is learned once
+    :param grading_message: voted message
+    :return: None
+    """
+    # votes are going to be learned anyway
+    if grading_message.learning_pending:
+        return
+
+    task = asyncio.current_task()
+    VOTES_LEARNING_TASKS.add(task)
+    grading_message.learning_pending = True
+    try:
+        delay = VOTES_QUIET_PERIOD
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = grading_message.last_vote_time + VOTES_QUIET_PERIOD - time.time()
+    finally:
+        grading_message.learning_pending = False
+        VOTES_LEARNING_TASKS.discard(task)
+
+    # votes of messages that stopped being gradable are learned when they are removed
+    if GRADING_MESSAGES.contains(grading_message):
+        await LOOP.run_in_executor(PROCESSING_EXECUTOR, learn_votes, grading_message)
 
 
 @BOT.callback_query_handler(func=lambda call: True)
@@ -238,13 +755,13 @@ def callback_inline(call: telebot.types.CallbackQuery) -> None:
     is executed when a user presses a button on the message inline keyboard"""
 
     if call.data in {DOWN_VOTE, UP_VOTE}:
-        grading_message: messages.GradableMessage = messages.CURRENT_GRADING_MESSAGE
         message: telebot.types.Message = call.message
+        grading_message = GRADING_MESSAGES.get(message.chat.id, message.message_id)
 
-        # if the message is not the one that is currently grading
+        # if the message is not gradable anymore
         # then remove keyboard
-        if not grading_message or message.message_id != grading_message.message.message_id:
-            remove_inline_keyboard(message)
+        if not grading_message:
+            schedule(remove_inline_keyboard(message))
             return
 
         user_id = call.from_user.id
@@ -255,37 +772,51 @@ def callback_inline(call: telebot.types.CallbackQuery) -> None:
             grading_message.down_vote(user_id)
 
         grading_message.update_grade()
+        grading_message.add_rating_change()
 
         # attaching keyboard to message
-        keyboard = make_voting_keyboard(grading_message.get_likes_num(),
-                                        grading_message.get_dislikes_num())
-        BOT.edit_message_reply_markup(chat_id=message.chat.id, message_id=message.message_id,
-                                      reply_markup=keyboard)
+        KEYBOARD_STATS['votes'] += 1
+        schedule(update_voting_keyboard(grading_message))
 
         # learning
-        agents.LEARNING_AGENT.rating_learn(grading_message.input_message,
-                                           grading_message.reply_message,
-                                           grading_message.get_change_difference())
+        schedule(learn_votes_later(grading_message))
+
+    schedule(TELEGRAM.answer_callback_query(call.id))
+
 
-    BOT.answer_callback_query(call.id)
+def main() -> None:
+    """
+    Sets webhook and starts the server
+    :return: None
+    """
+    set_proxy()
+    # learned knowledge that is not written yet is written when the process exits,
+    # the server handles SIGTERM itself by shutting down the usual way
+    persistence.drain_on_termination()
 
+    # Remove webhook, it fails sometimes the set if there is a previous webhook
+    BOT.remove_webhook()
 
-# Remove webhook, it fails sometimes the set if there is a previous webhook
-BOT.remove_webhook()
+    # Set webhook
+    url = URL_BASE + URL_PATH
+    with open(CONFIG['ssl']['certificate'], 'rb') as certificate:
+        BOT.set_webhook(url=url, certificate=certificate, max_connections=10)
 
+    # Build ssl context
+    context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+    context.load_cert_chain(CONFIG['ssl']['certificate'], CONFIG['ssl']['private key'])
+
+    if persistence.TERMINATION_REQUESTED.is_set():
+        return
 
-# Set webhook
-URL = URL_BASE + URL_PATH
-BOT.set_webhook(url=URL, certificate=open(CONFIG['ssl']['certificate'], 'rb'), max_connections=10)
+    # Start aiohttp server
+    web.run_app(
+        create_app(),
+        host=CONFIG['server']['listen'],
+        port=CONFIG['server']['port'],
+        ssl_context=context,
+    )
 
-# Build ssl context
-CONTEXT = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-CONTEXT.load_cert_chain(CONFIG['ssl']['certificate'], CONFIG['ssl']['private key'])
 
-# Start aiohttp server
-web.run_app(
-    APP,
-    host=CONFIG['server']['listen'],
-    port=CONFIG['server']['port'],
-    ssl_context=CONTEXT,
-)
+if __name__ == '__main__':
+    main()
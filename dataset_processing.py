@@ -2,11 +2,30 @@
 Module for converting data set into files used by agent
 """
 
-from typing import List, Dict, Optional
+import argparse
+import codecs
+import hashlib
+import os
+import os.path
+import time
+from collections import deque
+from contextlib import nullcontext
+from multiprocessing import Pool
+from typing import List, Dict, Optional, Iterator, Tuple
+
+import nltk.data
 from nltk.tokenize import sent_tokenize
+
 import json_manager
+import language_pack
+import logger
 import text_processing
 
+LOGGER = logger.get_logger(__file__)
+
+# tokenizer that is used by sent_tokenize()
+SENTENCE_TOKENIZER_PATH = 'tokenizers/punkt/english.pickle'
+
 
 def read_text_file(file_name: str) -> Optional[str]:
     """
@@ -75,3 +94,248 @@ def write_nouns_and_stemmed(input_json_name: str = "sentences_and_nouns.json",
             nouns_and_stemmed[noun] = text_processing.stem(noun)
 
     json_manager.write(nouns_and_stemmed, output_json_name)
+
+
+def read_sentences(text_file_name: str, chunk_size: int = 1 << 20) -> Iterator[Tuple[str, int]]:
+    """
+    Reads text file by chunks and splits its text into sentences
+    :param text_file_name: name of a file to read
+    :param chunk_size: [bytes] size of a chunk to read at once
+    :return: sentences with number of bytes read by the moment the sentence was split
+    """
+
+    tokenizer = nltk.data.load(SENTENCE_TOKENIZER_PATH)
+
+    # 'utf-8-sig' is used for omitting \ufeff symbol in the beginning of the file
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    read_bytes_num = 0
+    # the last sentence of a chunk can be continued in the next one
+    unfinished_text = ''
+
+    with open(text_file_name, 'rb') as text_file:
+        while True:
+            chunk = text_file.read(chunk_size)
+            read_bytes_num += len(chunk)
+            is_last = not chunk
+
+            text = unfinished_text + decoder.decode(chunk, final=is_last)
+            unfinished_text = ''
+
+            if not is_last:
+                # the text is split only by the last whitespace for not splitting a word
+                # or a sequence of punctuation symbols between chunks
+                split_position = max(text.rfind(' '), text.rfind('\n'))
+                if split_position <= 0:
+                    unfinished_text = text
+                    continue
+                text, unfinished_text = text[:split_position], text[split_position:]
+
+            spans = list(tokenizer.span_tokenize(text))
+            if not is_last:
+                # the end of the last but one sentence depends on the beginning of the last one
+                # so at least both of them are split again with the next chunk.
+                # Tokenizing is restarted only from a sentence that follows whitespace
+                # because a sentence starting inside a token, e.g. "??" of "???", is split differently alone
+                restart = max(len(spans) - 2, 0)
+                while restart > 0 and not text[spans[restart][0] - 1].isspace():
+                    restart -= 1
+                unfinished_text = text[spans[restart][0] if restart else 0:] + unfinished_text
+                spans = spans[:restart]
+
+            for start, end in spans:
+                yield text[start:end], read_bytes_num
+
+            if is_last:
+                return
+
+
+def _process_sentences(sentences: List[str]) -> List[Tuple[List[str], Dict[str, str]]]:
+    """
+    Finds nouns of sentences and their stemmed forms
+    :param sentences: sentences to process
+    :return: nouns and stemmed forms of the nouns for each sentence
+    """
+    return [(sorted(nouns), {noun: text_processing.stem(noun) for noun in nouns})
+            for nouns in text_processing.get_sentences_nouns(sentences)]
+
+
+def _read_json_if_exists(file_name: Optional[str]) -> Dict:
+    """
+    Reads json file if it exists and is not broken
+    :param file_name: name of a file to read
+    :return: data from json file or empty dictionary
+    """
+    if not file_name or not os.path.isfile(file_name):
+        return dict()
+
+    try:
+        return json_manager.read(file_name)
+    except ValueError as error:
+        LOGGER.error(f'{file_name} can\'t be read: {error}')
+        return dict()
+
+
+def build_language_data(text_file_name: str,
+                        sentences_json_name: str = "sentences_and_nouns.json",
+                        nouns_json_name: str = "nouns_and_stemmed.json",
+                        processes: Optional[int] = None,
+                        chunk_size: int = 1 << 20,
+                        batch_size: int = 256,
+                        progress_period: float = 10,
+                        cache_json_name: Optional[str] = None,
+                        diff_json_name: Optional[str] = None) -> None:
+    """
+    Reads text file by chunks and writes json with sentences and their nouns
+    and json with nouns and their stemmed forms in one pass.
+    Sentences are processed in parallel and written in the order they are in the text
+    :param text_file_name: name of the input text file
+    :param sentences_json_name: name of the output json file with sentences and nouns
+    :param nouns_json_name: name of the output json file with nouns and their stemmed forms
+    :param processes: number of processes that find nouns, number of CPUs is used if not given
+    :param chunk_size: [bytes] size of a text chunk to read at once
+    :param batch_size: number of sentences given to a process at once
+    :param progress_period: [seconds] how often the progress is reported
+    :param cache_json_name: name of json file with nouns and their stemmed forms of sentences
+    by hashes of the sentences, only sentences that are not in it are processed and then it's updated
+    :param diff_json_name: name of the output json file with sentences and nouns
+    that are added to and removed from previous versions of the output files
+    :return: None
+    """
+
+    processes = processes or os.cpu_count() or 1
+    total_bytes_num = os.path.getsize(text_file_name)
+
+    # results of previous builds by hashes of sentences
+    cache: Dict[str, Tuple[List[str], Dict[str, str]]] = _read_json_if_exists(cache_json_name)
+
+    # previous versions of output files for making the diff
+    old_sentences: Dict[str, List[str]] = _read_json_if_exists(sentences_json_name) if diff_json_name else dict()
+    old_nouns: Dict[str, str] = _read_json_if_exists(nouns_json_name) if diff_json_name else dict()
+    added_sentences: Dict[str, List[str]] = dict()
+
+    nouns_and_stemmed: Dict[str, str] = dict()
+    # hashes of already processed sentences for omitting repetitions
+    sentences_hashes = set()
+
+    sentences_num = 0
+    processed_sentences_num = 0
+    read_bytes_num = 0
+    start_time = last_report_time = time.time()
+
+    def get_batches() -> Iterator[Tuple[List[str], List[str]]]:
+        nonlocal read_bytes_num
+        batch = list()
+        batch_hashes = list()
+        for sentence, read_bytes_num in read_sentences(text_file_name, chunk_size):
+            sentence_hash = hashlib.sha1(sentence.encode('utf8')).hexdigest()
+            if sentence_hash in sentences_hashes:
+                continue
+            sentences_hashes.add(sentence_hash)
+
+            batch.append(sentence)
+            batch_hashes.append(sentence_hash)
+            if len(batch) >= batch_size:
+                yield batch, batch_hashes
+                batch = list()
+                batch_hashes = list()
+        if batch:
+            yield batch, batch_hashes
+
+    def get_not_cached(batch: List[str], batch_hashes: List[str]) -> List[str]:
+        return [sentence for sentence, sentence_hash in zip(batch, batch_hashes) if sentence_hash not in cache]
+
+    def write_batch(batch: List[str], batch_hashes: List[str],
+                    processed: List[Tuple[List[str], Dict[str, str]]]) -> None:
+        nonlocal sentences_num, processed_sentences_num, last_report_time
+        processed_sentences_num += len(processed)
+        processed = iter(processed)
+
+        for sentence, sentence_hash in zip(batch, batch_hashes):
+            nouns, stemmed_nouns = cache[sentence_hash] if sentence_hash in cache else next(processed)
+            sentences_writer.write(sentence, nouns)
+            if cache_writer:
+                cache_writer.write(sentence_hash, [nouns, stemmed_nouns])
+            nouns_and_stemmed.update(stemmed_nouns)
+
+            if diff_json_name:
+                if sentence in old_sentences and sorted(old_sentences[sentence]) == nouns:
+                    del old_sentences[sentence]
+                else:
+                    added_sentences[sentence] = nouns
+        sentences_num += len(batch)
+
+        if time.time() - last_report_time >= progress_period:
+            last_report_time = time.time()
+            LOGGER.info(f'{sentences_num} sentences are written ({processed_sentences_num} are processed), '
+                        f'{read_bytes_num / max(total_bytes_num, 1):.1%} of {text_file_name} is read, '
+                        f'{sentences_num / (last_report_time - start_time):.0f} sentences per second')
+
+    with json_manager.ObjectWriter(sentences_json_name) as sentences_writer, \
+            (json_manager.ObjectWriter(cache_json_name) if cache_json_name else nullcontext()) as cache_writer:
+        if processes == 1:
+            for batch, batch_hashes in get_batches():
+                write_batch(batch, batch_hashes, _process_sentences(get_not_cached(batch, batch_hashes)))
+        else:
+            with Pool(processes) as pool:
+                # limited number of batches is being processed at once
+                # so the text is not read into memory faster than it's processed
+                pending = deque()
+
+                def write_next_batch() -> None:
+                    batch, batch_hashes, result = pending.popleft()
+                    write_batch(batch, batch_hashes, result.get() if result else list())
+
+                for next_batch, next_batch_hashes in get_batches():
+                    not_cached = get_not_cached(next_batch, next_batch_hashes)
+                    pending.append((next_batch, next_batch_hashes,
+                                    pool.apply_async(_process_sentences, (not_cached,)) if not_cached else None))
+                    if len(pending) >= processes * 2:
+                        write_next_batch()
+                while pending:
+                    write_next_batch()
+
+    json_manager.write(nouns_and_stemmed, nouns_json_name)
+
+    if diff_json_name:
+        # sentences left in old ones are removed or have other nouns now
+        json_manager.write({
+            'sentences': {
+                'added': added_sentences,
+                'removed': old_sentences
+            },
+            'nouns': {
+                'added': {noun: stemmed for noun, stemmed in nouns_and_stemmed.items()
+                          if old_nouns.get(noun) != stemmed},
+                'removed': {noun: stemmed for noun, stemmed in old_nouns.items()
+                            if nouns_and_stemmed.get(noun) != stemmed}
+            }
+        }, diff_json_name)
+        LOGGER.info(f'diff with {len(added_sentences)} added and {len(old_sentences)} removed sentences '
+                    f'is written to {diff_json_name}')
+
+    elapsed_time = time.time() - start_time
+    LOGGER.info(f'{sentences_num} sentences and {len(nouns_and_stemmed)} nouns are written '
+                f'to {sentences_json_name} and {nouns_json_name} in {elapsed_time:.1f} seconds, '
+                f'{processed_sentences_num} sentences are processed, '
+                f'{sentences_num / max(elapsed_time, 1e-9):.0f} sentences per second')
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Builds language data files for agents from a text file')
+    PARSER.add_argument('text_file', help='input text file')
+    PARSER.add_argument('--sentences', default=os.path.join('data', 'language', 'sentences.json'),
+                        help='output json file with sentences and nouns')
+    PARSER.add_argument('--nouns', default=os.path.join('data', 'language', 'nouns.json'),
+                        help='output json file with nouns and their stemmed forms')
+    PARSER.add_argument('--processes', type=int, default=None, help='number of processes')
+    PARSER.add_argument('--chunk-size', type=int, default=1 << 20, help='size of a text chunk in bytes')
+    PARSER.add_argument('--batch-size', type=int, default=256, help='number of sentences in a batch')
+    PARSER.add_argument('--cache', default=None, help='json file with results of previous builds')
+    PARSER.add_argument('--diff', default=None, help='output json file with changes since the previous build')
+    PARSER.add_argument('--pack', default=None, help='output language pack compiled from the json files')
+    ARGS = PARSER.parse_args()
+
+    build_language_data(ARGS.text_file, ARGS.sentences, ARGS.nouns, ARGS.processes, ARGS.chunk_size, ARGS.batch_size,
+                        cache_json_name=ARGS.cache, diff_json_name=ARGS.diff)
+    if ARGS.pack:
+        language_pack.build_language_pack(ARGS.sentences, ARGS.nouns, ARGS.pack)
@@ -3,7 +3,7 @@ Module for reading and writing json files
 """
 
 import json
-from typing import Dict
+from typing import Dict, Any
 
 
 def read(file_name: str) -> Dict:
@@ -33,3 +33,38 @@ def write(data: 'JSON serializable', file_name: str) -> None:
     # json.dump is used instead of json.dumps because of Cyrillic letters
     with open(file_name, 'w', encoding='utf8') as json_file:
         json.dump(data, json_file, ensure_ascii=False, indent=4)
+
+
+class ObjectWriter:
+    """
+    Writes json object to file item by item without keeping the whole object in memory.
+    The output is the same as write() gives
+    """
+
+    def __init__(self, file_name: str):
+        """
+        :param file_name: name of a file to write
+        """
+        self.file_name = file_name
+        self.items_num = 0
+        self._file = None
+
+    def __enter__(self) -> 'ObjectWriter':
+        self._file = open(self.file_name, 'w', encoding='utf8')
+        self._file.write('{')
+        return self
+
+    def write(self, key: str, value: Any) -> None:
+        """
+        Writes one item of the object
+        :param key: key of the item
+        :param value: JSON serializable value of the item
+        :return: None
+        """
+        value_string = json.dumps(value, ensure_ascii=False, indent=4).replace('\n', '\n    ')
+        self._file.write(f'{"," if self.items_num else ""}\n    {json.dumps(key, ensure_ascii=False)}: {value_string}')
+        self.items_num += 1
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._file.write('\n}' if self.items_num else '}')
+        self._file.close()
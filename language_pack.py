@@ -0,0 +1,357 @@
+"""
+Module for compiling language data files into one binary pack
+that agents map into memory instead of parsing json files.
+
+The pack consists of a header and sections of little-endian arrays aligned by 8 bytes:
+sentences string table, sentences ids sorted by sentences, stems string table sorted by stems,
+postings of stems with ids of sentences and numbers of nouns with the stem in them,
+nouns string table with ids of their stems and nouns of each sentence
+"""
+
+import argparse
+import mmap
+import os.path
+import struct
+import sys
+import time
+from collections.abc import Mapping, Sequence
+from typing import Dict, List, Optional, Iterator, Tuple, Union
+
+import numpy
+
+import json_manager
+import logger
+import persistence
+
+LOGGER = logger.get_logger(__file__)
+
+MAGIC = b'REIPACK\0'
+VERSION = 1
+
+# names and types of arrays of sections in order of their appearance in the pack
+SECTIONS: List[Tuple[str, str]] = [
+    ('sentences offsets', '<u8'),
+    ('sentences', 'u1'),
+    ('sentences order', '<u4'),
+    ('stems offsets', '<u8'),
+    ('stems', 'u1'),
+    ('postings offsets', '<u8'),
+    ('postings sentences', '<u4'),
+    ('postings counts', '<u4'),
+    ('nouns offsets', '<u8'),
+    ('nouns', 'u1'),
+    ('nouns stems', '<u4'),
+    ('sentences nouns offsets', '<u8'),
+    ('sentences nouns', '<u4'),
+]
+
+# magic, version, number of sections and offset and size in bytes of each section
+HEADER = struct.Struct(f'<8sII{len(SECTIONS) * 2}Q')
+
+ALIGNMENT = 8
+
+
+def _make_string_table(strings: List[str]) -> Tuple[numpy.ndarray, bytes]:
+    """
+    Makes table of strings encoded in utf8 one after another
+    :param strings: strings
+    :return: offsets of strings with the end of the last one and encoded strings
+    """
+    encoded = [string.encode('utf8') for string in strings]
+    offsets = numpy.zeros(len(encoded) + 1, dtype='<u8')
+    numpy.cumsum([len(x) for x in encoded], out=offsets[1:])
+    return offsets, b''.join(encoded)
+
+
+def _as_sequence(array: numpy.ndarray) -> Union[memoryview, numpy.ndarray]:
+    """
+    Gets sequence of array items that are Python integers when they are indexed,
+    which is much faster than indexing numpy arrays by one item
+    :param array: array of unsigned integers from the pack
+    :return: memory view of the array or the array itself if byte order of the machine differs
+    """
+    if sys.byteorder != 'little':
+        return array
+    return memoryview(array).cast('B').cast(array.dtype.char)
+
+
+def build_language_pack(sentences_json_path: str, nouns_json_path: str, pack_path: str) -> None:
+    """
+    Compiles json files with sentences and nouns into the pack.
+    The pack is replaced atomically so running agents keep using the mapped old one
+    :param sentences_json_path: path to json with sentences and their nouns
+    :param nouns_json_path: path to json with nouns and their stemmed forms
+    :param pack_path: path of the pack to write
+    :return: None
+    """
+    start_time = time.perf_counter()
+    phrases_data: Dict[str, List[str]] = json_manager.read(sentences_json_path)
+    nouns_data: Dict[str, str] = json_manager.read(nouns_json_path)
+
+    sentences = list(phrases_data.keys())
+    nouns = list(nouns_data.keys())
+    # utf8 bytes are compared in the same order as code points
+    stems = sorted(set(nouns_data.values()), key=lambda x: x.encode('utf8'))
+    stems_ids = {stem: i for i, stem in enumerate(stems)}
+    nouns_ids = {noun: i for i, noun in enumerate(nouns)}
+
+    # postings are made in the same order as NounsFindingAgent makes them from json files
+    noun_sentences: Dict[str, List[int]] = dict()
+    for sentence_id, sentence_nouns in enumerate(phrases_data.values()):
+        for noun in sentence_nouns:
+            noun_sentences.setdefault(noun, list()).append(sentence_id)
+    stem_sentences: List[Dict[int, int]] = [dict() for _ in stems]
+    for noun, stemmed in nouns_data.items():
+        sentences_counts = stem_sentences[stems_ids[stemmed]]
+        for sentence_id in noun_sentences.get(noun, ()):
+            sentences_counts[sentence_id] = sentences_counts.get(sentence_id, 0) + 1
+
+    arrays = dict()
+    arrays['sentences offsets'], arrays['sentences'] = _make_string_table(sentences)
+    arrays['sentences order'] = numpy.array(sorted(range(len(sentences)), key=lambda i: sentences[i].encode('utf8')),
+                                            dtype='<u4')
+    arrays['stems offsets'], arrays['stems'] = _make_string_table(stems)
+    arrays['postings offsets'] = numpy.zeros(len(stems) + 1, dtype='<u8')
+    numpy.cumsum([len(x) for x in stem_sentences], out=arrays['postings offsets'][1:])
+    arrays['postings sentences'] = numpy.array([x for postings in stem_sentences for x in postings.keys()],
+                                               dtype='<u4')
+    arrays['postings counts'] = numpy.array([x for postings in stem_sentences for x in postings.values()],
+                                            dtype='<u4')
+    arrays['nouns offsets'], arrays['nouns'] = _make_string_table(nouns)
+    arrays['nouns stems'] = numpy.array([stems_ids[x] for x in nouns_data.values()], dtype='<u4')
+    # nouns that are not in nouns json are omitted as NounsFindingAgent can't find sentences by them anyway
+    sentences_nouns = [[nouns_ids[x] for x in sentence_nouns if x in nouns_ids]
+                       for sentence_nouns in phrases_data.values()]
+    arrays['sentences nouns offsets'] = numpy.zeros(len(sentences) + 1, dtype='<u8')
+    numpy.cumsum([len(x) for x in sentences_nouns], out=arrays['sentences nouns offsets'][1:])
+    arrays['sentences nouns'] = numpy.array([x for ids in sentences_nouns for x in ids], dtype='<u4')
+
+    chunks = list()
+    positions = list()
+    position = HEADER.size
+    for name, dtype in SECTIONS:
+        data = arrays[name] if isinstance(arrays[name], bytes) else arrays[name].astype(dtype).tobytes()
+        padding = -position % ALIGNMENT
+        chunks.append(b'\0' * padding + data)
+        position += padding
+        positions.extend((position, len(data)))
+        position += len(data)
+
+    persistence.replace_file(pack_path, HEADER.pack(MAGIC, VERSION, len(SECTIONS), *positions) + b''.join(chunks))
+    LOGGER.info(f'{len(sentences)} sentences, {len(stems)} stems and {len(nouns)} nouns '
+                f'are written to {pack_path} in {time.perf_counter() - start_time:.1f} seconds')
+
+
+class StringTable(Sequence):
+    """
+    Strings of the pack that are decoded only when they are accessed
+    """
+
+    def __init__(self, buffer: mmap.mmap, offsets: numpy.ndarray, strings_offset: int,
+                 order: Optional[numpy.ndarray] = None):
+        """
+        :param buffer: mapped pack
+        :param offsets: offsets of strings with the end of the last one
+        :param strings_offset: offset of the strings section in the pack
+        :param order: ids of strings sorted by strings, the strings are sorted themselves if it's None
+        """
+        self._buffer = buffer
+        self._offsets = _as_sequence(offsets)
+        self._strings_offset = strings_offset
+        self._order = None if order is None else _as_sequence(order)
+        self._length = len(offsets) - 1
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _get_bytes(self, index: int) -> bytes:
+        return self._buffer[self._strings_offset + self._offsets[index]:
+                            self._strings_offset + self._offsets[index + 1]]
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if not -self._length <= index < self._length:
+            raise IndexError(f'string index {index} is out of range')
+        return self._get_bytes(index % self._length).decode('utf8')
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(self._length):
+            yield self._get_bytes(index).decode('utf8')
+
+    def find(self, string: str) -> Optional[int]:
+        """
+        Finds index of a string by binary search
+        :param string: string to find
+        :return: index or None if there is no such string
+        """
+        key = string.encode('utf8')
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            index = middle if self._order is None else self._order[middle]
+            if self._get_bytes(index) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < len(self):
+            index = low if self._order is None else self._order[low]
+            if self._get_bytes(index) == key:
+                return index
+        return None
+
+
+class StringIds(Mapping):
+    """
+    Ids of strings of a string table by strings
+    """
+
+    def __init__(self, table: StringTable):
+        """
+        :param table: table with ordered strings
+        """
+        self._table = table
+
+    def __getitem__(self, string: str) -> int:
+        index = self._table.find(string) if isinstance(string, str) else None
+        if index is None:
+            raise KeyError(string)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._table)
+
+
+class StemPostings(Mapping):
+    """
+    Ids of sentences with numbers of nouns with a stem in them by stems,
+    only stems that are found in sentences are contained
+    """
+
+    def __init__(self, stems: StringTable, offsets: numpy.ndarray, sentences: numpy.ndarray, counts: numpy.ndarray):
+        """
+        :param stems: table of sorted stems
+        :param offsets: offsets of postings of each stem with the end of the last ones
+        :param sentences: ids of sentences of all postings
+        :param counts: numbers of nouns of all postings
+        """
+        self._stems = stems
+        self._offsets = _as_sequence(offsets)
+        self._sentences = sentences
+        self._counts = counts
+
+    def _find(self, stem: str) -> Optional[Tuple[int, int]]:
+        index = self._stems.find(stem) if isinstance(stem, str) else None
+        if index is None or self._offsets[index] == self._offsets[index + 1]:
+            return None
+        return self._offsets[index], self._offsets[index + 1]
+
+    def __getitem__(self, stem: str) -> Dict[int, int]:
+        bounds = self._find(stem)
+        if bounds is None:
+            raise KeyError(stem)
+        start, end = bounds
+        return dict(zip(self._sentences[start:end].tolist(), self._counts[start:end].tolist()))
+
+    def __contains__(self, stem: str) -> bool:
+        return self._find(stem) is not None
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __iter__(self) -> Iterator[str]:
+        for index, stem in enumerate(self._stems):
+            if self._offsets[index] != self._offsets[index + 1]:
+                yield stem
+
+
+class LanguagePack:
+    """
+    Language data mapped into memory from the pack, so loading takes only reading of the header
+    and memory pages of the pack are shared by all processes that use it
+    """
+
+    def __init__(self, pack_path: str):
+        """
+        :param pack_path: path to the pack made by build_language_pack()
+        """
+        self.pack_path = pack_path
+        with open(pack_path, 'rb') as pack_file:
+            self._buffer = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # the pack is checked before any array refers to the map, so the map can be closed on every failure
+        try:
+            positions = self._read_positions()
+        except ValueError:
+            self._buffer.close()
+            raise
+
+        self._offsets: Dict[str, int] = dict()
+        arrays: Dict[str, numpy.ndarray] = dict()
+        for i, (name, dtype) in enumerate(SECTIONS):
+            offset, size = positions[2 * i], positions[2 * i + 1]
+            self._offsets[name] = offset
+            arrays[name] = numpy.frombuffer(self._buffer, dtype, size // numpy.dtype(dtype).itemsize, offset)
+        self._arrays = arrays
+
+        self.sentences = StringTable(self._buffer, arrays['sentences offsets'], self._offsets['sentences'],
+                                     arrays['sentences order'])
+        self.sentences_ids = StringIds(self.sentences)
+        self.stems = StringTable(self._buffer, arrays['stems offsets'], self._offsets['stems'])
+        self.stem_sentences = StemPostings(self.stems, arrays['postings offsets'],
+                                           arrays['postings sentences'], arrays['postings counts'])
+        self.nouns = StringTable(self._buffer, arrays['nouns offsets'], self._offsets['nouns'])
+
+    def _read_positions(self) -> List[int]:
+        """
+        Reads offsets and sizes of sections from the header and checks that they are inside the pack
+        :return: offset and size in bytes of each section
+        """
+        if len(self._buffer) < HEADER.size:
+            raise ValueError(f'{self.pack_path} is truncated, its size is less than the header size')
+
+        magic, version, sections_num, *positions = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC or version != VERSION or sections_num != len(SECTIONS):
+            raise ValueError(f'{self.pack_path} is not a language pack of version {VERSION}')
+
+        for i, (name, _) in enumerate(SECTIONS):
+            if positions[2 * i] + positions[2 * i + 1] > len(self._buffer):
+                raise ValueError(f'{self.pack_path} is truncated, section {name} is out of it')
+
+        return positions
+
+    def read_nouns_stems(self) -> Dict[str, str]:
+        """
+        Reads nouns with their stemmed forms as they are in nouns json
+        :return: nouns and stems
+        """
+        stems = list(self.stems)
+        return {noun: stems[stem_id] for noun, stem_id in zip(self.nouns, self._arrays['nouns stems'].tolist())}
+
+    def read_sentences_nouns(self) -> Dict[str, List[str]]:
+        """
+        Reads sentences with their nouns as they are in sentences json
+        :return: sentences and nouns
+        """
+        nouns = list(self.nouns)
+        offsets = self._arrays['sentences nouns offsets'].tolist()
+        sentences_nouns = self._arrays['sentences nouns'].tolist()
+        return {sentence: [nouns[x] for x in sentences_nouns[offsets[i]:offsets[i + 1]]]
+                for i, sentence in enumerate(self.sentences)}
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Compiles language data files for agents into one binary pack')
+    PARSER.add_argument('--sentences', default=os.path.join('data', 'language', 'sentences.json'),
+                        help='json file with sentences and nouns')
+    PARSER.add_argument('--nouns', default=os.path.join('data', 'language', 'nouns.json'),
+                        help='json file with nouns and their stemmed forms')
+    PARSER.add_argument('--output', default=os.path.join('data', 'language', 'language.pack'),
+                        help='output pack file')
+    ARGS = PARSER.parse_args()
+
+    build_language_pack(ARGS.sentences, ARGS.nouns, ARGS.output)
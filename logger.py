@@ -4,14 +4,29 @@ Module for logging
 import logging
 from logging.handlers import TimedRotatingFileHandler
 from logging import Logger
+import os
 import os.path
 
 # Path to write
 LOG_FOLDER_PATH = os.path.join('data', 'logs')
 LOG_FILE_PATH = os.path.join(LOG_FOLDER_PATH, 'logs.txt')
 
-if not os.path.isfile(LOG_FILE_PATH):
-    os.mkdir(LOG_FOLDER_PATH)
+
+class LazyFileHandler(TimedRotatingFileHandler):
+    """
+    File handler that creates the log folder and opens the file only when the first message is written,
+    so importing modules doesn't touch the file system
+    """
+
+    def __init__(self, file_name: str):
+        """
+        :param file_name: path of the log file
+        """
+        super().__init__(file_name, when='midnight', interval=1, backupCount=1, delay=True)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
 
 
 def get_logger(tag: str) -> Logger:
@@ -23,13 +38,16 @@ def get_logger(tag: str) -> Logger:
     """
 
     logger = logging.getLogger(tag)
+    # handlers are added only once for a tag
+    if logger.handlers:
+        return logger
+
     logger.setLevel(logging.DEBUG)
     # create console handler which logs even debug messages
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.DEBUG)
     # create file handler which logs info messages
-    file_handler = TimedRotatingFileHandler(LOG_FILE_PATH,
-                                            when='midnight', interval=1, backupCount=1)
+    file_handler = LazyFileHandler(LOG_FILE_PATH)
     file_handler.setLevel(logging.INFO)
     # create formatter and add it to the handlers
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - ' + tag + ': %(message)s')
@@ -1,13 +1,15 @@
 """Module for operating on telegram messages"""
 
-from typing import Set
+import threading
+import time
+from collections import OrderedDict
+from typing import Set, Tuple, Optional, Callable, List
 
 from telebot.types import Message
 
 import logger
 
 LOGGER = logger.get_logger(__file__)
-CURRENT_GRADING_MESSAGE = None
 
 
 class GradableMessage:
@@ -15,24 +17,49 @@ class GradableMessage:
     For storing information about grading message which is used for agent learning
     """
 
-    # attribute that represents 'grade' of the reply on message
-    # based on ratio of likes and dislikes
-    _grade: int = 0
+    # many messages are kept at once so they don't have attributes dictionaries
+    __slots__ = ('_grade', '_change_difference', '_likes_num', '_dislikes_num',
+                 '_users_liked', '_users_disliked', 'chat_id', 'message_id', 'reply_message',
+                 'input_message', 'shown_votes', 'keyboard_update_pending',
+                 'patterns', '_pending_rating_change', 'last_vote_time', 'learning_pending')
 
-    # 1 if grade was increased -1 otherwise
-    _change_difference: [-1, 1] = 0
+    def __init__(self, message: Message, input_message: str, patterns: List[str]):
+        """
+        :param message: message that the bot sent
+        :param input_message: text of the message that the bot replied to
+        :param patterns: patterns of the input message that are learned with votes,
+        they are kept instead of the analysis of the input message that takes much more memory
+        """
+        # attribute that represents 'grade' of the reply on message
+        # based on ratio of likes and dislikes
+        self._grade: int = 0
+
+        # 1 if grade was increased -1 otherwise
+        self._change_difference: [-1, 1] = 0
 
-    _likes_num: int = 0
-    _dislikes_num: int = 0
+        self._likes_num: int = 0
+        self._dislikes_num: int = 0
 
-    def __init__(self, message: Message, input_message: str):
         self._users_liked: Set[int] = set()
         self._users_disliked: Set[int] = set()
         # message that bot sent
-        self.message = message
+        self.chat_id: int = message.chat.id
+        self.message_id: int = message.message_id
         self.reply_message = message.text
         # message that bot received
         self.input_message = input_message
+        # numbers of likes and dislikes shown on the keyboard of the message
+        self.shown_votes: Tuple[int, int] = (0, 0)
+        # True while the keyboard is going to be updated
+        self.keyboard_update_pending = False
+
+        # patterns of the input message that are learned on each vote
+        self.patterns = patterns
+        # sum of grade changes that are not learned yet
+        self._pending_rating_change: int = 0
+        self.last_vote_time: float = 0
+        # True while votes are going to be learned
+        self.learning_pending = False
 
     def _update_likes_num(self, user_id):
         if user_id in self._users_liked:
@@ -109,3 +136,117 @@ class GradableMessage:
         :return: change sign
         """
         return self._change_difference
+
+    def add_rating_change(self) -> None:
+        """
+        Adds the last change of the grade to changes that are not learned yet
+        :return: None
+        """
+        self._pending_rating_change += self._change_difference
+        self.last_vote_time = time.time()
+
+    def take_rating_change(self) -> int:
+        """
+        Takes sum of grade changes that are not learned yet, so they are learned only once
+        :return: net rating change, 0 if votes cancelled each other
+        """
+        rating_change = self._pending_rating_change
+        self._pending_rating_change = 0
+        return rating_change
+
+
+class GradingRegistry:
+    """
+    Registry of messages that can be graded identified by chat ids and message ids.
+    Number of the messages is limited and the least recently voted ones are removed first,
+    messages that were not voted for too long are removed as well
+    """
+
+    def __init__(self, max_size: int = 1000, lifetime: float = 24 * 60 * 60,
+                 on_removal: Optional[Callable[[GradableMessage], None]] = None):
+        """
+        :param max_size: maximum number of messages
+        :param lifetime: [seconds] period after the last vote or adding when a message can be graded
+        :param on_removal: function that is called for each message that stops being gradable
+        """
+        self.max_size = max_size
+        self.lifetime = lifetime
+        self._on_removal = on_removal
+
+        # (chat id, message id) as keys and messages with time of the last access as values
+        # from the least recently accessed to the most recently accessed
+        self._messages: OrderedDict = OrderedDict()
+        # messages are added from the event loop and voted from the processing thread
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def _remove_old(self, now: float) -> None:
+        """
+        Removes expired messages and ones that exceed maximum number
+        :param now: current time
+        :return: None
+        """
+        while self._messages:
+            grading_message, access_time = next(iter(self._messages.values()))
+            if len(self._messages) <= self.max_size and now - access_time <= self.lifetime:
+                break
+
+            self._messages.popitem(last=False)
+            if self._on_removal:
+                self._on_removal(grading_message)
+
+    def add(self, grading_message: GradableMessage) -> None:
+        """
+        Makes message gradable
+        :param grading_message: message to add
+        :return: None
+        """
+        now = time.time()
+        with self._lock:
+            key = grading_message.chat_id, grading_message.message_id
+            self._messages[key] = grading_message, now
+            self._messages.move_to_end(key)
+            self._remove_old(now)
+
+    def get(self, chat_id: int, message_id: int) -> Optional[GradableMessage]:
+        """
+        Gets gradable message and marks it as recently accessed
+        :param chat_id: id of a chat
+        :param message_id: id of the message in the chat
+        :return: message or None if it's not gradable
+        """
+        now = time.time()
+        with self._lock:
+            self._remove_old(now)
+
+            key = chat_id, message_id
+            if key not in self._messages:
+                return None
+
+            grading_message, _ = self._messages[key]
+            self._messages[key] = grading_message, now
+            self._messages.move_to_end(key)
+            return grading_message
+
+    def clear(self) -> None:
+        """
+        Removes all messages
+        :return: None
+        """
+        with self._lock:
+            while self._messages:
+                grading_message, _ = self._messages.popitem(last=False)[1]
+                if self._on_removal:
+                    self._on_removal(grading_message)
+
+    def contains(self, grading_message: GradableMessage) -> bool:
+        """
+        Checks if message is still gradable without marking it as accessed
+        :param grading_message: message to check
+        :return: True if the message is gradable else False
+        """
+        with self._lock:
+            entry = self._messages.get((grading_message.chat_id, grading_message.message_id))
+            return entry is not None and entry[0] is grading_message
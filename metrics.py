@@ -0,0 +1,210 @@
+"""
+Module for collecting metrics of the bot and exposing them in Prometheus text format
+"""
+
+from bisect import bisect_left
+from typing import List, Dict, Tuple, Callable, Iterable
+
+# content type of Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# [seconds] default buckets of latency histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple, extra: str = '') -> str:
+    """
+    Formats labels of a sample
+    :param label_names: names of labels
+    :param label_values: values of labels
+    :param extra: additional formatted label
+    :return: labels in braces or empty string if there are no labels
+    """
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """
+    Collection of metrics that are exposed together
+    """
+
+    def __init__(self):
+        self._metrics: List['Metric'] = list()
+
+    def register(self, metric: 'Metric') -> None:
+        """
+        Adds metric to the registry
+        :param metric: metric to add
+        :return: None
+        """
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        """
+        Formats all metrics in Prometheus text format
+        :return: text with metrics
+        """
+        return ''.join(metric.render() for metric in self._metrics)
+
+
+# registry of all metrics of the bot
+REGISTRY = Registry()
+
+
+class Metric:
+    """
+    Base class of metrics.
+    Values are changed without locks, so collecting costs only a few dictionary operations
+    """
+
+    _type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = (), registry: Registry = REGISTRY):
+        """
+        :param name: name of the metric
+        :param documentation: description of the metric
+        :param label_names: names of labels that samples of the metric have
+        :param registry: registry the metric is exposed in
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        registry.register(self)
+
+    def _render_samples(self) -> Iterable[str]:
+        return ()
+
+    def render(self) -> str:
+        """
+        Formats the metric in Prometheus text format
+        :return: text with the metric
+        """
+        return f'# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self._type}\n' \
+            + ''.join(f'{line}\n' for line in self._render_samples())
+
+
+class Counter(Metric):
+    """
+    Value that only increases
+    """
+
+    _type = 'counter'
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = (), registry: Registry = REGISTRY):
+        super().__init__(name, documentation, label_names, registry)
+        self._values: Dict[Tuple, float] = dict()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        """
+        Increases the value
+        :param label_values: values of labels in order of their names
+        :param amount: how much the value is increased
+        :return: None
+        """
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values) -> float:
+        """
+        Gets the value
+        :param label_values: values of labels in order of their names
+        :return: value
+        """
+        return self._values.get(label_values, 0)
+
+    def _render_samples(self) -> Iterable[str]:
+        for label_values, value in list(self._values.items()):
+            yield f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}'
+
+
+class Gauge(Metric):
+    """
+    Value that is got by calling a function when metrics are rendered,
+    so it costs nothing while nobody asks for it
+    """
+
+    _type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float], registry: Registry = REGISTRY,
+                 is_counter: bool = False):
+        """
+        :param name: name of the metric
+        :param documentation: description of the metric
+        :param function: function that gives the current value
+        :param registry: registry the metric is exposed in
+        :param is_counter: True if the value only increases
+        """
+        super().__init__(name, documentation, (), registry)
+        self._function = function
+        if is_counter:
+            self._type = 'counter'
+
+    def _render_samples(self) -> Iterable[str]:
+        yield f'{self.name} {_format_value(self._function())}'
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values by buckets
+    """
+
+    _type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Iterable[float] = LATENCY_BUCKETS,
+                 label_names: Iterable[str] = (), registry: Registry = REGISTRY):
+        """
+        :param name: name of the metric
+        :param documentation: description of the metric
+        :param buckets: upper bounds of buckets
+        :param label_names: names of labels that samples of the metric have
+        :param registry: registry the metric is exposed in
+        """
+        super().__init__(name, documentation, label_names, registry)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # label values as keys and lists of counts in buckets, sum and count of values as values
+        self._values: Dict[Tuple, List[float]] = dict()
+
+    def observe(self, value: float, *label_values) -> None:
+        """
+        Adds observed value
+        :param value: observed value
+        :param label_values: values of labels in order of their names
+        :return: None
+        """
+        values = self._values.get(label_values)
+        if values is None:
+            values = self._values[label_values] = [0] * (len(self.buckets) + 2)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def get_count(self, *label_values) -> int:
+        """
+        Gets number of observed values
+        :param label_values: values of labels in order of their names
+        :return: number of values
+        """
+        return self._values.get(label_values, [0])[-1]
+
+    def _render_samples(self) -> Iterable[str]:
+        for label_values, values in list(self._values.items()):
+            cumulative_count = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative_count += count
+                labels = _format_labels(self.label_names, label_values, f'le="{_format_value(bound)}"')
+                yield f'{self.name}_bucket{labels} {cumulative_count}'
+            labels = _format_labels(self.label_names, label_values)
+            yield f'{self.name}_sum{labels} {_format_value(values[-2])}'
+            yield f'{self.name}_count{labels} {values[-1]}'
@@ -0,0 +1,917 @@
+"""
+Module for persisting knowledge bases of learning agents
+"""
+
+import atexit
+import hashlib
+import heapq
+from array import array
+import json
+import os
+import os.path
+import signal
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, Optional, Callable, List, Iterable, Iterator, Tuple
+
+import logger
+
+LOGGER = logger.get_logger(__file__)
+
+# all started background flushers for draining them on exit
+_FLUSHERS: List['BackgroundFlusher'] = list()
+
+# set when the process receives SIGTERM, long loops of the main thread stop when it's set
+TERMINATION_REQUESTED = threading.Event()
+
+
+def replace_file(file_name: str, content: bytes) -> None:
+    """
+    Atomically replaces file content by writing it to a temporary file
+    and renaming it, so the file is never left truncated
+    :param file_name: name of a file to write
+    :param content: new content of the file
+    :return: None
+    """
+    temp_file_name = file_name + '.tmp'
+    with open(temp_file_name, 'wb') as temp_file:
+        temp_file.write(content)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.replace(temp_file_name, file_name)
+
+
+def write_json(data: 'JSON serializable', file_name: str, indent: Optional[int] = 4) -> str:
+    """
+    Atomically writes to json file
+    :param data: data to write
+    :param file_name: name of a file to write
+    :param indent: indentation of the json or None for writing it in one line
+    :return: hex digest of the written content
+    """
+    content = json.dumps(data, ensure_ascii=False, indent=indent).encode('utf8')
+    replace_file(file_name, content)
+    return hashlib.sha1(content).hexdigest()
+
+
+def get_file_hash(file_name: str) -> Optional[str]:
+    """
+    Gets hash of file content
+    :param file_name: name of a file
+    :return: hex digest of the content or None if there is no such file
+    """
+    if not os.path.isfile(file_name):
+        return None
+
+    with open(file_name, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+class CompactionPolicy:
+    """
+    Rules of removing knowledge that doesn't affect replies or is used too rarely to be kept
+    """
+
+    def __init__(self, drop_zero: bool = True, max_replies: Optional[int] = None, max_patterns: Optional[int] = None,
+                 is_known_reply: Optional[Callable[[str], bool]] = None):
+        """
+        :param drop_zero: if True then replies with zero rating are removed
+        :param max_replies: maximum number of replies of a pattern, ones with the least absolute ratings are removed
+        :param max_patterns: maximum number of patterns, the least recently used ones are removed,
+        from equally recently used ones the least used are removed first
+        :param is_known_reply: function that checks if a reply can be given, other ones are removed if it's given
+        """
+        self.drop_zero = drop_zero
+        self.max_replies = max_replies
+        self.max_patterns = max_patterns
+        self.is_known_reply = is_known_reply
+
+    def filter_ratings(self, ratings: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        """
+        Removes ratings of a pattern that should not be kept
+        :param ratings: replies and their ratings
+        :return: kept replies and ratings in the same order
+        """
+        if self.drop_zero:
+            ratings = [(reply, rating) for reply, rating in ratings if rating != 0]
+        if self.is_known_reply:
+            ratings = [(reply, rating) for reply, rating in ratings if self.is_known_reply(reply)]
+        if self.max_replies and len(ratings) > self.max_replies:
+            kept = set(sorted(range(len(ratings)), key=lambda i: -abs(ratings[i][1]))[:self.max_replies])
+            ratings = [x for i, x in enumerate(ratings) if i in kept]
+        return ratings
+
+
+class RatedKnowledgeBase:
+    """
+    Knowledge base of rating learning agent where each reply text is stored once in a shared table
+    and patterns have compact arrays of ids of their replies and ratings sorted by ratings in descending order
+    """
+
+    def __init__(self, data: Optional[Dict] = None):
+        """
+        :param data: knowledge base read from json file, either with "replies" table
+        and "patterns" with lists of replies ids and ratings
+        or with patterns and dictionaries of replies and ratings
+        """
+        # replies are identified by their indices in this list
+        self._replies: List[str] = list()
+        self._replies_ids: Dict[str, int] = dict()
+
+        # patterns with arrays of replies ids followed by their ratings, pairs are sorted by ratings
+        self._patterns: Dict[str, array] = dict()
+
+        # patterns with time when they were found or learned the last time and number of such times,
+        # every pattern has them so using patterns doesn't change size of the dictionary
+        self._usage: Dict[str, array] = dict()
+
+        data = data or dict()
+        if isinstance(data.get('replies'), list):
+            self._replies = data['replies']
+            self._replies_ids = {reply: i for i, reply in enumerate(self._replies)}
+            self._patterns = {pattern: self._sort_ratings(ratings) for pattern, ratings in data['patterns'].items()}
+            usage = data.get('usage', dict())
+            self._usage = {pattern: array('q', usage.get(pattern, (0, 0))) for pattern in self._patterns}
+        else:
+            for pattern, knowledge in data.items():
+                for reply, rating in knowledge.items():
+                    self.add_rating(pattern, reply, rating)
+
+    @staticmethod
+    def _sort_ratings(ratings: List[int]) -> array:
+        """
+        Makes array of replies ids and ratings sorted by ratings in descending order
+        :param ratings: list of replies ids followed by their ratings
+        :return: sorted array
+        """
+        values = ratings[1::2]
+        # knowledge bases written since ratings are sorted don't need sorting
+        if all(x >= y for x, y in zip(values, values[1:])):
+            return array('q', ratings)
+        pairs = sorted(zip(ratings[0::2], values), key=lambda x: -x[1])
+        return array('q', [x for pair in pairs for x in pair])
+
+    @staticmethod
+    def _move_rating(ratings: array, position: int, rating: int) -> None:
+        """
+        Sets rating of reply and moves the reply so ratings stay sorted in descending order.
+        The array is changed by one assignment that doesn't change its length,
+        so it can be read without lock meanwhile
+        :param ratings: array of replies ids followed by their ratings
+        :param position: index of the reply id in the array
+        :param rating: new rating of the reply
+        :return: None
+        """
+        reply_id = ratings[position]
+
+        start = position
+        while start > 0 and ratings[start - 1] < rating:
+            start -= 2
+        end = position
+        while end + 2 < len(ratings) and ratings[end + 3] > rating:
+            end += 2
+
+        if start < position:
+            ratings[start:position + 2] = array('q', (reply_id, rating)) + ratings[start:position]
+        elif end > position:
+            ratings[position:end + 2] = ratings[position + 2:end + 2] + array('q', (reply_id, rating))
+        else:
+            ratings[position + 1] = rating
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def __contains__(self, pattern: str) -> bool:
+        return pattern in self._patterns
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._patterns)
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, int]]]:
+        """
+        Gets patterns with their replies and ratings
+        :return: patterns and dictionaries with replies and ratings
+        """
+        for pattern in self._patterns:
+            yield pattern, self.get_ratings([pattern])
+
+    def _get_reply_id(self, reply: str) -> int:
+        """
+        Gets id of reply adding it to the replies table if it's not there yet
+        :param reply: reply text
+        :return: id of the reply
+        """
+        reply_id = self._replies_ids.get(reply)
+        if reply_id is None:
+            reply_id = len(self._replies)
+            self._replies.append(reply)
+            self._replies_ids[reply] = reply_id
+        return reply_id
+
+    def _set_ratings(self, pattern: str, ratings: List[Tuple[str, int]], usage: array) -> None:
+        """
+        Sets replies and ratings of pattern, so its array takes no more memory than needed
+        :param pattern: pattern
+        :param ratings: replies and their ratings
+        :param usage: array with time when the pattern was used the last time and number of uses
+        :return: None
+        """
+        self._usage[pattern] = usage
+        self._patterns[pattern] = array('q', [x for reply, rating in sorted(ratings, key=lambda x: -x[1])
+                                              for x in (self._get_reply_id(reply), rating)])
+
+    def add_rating(self, pattern: str, reply: str, rating_change: int) -> int:
+        """
+        Changes rating of reply for pattern
+        :param pattern: pattern
+        :param reply: reply text
+        :param rating_change: how much rating should be changed
+        :return: new rating
+        """
+        reply_id = self._get_reply_id(reply)
+
+        if pattern not in self._patterns:
+            self._usage[pattern] = array('q', (0, 0))
+            self._patterns[pattern] = array('q')
+        ratings = self._patterns[pattern]
+
+        for i in range(0, len(ratings), 2):
+            if ratings[i] == reply_id:
+                rating = ratings[i + 1] + rating_change
+                self._move_rating(ratings, i, rating)
+                return rating
+
+        ratings.extend((reply_id, rating_change))
+        self._move_rating(ratings, len(ratings) - 2, rating_change)
+        return rating_change
+
+    def get_ratings(self, patterns: Iterable[str]) -> Dict[str, int]:
+        """
+        Gets replies of patterns with ratings summed up over the patterns
+        :param patterns: known patterns
+        :return: replies and their summed ratings
+        """
+        replies_ratings: Dict[int, int] = dict()
+        for pattern in patterns:
+            ratings = self._patterns.get(pattern)
+            # the pattern was removed by compaction after it was found
+            if ratings is None:
+                continue
+            for i in range(0, len(ratings), 2):
+                replies_ratings[ratings[i]] = replies_ratings.get(ratings[i], 0) + ratings[i + 1]
+
+        # texts are got only for found replies
+        return {self._replies[reply_id]: rating for reply_id, rating in replies_ratings.items()}
+
+    def get_top_ratings(self, patterns: Iterable[str],
+                        k: Optional[int] = None) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """
+        Gets k replies of patterns with the highest non-negative ratings summed up over the patterns
+        and all replies with negative summed ratings.
+        Arrays of the patterns are read in parallel from their highest ratings
+        until replies that aren't read yet can't have higher rating than the k-th found one
+        :param patterns: known patterns
+        :param k: maximum number of replies with non-negative rating, all of them are got if it's None
+        :return: replies with the highest non-negative ratings and replies with negative ratings
+        """
+        if not k:
+            replies_ratings = self.get_ratings(patterns)
+            return {reply: rating for reply, rating in replies_ratings.items() if rating >= 0}, \
+                {reply: rating for reply, rating in replies_ratings.items() if rating < 0}
+
+        # patterns removed by compaction after they were found are omitted
+        postings = [ratings for ratings in map(self._patterns.get, patterns) if ratings]
+        # ratings of arrays are put into dictionaries for looking them up only when they are needed
+        postings_ratings: List[Optional[Dict[int, int]]] = [None] * len(postings)
+
+        def get_rating(reply_id: int) -> int:
+            rating = 0
+            for j, ratings in enumerate(postings):
+                if postings_ratings[j] is None:
+                    postings_ratings[j] = dict(zip(ratings[0::2], ratings[1::2]))
+                rating += postings_ratings[j].get(reply_id, 0)
+            return rating
+
+        # read replies ids with their summed ratings
+        read_ratings: Dict[int, int] = dict()
+        # k read replies with the highest ratings as heap of ratings and replies ids
+        top: List[Tuple[int, int]] = list()
+
+        position = 0
+        while True:
+            # the highest rating that a reply which isn't read yet can have
+            threshold = 0
+            non_negative_left = False
+            for ratings in postings:
+                if position >= len(ratings):
+                    continue
+                reply_id, rating = ratings[position], ratings[position + 1]
+                if rating >= 0:
+                    threshold += rating
+                    non_negative_left = True
+
+                if reply_id in read_ratings:
+                    continue
+                rating = rating if len(postings) == 1 else get_rating(reply_id)
+                read_ratings[reply_id] = rating
+                if rating < 0:
+                    continue
+                if len(top) < k:
+                    heapq.heappush(top, (rating, reply_id))
+                elif rating > top[0][0]:
+                    heapq.heapreplace(top, (rating, reply_id))
+            position += 2
+
+            if not non_negative_left or len(top) == k and top[0][0] >= threshold:
+                break
+
+        # a reply has negative summed rating only if it has negative rating for one of patterns
+        negative_ratings: Dict[int, int] = dict()
+        for ratings in postings:
+            for i in range(len(ratings) - 2, -1, -2):
+                reply_id, rating = ratings[i], ratings[i + 1]
+                if rating >= 0:
+                    break
+                if reply_id not in read_ratings:
+                    read_ratings[reply_id] = rating if len(postings) == 1 else get_rating(reply_id)
+                if read_ratings[reply_id] < 0:
+                    negative_ratings[reply_id] = read_ratings[reply_id]
+
+        return {self._replies[reply_id]: rating for rating, reply_id in sorted(top, reverse=True)}, \
+            {self._replies[reply_id]: rating for reply_id, rating in negative_ratings.items()}
+
+    def to_json(self) -> Dict:
+        """
+        Gets knowledge base as json serializable data
+        :return: replies table and patterns with lists of replies ids and ratings
+        """
+        return {
+            'replies': self._replies,
+            'patterns': {pattern: ratings.tolist() for pattern, ratings in self._patterns.items()},
+            'usage': {pattern: usage.tolist() for pattern, usage in self._usage.items()}
+        }
+
+    def mark_used(self, patterns: Iterable[str]) -> None:
+        """
+        Remembers that patterns were found or learned now
+        :param patterns: known patterns
+        :return: None
+        """
+        now = int(time.time())
+        for pattern in patterns:
+            usage = self._usage.get(pattern)
+            if usage is not None:
+                usage[0] = now
+                usage[1] += 1
+
+    def get_size(self) -> int:
+        """
+        Estimates memory taken by the knowledge base
+        :return: [bytes] size of patterns, replies and their arrays
+        """
+        # patterns are copied at once because they can be learned meanwhile
+        return sum(sys.getsizeof(pattern) + sys.getsizeof(ratings) + sys.getsizeof(self._usage[pattern])
+                   for pattern, ratings in list(self._patterns.items())) \
+            + sum(sys.getsizeof(reply) for reply in self._replies)
+
+    def get_replies_num(self) -> int:
+        """
+        Gets number of replies in the replies table
+        :return: number of replies
+        """
+        return len(self._replies)
+
+    def get_ratings_num(self) -> int:
+        """
+        Gets number of rated replies of all patterns
+        :return: number of ratings
+        """
+        return sum(len(ratings) for ratings in list(self._patterns.values())) // 2
+
+    def _filter_ratings(self, pattern: str, policy: CompactionPolicy) -> List[Tuple[str, int]]:
+        """
+        Gets replies and ratings of pattern that should be kept by the policy
+        :param pattern: known pattern
+        :param policy: rules of removing knowledge
+        :return: kept replies and ratings
+        """
+        # the array is copied at once because it can be changed by learning meanwhile
+        ratings = self._patterns[pattern].tolist()
+        return policy.filter_ratings([(self._replies[ratings[i]], ratings[i + 1]) for i in range(0, len(ratings), 2)])
+
+    def compact(self, policy: CompactionPolicy) -> 'RatedKnowledgeBase':
+        """
+        Makes knowledge base without knowledge that should be removed by the policy,
+        the knowledge base itself is not changed so it can be used while the new one is made.
+        Patterns that are learned meanwhile should be merged into the compacted knowledge base
+        by merge_patterns() because their knowledge can be read partially changed
+        :param policy: rules of removing knowledge
+        :return: compacted knowledge base
+        """
+        kept_ratings: Dict[str, List[Tuple[str, int]]] = dict()
+        for pattern in list(self._patterns):
+            pattern_ratings = self._filter_ratings(pattern, policy)
+            if pattern_ratings:
+                kept_ratings[pattern] = pattern_ratings
+
+        if policy.max_patterns and len(kept_ratings) > policy.max_patterns:
+            evicted = sorted(kept_ratings, key=lambda x: tuple(self._usage[x]))[:-policy.max_patterns]
+            for pattern in evicted:
+                del kept_ratings[pattern]
+
+        knowledge_base = RatedKnowledgeBase()
+        for pattern, pattern_ratings in kept_ratings.items():
+            # usage arrays are shared so patterns found meanwhile are marked used in both knowledge bases
+            knowledge_base._set_ratings(pattern, pattern_ratings, self._usage[pattern])
+        return knowledge_base
+
+    def merge_patterns(self, knowledge_base: 'RatedKnowledgeBase', patterns: Iterable[str],
+                       policy: CompactionPolicy) -> None:
+        """
+        Replaces knowledge of patterns by their knowledge from another knowledge base kept by the policy
+        :param knowledge_base: knowledge base that has the patterns
+        :param patterns: patterns to replace
+        :param policy: rules of removing knowledge
+        :return: None
+        """
+        for pattern in patterns:
+            self._patterns.pop(pattern, None)
+            self._usage.pop(pattern, None)
+            if pattern not in knowledge_base:
+                continue
+
+            pattern_ratings = knowledge_base._filter_ratings(pattern, policy)
+            if pattern_ratings:
+                self._set_ratings(pattern, pattern_ratings, knowledge_base._usage[pattern])
+
+
+class KnowledgeJournal:
+    """
+    Append-only journal of rating changes made on top of a knowledge base snapshot.
+    Each learned rating change is appended as one line
+    and the journal is periodically compacted into the snapshot
+    """
+
+    def __init__(self, snapshot_file_name: str, compaction_period: int = 1000):
+        """
+        :param snapshot_file_name: name of a json file with knowledge base
+        :param compaction_period: number of records after which
+        the journal should be compacted into the snapshot
+        """
+        self.snapshot_file_name = snapshot_file_name
+        self.journal_file_name = snapshot_file_name + '.journal'
+        self.compaction_period = compaction_period
+
+        self._records_num = 0
+        self._journal_file = None
+
+    def _start_journal(self, snapshot_hash: Optional[str]) -> None:
+        """
+        Starts a new empty journal for the snapshot with given hash
+        :param snapshot_hash: hash of the snapshot the journal is applied to
+        :return: None
+        """
+        if self._journal_file:
+            self._journal_file.close()
+
+        header = json.dumps({'snapshot': snapshot_hash}) + '\n'
+        replace_file(self.journal_file_name, header.encode('utf8'))
+
+        self._journal_file = open(self.journal_file_name, 'a', encoding='utf8')
+        self._records_num = 0
+
+    def replay(self, knowledge_base: RatedKnowledgeBase) -> int:
+        """
+        Applies journal records to knowledge base read from the snapshot
+        and starts appending to the journal
+        :param knowledge_base: knowledge base read from the snapshot
+        :return: number of applied records
+        """
+        snapshot_hash = get_file_hash(self.snapshot_file_name)
+        applied_num = 0
+
+        if os.path.isfile(self.journal_file_name):
+            with open(self.journal_file_name, 'r', encoding='utf8') as journal_file:
+                lines = journal_file.readlines()
+
+            # the journal that was written for another snapshot
+            # is already compacted into the current one
+            try:
+                header = json.loads(lines[0]) if lines else dict()
+            except ValueError:
+                header = dict()
+            if header.get('snapshot') != snapshot_hash:
+                LOGGER.info(f'journal {self.journal_file_name} is outdated and will be omitted')
+                lines = list()
+
+            for line in lines[1:]:
+                try:
+                    pattern, reply, rating_change = json.loads(line)
+                except (ValueError, TypeError):
+                    # the last record can be partially written because of a crash
+                    LOGGER.warning(f'broken record "{line}" in journal {self.journal_file_name}')
+                    continue
+
+                knowledge_base.add_rating(pattern, reply, rating_change)
+                applied_num += 1
+
+        LOGGER.info(f'{applied_num} records are replayed from journal {self.journal_file_name}')
+
+        if applied_num:
+            self.compact(knowledge_base)
+        else:
+            self._start_journal(snapshot_hash)
+
+        return applied_num
+
+    def append(self, pattern: str, reply: str, rating_change: int) -> None:
+        """
+        Appends rating change to the journal
+        :param pattern: learned pattern
+        :param reply: learned reply
+        :param rating_change: how much rating of the reply was changed
+        :return: None
+        """
+        self._journal_file.write(json.dumps([pattern, reply, rating_change], ensure_ascii=False) + '\n')
+        self._journal_file.flush()
+        self._records_num += 1
+
+    def needs_compaction(self) -> bool:
+        """
+        Checks if the journal has grown enough to be compacted
+        :return: True if the journal should be compacted else False
+        """
+        return self._records_num >= self.compaction_period
+
+    def compact(self, knowledge_base: RatedKnowledgeBase) -> None:
+        """
+        Writes knowledge base as a new snapshot and empties the journal
+        :param knowledge_base: knowledge base with all journal records applied
+        :return: None
+        """
+        # the snapshot isn't indented because it's mostly long lists of numbers
+        self._start_journal(write_json(knowledge_base.to_json(), self.snapshot_file_name, indent=None))
+
+        LOGGER.info(f'journal {self.journal_file_name} is compacted into {self.snapshot_file_name}')
+
+    def write_snapshot(self, knowledge_base: RatedKnowledgeBase) -> str:
+        """
+        Writes knowledge base next to the snapshot to replace the snapshot by replace_snapshot() later,
+        so the journal is appended meanwhile
+        :param knowledge_base: knowledge base that isn't changed while it's written
+        :return: hex digest of the written snapshot
+        """
+        return write_json(knowledge_base.to_json(), self.snapshot_file_name + '.new', indent=None)
+
+    def replace_snapshot(self, snapshot_hash: str, records: Iterable[Tuple[str, str, int]]) -> None:
+        """
+        Replaces the snapshot by one written by write_snapshot() and starts a new journal
+        :param snapshot_hash: hex digest of the written snapshot
+        :param records: patterns, replies and rating changes learned after the snapshot was written
+        :return: None
+        """
+        os.replace(self.snapshot_file_name + '.new', self.snapshot_file_name)
+        self._start_journal(snapshot_hash)
+        for pattern, reply, rating_change in records:
+            self.append(pattern, reply, rating_change)
+
+        LOGGER.info(f'snapshot {self.snapshot_file_name} is replaced')
+
+    def close(self) -> None:
+        """
+        Closes the journal file
+        :return: None
+        """
+        if self._journal_file:
+            self._journal_file.close()
+            self._journal_file = None
+
+
+class SQLiteKnowledgeBase:
+    """
+    Knowledge base of rating learning agent stored in SQLite database
+    as rows of patterns and replies with their ratings
+    """
+
+    # maximum number of query parameters supported by old SQLite versions
+    _max_parameters_num = 999
+    # number of rows deleted by compaction in one transaction
+    _compaction_batch_size = 500
+
+    def __init__(self, file_name: str):
+        """
+        :param file_name: name of the database file
+        """
+        self.file_name = file_name
+
+        # the connection is used from different threads under lock of the agent
+        self._connection = sqlite3.connect(file_name, check_same_thread=False)
+        # readers don't block writer and a transaction is one append to the write-ahead log,
+        # the database can't be corrupted by a crash in this mode without full synchronization
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS ratings ('
+                                     'pattern TEXT NOT NULL, '
+                                     'reply TEXT NOT NULL, '
+                                     'rating INTEGER NOT NULL, '
+                                     'PRIMARY KEY (pattern, reply)) WITHOUT ROWID')
+            # time when patterns were found or learned the last time and number of such times,
+            # it's written only by compaction
+            self._connection.execute('CREATE TABLE IF NOT EXISTS usage ('
+                                     'pattern TEXT PRIMARY KEY, '
+                                     'last_used INTEGER NOT NULL, '
+                                     'uses INTEGER NOT NULL) WITHOUT ROWID')
+
+    def is_migrated(self) -> bool:
+        """
+        Checks if json knowledge base was migrated into the database
+        :return: True if it was migrated else False
+        """
+        return self._connection.execute('PRAGMA user_version').fetchone()[0] > 0
+
+    def migrate(self, knowledge_base: Dict[str, Dict[str, int]]) -> None:
+        """
+        Writes json knowledge base into the database in one transaction
+        :param knowledge_base: knowledge base with patterns, replies and their ratings
+        :return: None
+        """
+        # ratings and the migration mark are written in the same transaction
+        # so the ratings can't be migrated twice
+        with self._connection:
+            self._add_ratings((pattern, reply, rating)
+                              for pattern, knowledge in knowledge_base.items()
+                              for reply, rating in knowledge.items())
+            self._connection.execute('PRAGMA user_version = 1')
+
+        LOGGER.info(f'knowledge base with {len(knowledge_base)} patterns is migrated into {self.file_name}')
+
+    def add_ratings(self, ratings_changes: Iterable[Tuple[str, str, int]]) -> None:
+        """
+        Changes ratings of replies in one transaction
+        :param ratings_changes: patterns, replies and how much their ratings should be changed
+        :return: None
+        """
+        with self._connection:
+            self._add_ratings(ratings_changes)
+
+    def _add_ratings(self, ratings_changes: Iterable[Tuple[str, str, int]]) -> None:
+        self._connection.executemany('INSERT INTO ratings (pattern, reply, rating) VALUES (?, ?, ?) '
+                                     'ON CONFLICT (pattern, reply) DO UPDATE '
+                                     'SET rating = rating + excluded.rating', ratings_changes)
+
+    def get_patterns(self) -> List[str]:
+        """
+        Gets all known patterns by a separate connection, so ratings can be read meanwhile
+        :return: patterns
+        """
+        connection = sqlite3.connect(self.file_name)
+        try:
+            return [pattern for pattern, in connection.execute('SELECT DISTINCT pattern FROM ratings')]
+        finally:
+            connection.close()
+
+    def get_ratings(self, patterns: List[str]) -> Dict[str, int]:
+        """
+        Gets replies of patterns with ratings summed up over the patterns
+        :param patterns: patterns
+        :return: replies and their summed ratings
+        """
+        result = dict()
+
+        for start in range(0, len(patterns), self._max_parameters_num):
+            patterns_part = patterns[start:start + self._max_parameters_num]
+            for reply, rating in self._connection.execute(
+                    f'SELECT reply, SUM(rating) FROM ratings '
+                    f'WHERE pattern IN ({", ".join("?" * len(patterns_part))}) GROUP BY reply', patterns_part):
+                result[reply] = result.get(reply, 0) + rating
+
+        return result
+
+    def get_top_ratings(self, patterns: List[str],
+                        k: Optional[int] = None) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """
+        Gets k replies of patterns with the highest non-negative ratings summed up over the patterns
+        and all replies with negative summed ratings
+        :param patterns: patterns
+        :param k: maximum number of replies with non-negative rating, all of them are got if it's None
+        :return: replies with the highest non-negative ratings and replies with negative ratings
+        """
+        # ratings of patterns that don't fit into one query are summed up in python
+        if not k or len(patterns) > self._max_parameters_num:
+            replies_ratings = self.get_ratings(patterns)
+            top_replies = sorted((reply for reply, rating in replies_ratings.items() if rating >= 0),
+                                 key=lambda x: -replies_ratings[x])[:k or None]
+            return {reply: replies_ratings[reply] for reply in top_replies}, \
+                {reply: rating for reply, rating in replies_ratings.items() if rating < 0}
+
+        query = f'SELECT reply, SUM(rating) AS total FROM ratings ' \
+                f'WHERE pattern IN ({", ".join("?" * len(patterns))}) GROUP BY reply '
+        return dict(self._connection.execute(query + 'HAVING total >= 0 ORDER BY total DESC LIMIT ?',
+                                             (*patterns, k))), \
+            dict(self._connection.execute(query + 'HAVING total < 0', patterns))
+
+    def compact(self, policy: CompactionPolicy, usage: Dict[str, Tuple[int, int]],
+                is_used: Optional[Callable[[str], bool]] = None) -> Dict[str, int]:
+        """
+        Removes knowledge that should be removed by the policy using a separate connection.
+        Knowledge to remove is found by reading the database and removed in short transactions,
+        so ratings can be read and learned meanwhile
+        :param policy: rules of removing knowledge
+        :param usage: patterns with time when they were used the last time and number of uses since the last compaction
+        :param is_used: function that checks if a pattern was found or learned after the compaction started,
+        such patterns are not removed for being the least recently used
+        :return: numbers of removed patterns, ratings and replies and [bytes] size of freed database pages
+        """
+        connection = sqlite3.connect(self.file_name)
+        try:
+            def count() -> Dict[str, int]:
+                return dict(zip(('patterns', 'ratings', 'replies'), connection.execute(
+                    'SELECT COUNT(DISTINCT pattern), COUNT(*), COUNT(DISTINCT reply) FROM ratings').fetchone()))
+
+            def get_free_size() -> int:
+                return connection.execute('PRAGMA freelist_count').fetchone()[0] \
+                    * connection.execute('PRAGMA page_size').fetchone()[0]
+
+            def delete(query: str, parameters: List[Tuple]) -> None:
+                for start in range(0, len(parameters), self._compaction_batch_size):
+                    with connection:
+                        connection.executemany(query, parameters[start:start + self._compaction_batch_size])
+
+            free_size = get_free_size()
+            before = count()
+
+            with connection:
+                connection.executemany('INSERT INTO usage (pattern, last_used, uses) VALUES (?, ?, ?) '
+                                       'ON CONFLICT (pattern) DO UPDATE '
+                                       'SET last_used = MAX(last_used, excluded.last_used), '
+                                       'uses = uses + excluded.uses',
+                                       ((pattern, last_used, uses) for pattern, (last_used, uses) in usage.items()))
+
+            # ratings are deleted only if they aren't changed since they were read
+            if policy.drop_zero:
+                delete('DELETE FROM ratings WHERE pattern = ? AND reply = ? AND rating = 0',
+                       connection.execute('SELECT pattern, reply FROM ratings WHERE rating = 0').fetchall())
+            if policy.is_known_reply:
+                unknown_replies = {reply for reply, in connection.execute('SELECT DISTINCT reply FROM ratings')
+                                   if not policy.is_known_reply(reply)}
+                # ratings are deleted by the primary key because replies aren't indexed
+                delete('DELETE FROM ratings WHERE pattern = ? AND reply = ?',
+                       [(pattern, reply) for pattern, reply in connection.execute('SELECT pattern, reply FROM ratings')
+                        if reply in unknown_replies])
+            if policy.max_replies:
+                delete('DELETE FROM ratings WHERE pattern = ? AND reply = ? AND rating = ?',
+                       connection.execute('SELECT pattern, reply, rating FROM ('
+                                          'SELECT pattern, reply, rating, ROW_NUMBER() OVER ('
+                                          'PARTITION BY pattern ORDER BY ABS(rating) DESC) AS place FROM ratings) '
+                                          'WHERE place > ?', (policy.max_replies,)).fetchall())
+            if policy.max_patterns:
+                evicted = [(pattern,) for pattern, in connection.execute(
+                    'SELECT patterns.pattern FROM (SELECT DISTINCT pattern FROM ratings) AS patterns '
+                    'LEFT JOIN usage ON usage.pattern = patterns.pattern '
+                    'ORDER BY COALESCE(last_used, 0), COALESCE(uses, 0) '
+                    'LIMIT MAX((SELECT COUNT(DISTINCT pattern) FROM ratings) - ?, 0)',
+                    (policy.max_patterns,)).fetchall()
+                    if not (is_used and is_used(pattern))]
+                delete('DELETE FROM ratings WHERE pattern = ?', evicted)
+
+            with connection:
+                connection.execute('DELETE FROM usage WHERE pattern NOT IN (SELECT pattern FROM ratings)')
+
+            removed = {key: before[key] - value for key, value in count().items()}
+            removed['bytes'] = get_free_size() - free_size
+            return removed
+        finally:
+            connection.close()
+
+    def close(self) -> None:
+        """
+        Closes the database connection
+        :return: None
+        """
+        self._connection.close()
+
+
+class BackgroundFlusher:
+    """
+    Writes changed data in a background thread
+    every given period of time or after given number of changes,
+    so a burst of changes costs only one write
+    """
+
+    def __init__(self, flush: Callable[[], None], period: float = 30, changes_threshold: int = 100):
+        """
+        :param flush: function that writes the data
+        :param period: [seconds] maximum time between a change and writing of the data
+        :param changes_threshold: number of changes that makes the data to be written immediately
+        """
+        self._flush = flush
+        self.period = period
+        self.changes_threshold = changes_threshold
+
+        self._changes_num = 0
+        self._stopped = False
+        self._condition = threading.Condition()
+        # for not writing the data simultaneously from the thread and on draining
+        self._flush_lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run, name='background flusher', daemon=True)
+        self._thread.start()
+
+        _FLUSHERS.append(self)
+
+    def mark_dirty(self, changes_num: int = 1) -> None:
+        """
+        Marks the data as changed and not written
+        :param changes_num: number of new changes
+        :return: None
+        """
+        with self._condition:
+            self._changes_num += changes_num
+            if self._changes_num >= self.changes_threshold:
+                self._condition.notify()
+
+    def _flush_changes(self) -> bool:
+        """
+        Writes the data if there are changes that are not written
+        :return: False if writing failed else True
+        """
+        with self._flush_lock:
+            with self._condition:
+                changes_num = self._changes_num
+                self._changes_num = 0
+
+            if not changes_num:
+                return True
+
+            try:
+                self._flush()
+            except Exception as error:
+                LOGGER.error(f'{changes_num} changes are not written: {error}')
+                # the changes will be written next time
+                with self._condition:
+                    self._changes_num += changes_num
+                return False
+
+        LOGGER.info(f'{changes_num} changes are written')
+        return True
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._stopped or self._changes_num >= self.changes_threshold,
+                                         timeout=self.period)
+                if self._stopped:
+                    return
+
+            if not self._flush_changes():
+                # waiting before the next try
+                with self._condition:
+                    self._condition.wait_for(lambda: self._stopped, timeout=self.period)
+
+    def drain(self) -> None:
+        """
+        Stops the background thread and writes all changes that are not written
+        :return: None
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+        self._flush_changes()
+
+
+def drain_all() -> None:
+    """
+    Writes not written changes of all background flushers
+    :return: None
+    """
+    for flusher in _FLUSHERS:
+        flusher.drain()
+
+
+def drain_on_termination() -> None:
+    """
+    Makes all background flushers to be drained when the process exits
+    and makes SIGTERM only set TERMINATION_REQUESTED, so the process exits the normal way.
+    The handler doesn't drain flushers itself because it interrupts the main thread
+    that can be in the middle of changing knowledge under its lock.
+    Must be called from the main thread
+    :return: None
+    """
+    atexit.register(drain_all)
+
+    previous_handler = signal.getsignal(signal.SIGTERM)
+
+    def handle_termination(signal_number, frame) -> None:
+        TERMINATION_REQUESTED.set()
+        if callable(previous_handler):
+            previous_handler(signal_number, frame)
+
+    signal.signal(signal.SIGTERM, handle_termination)
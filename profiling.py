@@ -0,0 +1,226 @@
+"""
+Module for profiling replying and learning of agents offline
+by replaying a log of messages and votes against a copy of the knowledge base
+"""
+
+import argparse
+import cProfile
+import io
+import json
+import logging
+import os.path
+import pstats
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import List, Dict, Callable
+
+import numpy
+
+import agents
+import persistence
+import text_processing
+
+MESSAGE_EVENT = 'message'
+VOTE_EVENT = 'vote'
+
+
+def read_events(log_file_name: str) -> List[Dict]:
+    """
+    Reads log of events. A json lines file has one event per line:
+    {"type": "message", "text": ..., "private": bool, "call": bool}
+    or {"type": "vote", "text": input text, "reply": reply, "change": rating change},
+    other files have one message text per line
+    :param log_file_name: name of the log file
+    :return: events
+    """
+    events = list()
+    with open(log_file_name, 'r', encoding='utf-8-sig') as log_file:
+        for line in log_file:
+            line = line.strip()
+            if not line:
+                continue
+            if log_file_name.endswith('.jsonl'):
+                events.append(json.loads(line))
+            else:
+                events.append({'type': MESSAGE_EVENT, 'text': line})
+    return events
+
+
+def replay(events: List[Dict], loaded_agents: agents.Agents, learn: bool) -> Counter:
+    """
+    Replays events through conversation controller and learning agent
+    :param events: events read from log
+    :param loaded_agents: agents to replay events with
+    :param learn: if True then vote events are learned else they are omitted
+    :return: numbers of replayed events by types
+    """
+    controller = loaded_agents.conversation_controller
+    learning_agent = loaded_agents.learning_agent
+
+    replayed = Counter()
+    for event in events:
+        if event['type'] == MESSAGE_EVENT:
+            controller.proceed_input_message(text_processing.AnalyzedMessage(event['text']),
+                                             event.get('private', True), event.get('call', False))
+        elif event['type'] == VOTE_EVENT and learn:
+            learning_agent.rating_learn(event['text'], event['reply'], event['change'])
+        else:
+            continue
+        replayed[event['type']] += 1
+    return replayed
+
+
+class StackSampler:
+    """
+    Samples stacks of a thread periodically and counts them in collapsed format used for flamegraphs
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.001):
+        """
+        :param thread_id: id of the sampled thread
+        :param interval: [seconds] period between samples
+        """
+        self._thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack sampler', daemon=True)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = list()
+            while frame:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def __enter__(self) -> 'StackSampler':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def write(self, file_name: str) -> None:
+        """
+        Writes sampled stacks with their counts one per line
+        :param file_name: name of the output file
+        :return: None
+        """
+        with open(file_name, 'w', encoding='utf8') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+
+def profile_run(name: str, run: Callable[[], Counter]) -> None:
+    """
+    Runs replay and logs its duration
+    :param name: name of the profiling
+    :param run: function that replays events
+    :return: None
+    """
+    start_time = time.perf_counter()
+    replayed = run()
+    print(f'{name}: {dict(replayed)} events are replayed in {time.perf_counter() - start_time:.2f} seconds')
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Profiles replying on messages and learning votes from a log')
+    PARSER.add_argument('log', help='file with one message per line or json lines file with events')
+    PARSER.add_argument('--config', default=agents.CONFIG_PATH, help='bot config')
+    PARSER.add_argument('--language', default=agents.AGENT_LANGUAGE_PATH,
+                        help='directory with sentences.json, nouns.json and names.json')
+    PARSER.add_argument('--rated-model', default=agents.RATED_LEARNING_MODEL_PATH,
+                        help="RatingLearningAgent's knowledge base, it's copied and not changed")
+    PARSER.add_argument('--model', default=agents.LEARNING_MODEL_PATH,
+                        help="LearningAgent's knowledge base")
+    PARSER.add_argument('--database', default=agents.RATED_LEARNING_DATABASE_PATH,
+                        help="SQLite knowledge base, it's copied and not changed")
+    PARSER.add_argument('--learn', action='store_true', help='replay votes as well')
+    PARSER.add_argument('--seed', type=int, default=0, help='seed of random numbers generators')
+    PARSER.add_argument('--cprofile', default='profile.txt', help='output file with cProfile statistics')
+    PARSER.add_argument('--stacks', default='profile.folded', help='output file with collapsed stacks')
+    PARSER.add_argument('--tracemalloc', default='allocations.txt', help='output file with top allocations')
+    PARSER.add_argument('--top', type=int, default=50, help='number of functions and allocations to report')
+    PARSER.add_argument('--skip', nargs='*', default=[], choices=['cprofile', 'stacks', 'tracemalloc'],
+                        help='kinds of profiling to skip')
+    ARGS = PARSER.parse_args()
+
+    # logging would be profiled instead of agents
+    logging.disable(logging.INFO)
+
+    CONFIG = agents.read_config(ARGS.config)
+    EVENTS = read_events(ARGS.log)
+
+    def make_run(directory: str) -> Callable[[], Counter]:
+        """
+        Copies knowledge bases into directory and loads agents from the copies,
+        so learning doesn't change the original ones and each profiling starts from the same state
+        :param directory: directory for copies of knowledge bases
+        :return: function that replays events
+        """
+        random.seed(ARGS.seed)
+        numpy.random.seed(ARGS.seed)
+
+        copies = dict()
+        for key, path in [('rated', ARGS.rated_model), ('database', ARGS.database)]:
+            copies[key] = os.path.join(directory, os.path.basename(path))
+
+        # rating changes that are not compacted yet are in the journal of the snapshot
+        for path in [ARGS.rated_model, persistence.KnowledgeJournal(ARGS.rated_model).journal_file_name]:
+            if os.path.isfile(path):
+                shutil.copy(path, os.path.join(directory, os.path.basename(path)))
+
+        # the database is copied by SQLite with changes that are in its write-ahead log
+        if os.path.isfile(ARGS.database):
+            source, copy = sqlite3.connect(ARGS.database), sqlite3.connect(copies['database'])
+            try:
+                source.backup(copy)
+            finally:
+                source.close()
+                copy.close()
+
+        loaded_agents = agents.Agents(CONFIG, ARGS.language, copies['rated'], ARGS.model, copies['database'])
+        return lambda: replay(EVENTS, loaded_agents, ARGS.learn)
+
+    if 'cprofile' not in ARGS.skip:
+        with tempfile.TemporaryDirectory() as DIRECTORY:
+            RUN = make_run(DIRECTORY)
+            PROFILE = cProfile.Profile()
+            profile_run('cprofile', lambda: PROFILE.runcall(RUN))
+
+        OUTPUT = io.StringIO()
+        pstats.Stats(PROFILE, stream=OUTPUT).sort_stats('cumulative').print_stats(ARGS.top)
+        with open(ARGS.cprofile, 'w', encoding='utf8') as FILE:
+            FILE.write(OUTPUT.getvalue())
+        PROFILE.dump_stats(os.path.splitext(ARGS.cprofile)[0] + '.prof')
+
+    if 'stacks' not in ARGS.skip:
+        with tempfile.TemporaryDirectory() as DIRECTORY:
+            RUN = make_run(DIRECTORY)
+            with StackSampler(threading.get_ident()) as SAMPLER:
+                profile_run('stacks', RUN)
+        SAMPLER.write(ARGS.stacks)
+
+    if 'tracemalloc' not in ARGS.skip:
+        with tempfile.TemporaryDirectory() as DIRECTORY:
+            RUN = make_run(DIRECTORY)
+            tracemalloc.start(25)
+            profile_run('tracemalloc', RUN)
+            SNAPSHOT = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+        with open(ARGS.tracemalloc, 'w', encoding='utf8') as FILE:
+            for STATISTIC in SNAPSHOT.statistics('lineno')[:ARGS.top]:
+                FILE.write(f'{STATISTIC}\n')
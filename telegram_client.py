@@ -0,0 +1,261 @@
+"""
+Module for asynchronous calls of Telegram Bot API
+"""
+
+import asyncio
+import time
+from typing import Dict, Optional, Hashable, Union
+
+import aiohttp
+import aiohttp_socks
+
+import logger
+
+LOGGER = logger.get_logger(__file__)
+
+API_URL = 'https://api.telegram.org'
+
+
+class TelegramError(Exception):
+    """
+    Error returned by Telegram Bot API
+    """
+
+    def __init__(self, method: str, error_code: Optional[int], description: Optional[str]):
+        """
+        :param method: called API method
+        :param error_code: code of the error
+        :param description: description of the error
+        """
+        super().__init__(f'{method} failed with error {error_code}: {description}')
+        self.method = method
+        self.error_code = error_code
+        self.description = description
+
+
+class RateLimiter:
+    """
+    Limits rate of calls by keeping minimal intervals between calls with the same key
+    """
+
+    # number of keys after which keys with passed times are removed
+    _max_keys_num = 10000
+
+    def __init__(self):
+        # keys with the earliest time of the next allowed call
+        self._next_times: Dict[Hashable, float] = dict()
+        # keys with the time until which all calls are prohibited
+        self._delayed_times: Dict[Hashable, float] = dict()
+
+    async def wait(self, key: Hashable, interval: float) -> None:
+        """
+        Waits until a call with the key is allowed and reserves time for it
+        :param key: key of calls, e.g. id of a chat
+        :param interval: [seconds] minimal interval between calls with this key,
+        calls with zero interval wait only for delays and don't reserve time
+        :return: None
+        """
+        now = time.monotonic()
+        if len(self._next_times) + len(self._delayed_times) > self._max_keys_num:
+            self._next_times = {x: next_time for x, next_time in self._next_times.items() if next_time > now}
+            self._delayed_times = {x: delayed_time for x, delayed_time in self._delayed_times.items()
+                                   if delayed_time > now}
+
+        next_time = max(now, self._delayed_times.get(key, now))
+        if interval:
+            next_time = max(next_time, self._next_times.get(key, now))
+            self._next_times[key] = next_time + interval
+
+        if next_time > now:
+            await asyncio.sleep(next_time - now)
+
+    def delay(self, key: Hashable, period: float) -> None:
+        """
+        Prohibits calls with the key for a period
+        :param key: key of calls
+        :param period: [seconds] period from now while calls are prohibited
+        :return: None
+        """
+        self._delayed_times[key] = max(self._delayed_times.get(key, 0), time.monotonic() + period)
+
+
+class TelegramClient:
+    """
+    Client of Telegram Bot API that makes calls through one pool of kept-alive connections
+    and follows Telegram's rate limits
+    """
+
+    # key for limiting rate of all calls
+    _global_key = None
+
+    # only sent messages count towards limits of chats, these calls wait only for delays asked by Telegram
+    _chat_unlimited_methods = frozenset(('sendChatAction', 'editMessageReplyMarkup', 'answerCallbackQuery'))
+
+    def __init__(self, token: str, base_url: str = API_URL,
+                 proxy: Optional[str] = None, proxy_auth: Optional[aiohttp.BasicAuth] = None,
+                 connections_limit: int = 10, timeout: float = 30, max_retries: int = 3,
+                 global_interval: float = 1 / 30, chat_interval: float = 1, group_chat_interval: float = 3):
+        """
+        :param token: bot token
+        :param base_url: url of Bot API server
+        :param proxy: url of http or socks5 proxy, credentials of socks5 proxy are given in the url
+        :param proxy_auth: credentials for http proxy
+        :param connections_limit: maximum number of simultaneous connections
+        :param timeout: [seconds] timeout of one call
+        :param max_retries: how many times a call is repeated if Telegram asks to retry later
+        :param global_interval: [seconds] minimal interval between all calls
+        :param chat_interval: [seconds] minimal interval between sent messages for one private chat
+        :param group_chat_interval: [seconds] minimal interval between sent messages for one group chat
+        """
+        if proxy and not proxy.startswith(('http://', 'https://', 'socks5://')):
+            raise ValueError(f'only http and socks5 proxies are supported, {proxy} is given')
+
+        self._token = token
+        self.base_url = base_url.rstrip('/')
+        # socks5 proxy is used by the connector of the session, http proxy is given to each call
+        self._socks_proxy = proxy if proxy and proxy.startswith('socks5://') else None
+        self._proxy = None if self._socks_proxy else proxy
+        self._proxy_auth = None if self._socks_proxy else proxy_auth
+        self._connections_limit = connections_limit
+        self._timeout = timeout
+        self.max_retries = max_retries
+
+        self.global_interval = global_interval
+        self.chat_interval = chat_interval
+        self.group_chat_interval = group_chat_interval
+        self._rate_limiter = RateLimiter()
+
+        # session is created when the first call is made inside the event loop
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        # the bot user that doesn't change while the bot is working
+        self._me: Optional[Dict] = None
+
+        # statistics of calls
+        self.stats = {
+            'calls': 0,
+            'rate limited': 0,
+            'errors': 0
+        }
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Gets session that keeps connections to the API server
+        :return: session
+        """
+        if not self._session or self._session.closed:
+            connector = aiohttp_socks.ProxyConnector.from_url(self._socks_proxy, limit=self._connections_limit) \
+                if self._socks_proxy else aiohttp.TCPConnector(limit=self._connections_limit)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self._timeout))
+        return self._session
+
+    async def call(self, method: str, params: Optional[Dict] = None,
+                   chat_id: Optional[Union[int, str]] = None) -> Union[Dict, bool]:
+        """
+        Calls API method waiting for rate limits of all calls and the chat
+        :param method: name of API method
+        :param params: parameters of the method, parameters with None values are omitted
+        :param chat_id: id of a chat that the call is made for
+        :return: result of the call
+        """
+        params = {key: value for key, value in (params or dict()).items() if value is not None}
+        url = f'{self.base_url}/bot{self._token}/{method}'
+
+        # groups have negative ids and lower limits
+        if method in self._chat_unlimited_methods:
+            chat_interval = 0
+        elif isinstance(chat_id, str) or chat_id is not None and chat_id < 0:
+            chat_interval = self.group_chat_interval
+        else:
+            chat_interval = self.chat_interval
+
+        for attempt in range(self.max_retries + 1):
+            await self._rate_limiter.wait(self._global_key, self.global_interval)
+            if chat_id is not None:
+                await self._rate_limiter.wait(chat_id, chat_interval)
+
+            self.stats['calls'] += 1
+            try:
+                async with self._get_session().post(url, json=params,
+                                                    proxy=self._proxy, proxy_auth=self._proxy_auth) as response:
+                    result = await response.json(content_type=None)
+            except (aiohttp.ClientError, aiohttp_socks.ProxyError, OSError, asyncio.TimeoutError, ValueError):
+                self.stats['errors'] += 1
+                raise
+
+            if result.get('ok'):
+                return result['result']
+
+            retry_after = result.get('parameters', dict()).get('retry_after')
+            if result.get('error_code') == 429 and retry_after is not None and attempt < self.max_retries:
+                self.stats['rate limited'] += 1
+                LOGGER.warning(f'{method} is rate limited, it will be retried after {retry_after} seconds')
+                self._rate_limiter.delay(self._global_key if chat_id is None else chat_id, retry_after)
+                continue
+
+            self.stats['errors'] += 1
+            raise TelegramError(method, result.get('error_code'), result.get('description'))
+
+    async def get_me(self, refresh: bool = False) -> Dict:
+        """
+        Gets information about the bot, it's requested only once
+        :param refresh: if True then the information is requested again
+        :return: bot user
+        """
+        if self._me is None or refresh:
+            self._me = await self.call('getMe')
+        return self._me
+
+    async def send_chat_action(self, chat_id: Union[int, str], action: str) -> bool:
+        """
+        Shows chat action, e.g. "typing"
+        :param chat_id: id of a chat
+        :param action: type of the action
+        :return: True
+        """
+        return await self.call('sendChatAction', {'chat_id': chat_id, 'action': action}, chat_id)
+
+    async def send_message(self, chat_id: Union[int, str], text: str,
+                           reply_to_message_id: Optional[int] = None, reply_markup: Optional[Dict] = None) -> Dict:
+        """
+        Sends text message
+        :param chat_id: id of a chat
+        :param text: text of the message
+        :param reply_to_message_id: id of a message the sent message replies to
+        :param reply_markup: keyboard of the message
+        :return: sent message
+        """
+        return await self.call('sendMessage', {'chat_id': chat_id, 'text': text,
+                                               'reply_to_message_id': reply_to_message_id,
+                                               'reply_markup': reply_markup}, chat_id)
+
+    async def edit_message_reply_markup(self, chat_id: Union[int, str], message_id: int,
+                                        reply_markup: Optional[Dict] = None) -> Union[Dict, bool]:
+        """
+        Replaces keyboard of a message
+        :param chat_id: id of a chat
+        :param message_id: id of the message
+        :param reply_markup: new keyboard or None for removing the keyboard
+        :return: edited message
+        """
+        return await self.call('editMessageReplyMarkup', {'chat_id': chat_id, 'message_id': message_id,
+                                                          'reply_markup': reply_markup}, chat_id)
+
+    async def answer_callback_query(self, callback_query_id: str, text: Optional[str] = None) -> bool:
+        """
+        Answers a callback query sent by pressing a keyboard button
+        :param callback_query_id: id of the query
+        :param text: notification text
+        :return: True
+        """
+        return await self.call('answerCallbackQuery', {'callback_query_id': callback_query_id, 'text': text})
+
+    async def close(self) -> None:
+        """
+        Closes all connections
+        :return: None
+        """
+        if self._session:
+            await self._session.close()
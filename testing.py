@@ -7,6 +7,7 @@ from typing import List, Dict
 
 import json_manager
 import agents
+import persistence
 
 
 def test_reply_agent(agent_function: "agent's function to process input message",
@@ -30,6 +31,8 @@ def test_reply_agent(agent_function: "agent's function to process input message"
     test_output: List[Dict[str, str]] = list()
 
     for message in messages:
+        if persistence.TERMINATION_REQUESTED.is_set():
+            break
         test_output.append({"message": message,
                             "reply": agent_function(message)})
 
@@ -38,8 +41,13 @@ def test_reply_agent(agent_function: "agent's function to process input message"
 
 TEST_NUMBERS = [1, 0, 2]
 
-for test_n in TEST_NUMBERS:
-    for agent_f in [agents.CONVERSATION_CONTROLLER.proceed_input_message]:
-        test_reply_agent(agent_f,
-                         os.path.join('data', 'tests', f'test{str(test_n)}.txt'),
-                         test_output_file_name=f'test_output_CONVERSATION_CONTROLLER_n_{str(test_n)}.txt')
+if __name__ == '__main__':
+    persistence.drain_on_termination()
+
+    for test_n in TEST_NUMBERS:
+        if persistence.TERMINATION_REQUESTED.is_set():
+            break
+        for agent_f in [agents.get_agents().conversation_controller.proceed_input_message]:
+            test_reply_agent(agent_f,
+                             os.path.join('data', 'tests', f'test{str(test_n)}.txt'),
+                             test_output_file_name=f'test_output_CONVERSATION_CONTROLLER_n_{str(test_n)}.txt')
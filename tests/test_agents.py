@@ -0,0 +1,71 @@
+"""
+Tests of making agents when they are needed the first time
+"""
+
+import os.path
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from configparser import ConfigParser
+from unittest import mock
+
+import agents
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class GetAgentsTest(unittest.TestCase):
+    """
+    Checks that agents aren't made on import and are made once by concurrent calls
+    """
+
+    def setUp(self) -> None:
+        self.made_agents = list()
+
+        def make_agents(config: ConfigParser) -> mock.Mock:
+            # making agents takes time, so concurrent calls wait for each other
+            time.sleep(0.05)
+            made_agents = mock.Mock(config=config)
+            self.made_agents.append(made_agents)
+            return made_agents
+
+        for patcher in [mock.patch.object(agents, '_AGENTS', None),
+                        mock.patch.object(agents, 'Agents', make_agents),
+                        mock.patch.object(agents, 'read_config', ConfigParser),
+                        mock.patch.object(agents.metrics, 'Gauge')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_import(self) -> None:
+        # files are opened from the data directory when agents are made
+        code = 'import os.path, sys\n' \
+               'opened = list()\n' \
+               'sys.addaudithook(lambda event, args: opened.append(os.path.abspath(args[0])) ' \
+               'if event == "open" and isinstance(args[0], str) else None)\n' \
+               'import agents\n' \
+               'print("\\n".join(opened))'
+        opened = subprocess.run([sys.executable, '-c', code], cwd=ROOT_PATH, check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout.splitlines()
+        self.assertEqual([file_name for file_name in opened
+                          if file_name.startswith(os.path.join(ROOT_PATH, 'data') + os.sep)], [])
+
+    def test_made_once(self) -> None:
+        # changes of language files are read by agents when they are made
+        self.assertFalse(agents.apply_language_diff('diff.json'))
+        self.assertEqual(self.made_agents, [])
+
+        got_agents = list()
+        threads = [threading.Thread(target=lambda: got_agents.append(agents.get_agents())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.made_agents), 1)
+        self.assertEqual(got_agents, self.made_agents * len(threads))
+        self.assertIs(agents.get_agents(), self.made_agents[0])
+
+        self.assertTrue(agents.apply_language_diff('diff.json'))
+        self.made_agents[0].apply_language_diff.assert_called_once_with('diff.json')
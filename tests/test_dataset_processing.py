@@ -0,0 +1,48 @@
+"""
+Tests of reading data set texts by chunks
+"""
+
+import os.path
+import tempfile
+import unittest
+
+import nltk.data
+from nltk.tokenize import sent_tokenize
+
+import dataset_processing
+
+TESTS_DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'tests')
+
+
+class ReadSentencesTest(unittest.TestCase):
+    """
+    Checks that sentences read by chunks are the same as sentences of the whole text
+    """
+
+    chunk_sizes = (7, 50, 333, 4096)
+
+    def setUp(self) -> None:
+        try:
+            nltk.data.load(dataset_processing.SENTENCE_TOKENIZER_PATH)
+        except LookupError:
+            self.skipTest('punkt tokenizer is not downloaded')
+
+    def check_chunk_sizes(self, text_file_name: str) -> None:
+        with open(text_file_name, 'r', encoding='utf-8-sig') as text_file:
+            sentences = sent_tokenize(text_file.read())
+
+        for chunk_size in self.chunk_sizes:
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual([sentence for sentence, _ in
+                                  dataset_processing.read_sentences(text_file_name, chunk_size)], sentences)
+
+    def test_data_set(self) -> None:
+        self.check_chunk_sizes(os.path.join(TESTS_DATA_PATH, 'test0.txt'))
+
+    def test_sentences_inside_tokens(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            text_file_name = os.path.join(directory, 'text.txt')
+            with open(text_file_name, 'w', encoding='utf-8') as text_file:
+                text_file.write(' \nНе ну за шо ??? Нельзя же так. Mr. Smith said "hi!" (and left.) \n\n'
+                                'Что?! Да... ну ладно. ' * 20)
+            self.check_chunk_sizes(text_file_name)
@@ -0,0 +1,40 @@
+"""
+Tests of loading language packs
+"""
+
+import os.path
+import tempfile
+import unittest
+
+import language_pack
+
+LANGUAGE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'language')
+
+
+class LanguagePackTest(unittest.TestCase):
+    """
+    Checks that damaged packs are rejected with ValueError
+    """
+
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.pack_path = os.path.join(self._directory.name, 'language.pack')
+        language_pack.build_language_pack(os.path.join(LANGUAGE_PATH, 'sentences.json'),
+                                          os.path.join(LANGUAGE_PATH, 'nouns.json'), self.pack_path)
+        with open(self.pack_path, 'rb') as pack_file:
+            self.pack_data = pack_file.read()
+
+    def tearDown(self) -> None:
+        self._directory.cleanup()
+
+    def test_truncated_pack(self) -> None:
+        for size in (1, language_pack.HEADER.size - 1, language_pack.HEADER.size, len(self.pack_data) - 1):
+            with self.subTest(size=size):
+                with open(self.pack_path, 'wb') as pack_file:
+                    pack_file.write(self.pack_data[:size])
+                with self.assertRaises(ValueError):
+                    language_pack.LanguagePack(self.pack_path)
+
+    def test_whole_pack(self) -> None:
+        pack = language_pack.LanguagePack(self.pack_path)
+        self.assertEqual(len(pack.sentences), len(pack.read_sentences_nouns()))
@@ -0,0 +1,65 @@
+"""
+Tests of searching learned patterns with the inverted index
+"""
+
+import random
+import re
+import unittest
+from typing import List
+
+import texting_ai
+
+PATTERN_DELIMITER = '.* '
+
+# stems longer and shorter than index keys, with characters that change under case folding
+# and with regex special symbols that can't be indexed
+STEMS = ['привет', 'как', 'дел', 'ёж', 'ЕЛК', 'рей', 'ева', 'a', 'ok', 'straße', 'strasse', 'ǅem', 'ΣΟΦ',
+         'σοφ', 'ς', 'ﬁ', 'kelvin', 'Kelvin', 'İst', 'ist', 'word', 'wordy', 'w.rd', 'x?y', 'неа', 'не']
+
+
+def search_patterns(patterns: List[str], text: str) -> List[str]:
+    """
+    Finds patterns that match text by checking all of them with regex search
+    :param patterns: patterns in order they were added
+    :param text: text to search in
+    :return: matched patterns in order they were added
+    """
+    return [pattern for pattern in patterns if re.search(pattern, text, re.I)]
+
+
+class PatternIndexTest(unittest.TestCase):
+    """
+    Checks that the index finds exactly the same patterns as regex search of all patterns
+    """
+
+    def make_text(self, generator: random.Random) -> str:
+        words = list()
+        for _ in range(generator.randint(0, 8)):
+            word = generator.choice(STEMS) + generator.choice(['', '', 'ом', 'а', 's', 'ing'])
+            words.append(generator.choice([word, word.upper(), word.lower(), word.title()]))
+            words.append(generator.choice([' ', ' ', ', ', '! ', '.', '\n']))
+        return ''.join(words)
+
+    def test_same_as_regex_search(self) -> None:
+        generator = random.Random(0)
+        patterns = list()
+        for _ in range(500):
+            pattern = PATTERN_DELIMITER.join(generator.choice(STEMS) for _ in range(generator.randint(1, 3)))
+            if pattern not in patterns:
+                patterns.append(pattern)
+
+        index = texting_ai.PatternIndex(PATTERN_DELIMITER, patterns[:250])
+        for pattern in patterns[250:]:
+            index.add(pattern)
+        self.assertEqual(len(index), len(patterns))
+
+        for _ in range(2000):
+            text = self.make_text(generator)
+            self.assertEqual(index.find(text), search_patterns(patterns, text), text)
+
+    def test_case_folding(self) -> None:
+        patterns = ['straße', 'kelvin', 'σοφ', 'ёж' + PATTERN_DELIMITER + 'елк', 'ist']
+        index = texting_ai.PatternIndex(PATTERN_DELIMITER, patterns)
+
+        for text in ['STRASSE', 'STRAẞE', 'KELVIN', 'ΣΟΦ', 'σοφ', 'ЁЖ и ЕЛКА', 'İST', 'IST']:
+            self.assertEqual(index.find(text), search_patterns(patterns, text), text)
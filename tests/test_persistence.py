@@ -0,0 +1,271 @@
+"""
+Tests of persisting knowledge bases of learning agents
+"""
+
+import json
+import os.path
+import random
+import tempfile
+import unittest
+from typing import Dict, List, Tuple, Union
+
+import json_manager
+import persistence
+
+REPLIES = ['привет', 'как дела?', 'хорошо', 'нет', 'да', 'ну и ладно', 'рей', '']
+PATTERNS = ['привет', 'как.* дел', 'рей', 'ева.* 01', 'нет.* да']
+
+
+def make_changes(generator: random.Random, changes_num: int) -> List[Tuple[str, str, int]]:
+    """
+    Makes random rating changes
+    :param generator: random generator
+    :param changes_num: number of changes
+    :return: patterns, replies and rating changes
+    """
+    return [(generator.choice(PATTERNS), generator.choice(REPLIES), generator.randint(-3, 3))
+            for _ in range(changes_num)]
+
+
+def apply_changes(knowledge: Dict[str, Dict[str, int]], changes: List[Tuple[str, str, int]]) -> None:
+    """
+    Applies rating changes to knowledge base kept in dictionaries
+    :param knowledge: patterns with replies and their ratings
+    :param changes: patterns, replies and rating changes
+    :return: None
+    """
+    for pattern, reply, rating_change in changes:
+        pattern_knowledge = knowledge.setdefault(pattern, dict())
+        pattern_knowledge[reply] = pattern_knowledge.get(reply, 0) + rating_change
+
+
+class RatedKnowledgeBaseTest(unittest.TestCase):
+    """
+    Checks that knowledge base with interned replies keeps the same ratings as dictionaries
+    """
+
+    def test_same_as_dictionaries(self) -> None:
+        generator = random.Random(0)
+        knowledge = dict()
+        knowledge_base = persistence.RatedKnowledgeBase()
+        for pattern, reply, rating_change in make_changes(generator, 300):
+            apply_changes(knowledge, [(pattern, reply, rating_change)])
+            self.assertEqual(knowledge_base.add_rating(pattern, reply, rating_change), knowledge[pattern][reply])
+        self.assertEqual(dict(knowledge_base.items()), knowledge)
+
+        for _ in range(100):
+            patterns = generator.sample(PATTERNS + ['неизвестный'], generator.randint(0, 4))
+            ratings = dict()
+            for pattern in patterns:
+                for reply, rating in knowledge.get(pattern, dict()).items():
+                    ratings[reply] = ratings.get(reply, 0) + rating
+            self.assertEqual(knowledge_base.get_ratings(patterns), ratings, patterns)
+
+    def test_json(self) -> None:
+        generator = random.Random(0)
+        knowledge = dict()
+        apply_changes(knowledge, make_changes(generator, 300))
+
+        # the old format with replies texts is read as well
+        knowledge_base = persistence.RatedKnowledgeBase(knowledge)
+        data = json.loads(json.dumps(knowledge_base.to_json(), ensure_ascii=False))
+        # each reply text is stored once
+        self.assertCountEqual(data['replies'], {reply for x in knowledge.values() for reply in x})
+        self.assertEqual(knowledge_base.get_replies_num(), len(data['replies']))
+        self.assertEqual(knowledge_base.get_ratings_num(), sum(map(len, knowledge.values())))
+
+        replies_num = len(data['replies'])
+        read_knowledge_base = persistence.RatedKnowledgeBase(data)
+        self.assertEqual(dict(read_knowledge_base.items()), knowledge)
+        self.assertEqual(read_knowledge_base.to_json(), knowledge_base.to_json())
+        # new replies get new ids after the read ones
+        read_knowledge_base.add_rating(PATTERNS[0], 'новый ответ', 1)
+        self.assertEqual(read_knowledge_base.get_ratings([PATTERNS[0]])['новый ответ'],
+                         knowledge[PATTERNS[0]].get('новый ответ', 0) + 1)
+        self.assertEqual(read_knowledge_base.get_replies_num(), replies_num + 1)
+
+
+class KnowledgeJournalTest(unittest.TestCase):
+    """
+    Checks that rating changes are not lost when the journal isn't compacted because of a crash
+    """
+
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.snapshot_file_name = os.path.join(self._directory.name, 'rated_learning_model.json')
+        self.generator = random.Random(0)
+
+        self.knowledge = dict()
+        apply_changes(self.knowledge, make_changes(self.generator, 20))
+        persistence.write_json(persistence.RatedKnowledgeBase(self.knowledge).to_json(), self.snapshot_file_name)
+
+    def tearDown(self) -> None:
+        self._directory.cleanup()
+
+    def read_knowledge_base(self) -> Tuple[persistence.RatedKnowledgeBase, persistence.KnowledgeJournal, int]:
+        knowledge_base = persistence.RatedKnowledgeBase(json_manager.read(self.snapshot_file_name))
+        journal = persistence.KnowledgeJournal(self.snapshot_file_name, compaction_period=1000)
+        return knowledge_base, journal, journal.replay(knowledge_base)
+
+    def append_changes(self, journal: persistence.KnowledgeJournal, changes_num: int) -> None:
+        changes = make_changes(self.generator, changes_num)
+        for change in changes:
+            journal.append(*change)
+        apply_changes(self.knowledge, changes)
+
+    def test_replay_after_crash(self) -> None:
+        knowledge_base, journal, replayed_num = self.read_knowledge_base()
+        self.assertEqual(replayed_num, 0)
+        self.append_changes(journal, 50)
+        self.assertFalse(journal.needs_compaction())
+        # the process is killed while the last record is being written
+        with open(journal.journal_file_name, 'a', encoding='utf8') as journal_file:
+            journal_file.write('["привет", "как де')
+        journal.close()
+
+        knowledge_base, journal, replayed_num = self.read_knowledge_base()
+        self.assertEqual(replayed_num, 50)
+        self.assertEqual(dict(knowledge_base.items()), self.knowledge)
+
+        # the replayed journal is compacted into the snapshot, so it isn't applied twice
+        self.append_changes(journal, 10)
+        journal.close()
+        knowledge_base, journal, replayed_num = self.read_knowledge_base()
+        journal.close()
+        self.assertEqual(replayed_num, 10)
+        self.assertEqual(dict(knowledge_base.items()), self.knowledge)
+
+    def test_outdated_journal(self) -> None:
+        _, journal, _ = self.read_knowledge_base()
+        self.append_changes(journal, 10)
+        journal.close()
+
+        # the process is killed after the compacted snapshot is written but before the journal is emptied
+        knowledge_base = persistence.RatedKnowledgeBase(self.knowledge)
+        persistence.write_json(knowledge_base.to_json(), self.snapshot_file_name, indent=None)
+
+        knowledge_base, journal, replayed_num = self.read_knowledge_base()
+        journal.close()
+        self.assertEqual(replayed_num, 0)
+        self.assertEqual(dict(knowledge_base.items()), self.knowledge)
+
+    def test_compaction_period(self) -> None:
+        knowledge_base = persistence.RatedKnowledgeBase(json_manager.read(self.snapshot_file_name))
+        journal = persistence.KnowledgeJournal(self.snapshot_file_name, compaction_period=5)
+        journal.replay(knowledge_base)
+        for pattern, reply, rating_change in make_changes(self.generator, 5):
+            knowledge_base.add_rating(pattern, reply, rating_change)
+            journal.append(pattern, reply, rating_change)
+        self.assertTrue(journal.needs_compaction())
+
+        journal.compact(knowledge_base)
+        self.assertFalse(journal.needs_compaction())
+        journal.close()
+        read_knowledge_base, journal, replayed_num = self.read_knowledge_base()
+        journal.close()
+        self.assertEqual(replayed_num, 0)
+        self.assertEqual(dict(read_knowledge_base.items()), dict(knowledge_base.items()))
+
+
+class SQLiteKnowledgeBaseTest(unittest.TestCase):
+    """
+    Checks that the database keeps the same ratings as knowledge base kept in dictionaries
+    """
+
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.database_file_name = os.path.join(self._directory.name, 'rated_learning_model.sqlite3')
+        self.generator = random.Random(0)
+
+    def tearDown(self) -> None:
+        self._directory.cleanup()
+
+    def check_ratings(self, store: persistence.SQLiteKnowledgeBase, knowledge: Dict[str, Dict[str, int]]) -> None:
+        self.assertCountEqual(store.get_patterns(), knowledge)
+        for pattern, pattern_knowledge in knowledge.items():
+            self.assertEqual(store.get_ratings([pattern]), pattern_knowledge, pattern)
+
+    def test_migrate(self) -> None:
+        knowledge = dict()
+        apply_changes(knowledge, make_changes(self.generator, 50))
+
+        store = persistence.SQLiteKnowledgeBase(self.database_file_name)
+        self.assertFalse(store.is_migrated())
+        store.migrate(knowledge)
+        self.assertTrue(store.is_migrated())
+        store.close()
+
+        store = persistence.SQLiteKnowledgeBase(self.database_file_name)
+        self.assertTrue(store.is_migrated())
+        self.check_ratings(store, knowledge)
+        store.close()
+
+    def test_add_ratings(self) -> None:
+        knowledge = dict()
+        store = persistence.SQLiteKnowledgeBase(self.database_file_name)
+        for _ in range(20):
+            # changes of one transaction can change the same rating several times
+            changes = make_changes(self.generator, 10)
+            store.add_ratings(changes)
+            apply_changes(knowledge, changes)
+            self.check_ratings(store, knowledge)
+        store.close()
+
+    def test_many_patterns(self) -> None:
+        knowledge = {f'pattern{i}': {REPLIES[i % len(REPLIES)]: i % 7 - 3} for i in range(2500)}
+        store = persistence.SQLiteKnowledgeBase(self.database_file_name)
+        store.migrate(knowledge)
+
+        # patterns are split into several queries
+        ratings = dict()
+        for pattern_knowledge in knowledge.values():
+            for reply, rating in pattern_knowledge.items():
+                ratings[reply] = ratings.get(reply, 0) + rating
+        self.assertEqual(store.get_ratings(list(knowledge)), ratings)
+        store.close()
+
+
+class TopRatingsTest(unittest.TestCase):
+    """
+    Checks that only top rated replies are the same as the highest ones of all summed up ratings
+    """
+
+    @staticmethod
+    def make_knowledge(generator: random.Random) -> Dict[str, Dict[str, int]]:
+        replies = [f'ответ {i}' for i in range(30)]
+        return {f'pattern{i}': {generator.choice(replies): generator.randint(-10, 10) for _ in range(20)}
+                for i in range(20)}
+
+    def check_top_ratings(self,
+                          knowledge_base: Union[persistence.RatedKnowledgeBase, persistence.SQLiteKnowledgeBase],
+                          knowledge: Dict[str, Dict[str, int]], generator: random.Random) -> None:
+        for _ in range(300):
+            patterns = generator.sample(list(knowledge) + ['неизвестный'], generator.randint(0, 5))
+            ratings = dict()
+            for pattern in patterns:
+                for reply, rating in knowledge.get(pattern, dict()).items():
+                    ratings[reply] = ratings.get(reply, 0) + rating
+            non_negative = sorted((rating for rating in ratings.values() if rating >= 0), reverse=True)
+
+            for k in (None, 1, 2, 5, 100):
+                with self.subTest(patterns=patterns, k=k):
+                    top, negative = knowledge_base.get_top_ratings(patterns, k)
+                    self.assertEqual(negative, {reply: rating for reply, rating in ratings.items() if rating < 0})
+                    # replies with equal ratings can be chosen differently
+                    self.assertEqual(sorted(top.values(), reverse=True), non_negative[:k])
+                    for reply, rating in top.items():
+                        self.assertEqual(ratings[reply], rating)
+
+    def test_rated_knowledge_base(self) -> None:
+        generator = random.Random(0)
+        knowledge = self.make_knowledge(generator)
+        self.check_top_ratings(persistence.RatedKnowledgeBase(knowledge), knowledge, generator)
+
+    def test_sqlite_knowledge_base(self) -> None:
+        generator = random.Random(0)
+        knowledge = self.make_knowledge(generator)
+        with tempfile.TemporaryDirectory() as directory:
+            store = persistence.SQLiteKnowledgeBase(os.path.join(directory, 'rated_learning_model.sqlite3'))
+            store.migrate(knowledge)
+            self.check_top_ratings(store, knowledge, generator)
+            store.close()
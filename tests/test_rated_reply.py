@@ -0,0 +1,97 @@
+"""
+Tests of choosing rated replies with lists of phrases and with arrays aligned by phrases ids
+"""
+
+import os.path
+import random
+import tempfile
+import unittest
+from collections import Counter
+from typing import Dict, List, Optional
+
+import json_manager
+import texting_ai
+
+# critical values of chi-square distribution for significance level 0.001 by degrees of freedom
+CHI_SQUARE_CRITICAL_VALUES = {1: 10.828, 2: 13.816, 3: 16.266, 4: 18.467, 5: 20.515, 6: 22.458, 7: 24.322,
+                              8: 26.124, 9: 27.877}
+
+PHRASES = [f'phrase {i}' for i in range(10)]
+
+
+class FixedWeightsAgent(texting_ai.RatingRandomReplyAgent):
+    """
+    Agent with weights of phrases that aren't decreased by chosen replies,
+    so every reply is chosen from the same distribution
+    """
+
+    def _decrease_weight(self, reply: Optional[str]) -> None:
+        pass
+
+
+def get_chi_square(first_counts: Counter, second_counts: Counter) -> float:
+    """
+    Calculates chi-square statistic of the test that two samples have the same distribution
+    :param first_counts: numbers of values in the first sample
+    :param second_counts: numbers of values in the second sample
+    :return: statistic
+    """
+    first_total, second_total = sum(first_counts.values()), sum(second_counts.values())
+    statistic = 0
+    for value in set(first_counts).union(second_counts):
+        value_total = first_counts[value] + second_counts[value]
+        for counts, total in ((first_counts, first_total), (second_counts, second_total)):
+            expected = value_total * total / (first_total + second_total)
+            statistic += (counts[value] - expected) ** 2 / expected
+    return statistic
+
+
+class RatedReplyTest(unittest.TestCase):
+    """
+    Checks that the vectorized path chooses replies with the same frequencies as the scalar one
+    """
+
+    samples_num = 20000
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls._directory = tempfile.TemporaryDirectory()
+        cls.phrases_path = os.path.join(cls._directory.name, 'phrases.json')
+        json_manager.write({phrase: [] for phrase in PHRASES}, cls.phrases_path)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls._directory.cleanup()
+
+    def make_agent(self, vectorized: bool) -> FixedWeightsAgent:
+        agent = FixedWeightsAgent(self.phrases_path, vectorized)
+        # phrases given as replies before have lower weights
+        for phrase, times in ((PHRASES[0], 1), (PHRASES[4], 2), (PHRASES[7], 1)):
+            for _ in range(times):
+                texting_ai.RatingRandomReplyAgent._decrease_weight(agent, phrase)
+        return agent
+
+    def sample(self, vectorized: bool, rated_replies: Dict[str, int], replies: List[str], black_list: List[str],
+               no_empty_reply: bool) -> Counter:
+        agent = self.make_agent(vectorized)
+        random.seed(vectorized)
+        return Counter(agent.get_rated_reply(rated_replies, replies, black_list, no_empty_reply)[0]
+                       for _ in range(self.samples_num))
+
+    def check_same_frequencies(self, rated_replies: Dict[str, int], replies: List[str], black_list: List[str],
+                               no_empty_reply: bool) -> None:
+        scalar_counts = self.sample(False, rated_replies, replies, black_list, no_empty_reply)
+        vectorized_counts = self.sample(True, rated_replies, replies, black_list, no_empty_reply)
+
+        self.assertEqual(set(scalar_counts), set(vectorized_counts))
+        self.assertFalse(set(black_list).intersection(vectorized_counts))
+        degrees_of_freedom = len(scalar_counts) - 1
+        self.assertLess(get_chi_square(scalar_counts, vectorized_counts),
+                        CHI_SQUARE_CRITICAL_VALUES[degrees_of_freedom])
+
+    def test_rated_and_given_replies(self) -> None:
+        self.check_same_frequencies({PHRASES[0]: 3, PHRASES[1]: 1, PHRASES[2]: 0, PHRASES[3]: -2},
+                                    [PHRASES[4]], [PHRASES[5]], False)
+
+    def test_all_phrases_without_possible_replies(self) -> None:
+        self.check_same_frequencies({PHRASES[0]: -1, PHRASES[2]: 2}, list(), [PHRASES[1], PHRASES[2]], True)
@@ -0,0 +1,133 @@
+"""
+Tests of learning ratings of replies
+"""
+
+import os.path
+import random
+import tempfile
+import threading
+import unittest
+from typing import Dict, List, Tuple
+
+import persistence
+import texting_ai
+
+PATTERN_DELIMITER = '.* '
+REPLIES = ['привет', 'как дела?', 'хорошо', 'нет', 'да', 'ну и ладно', 'рей']
+PATTERNS = ['привет', 'как.* дел', 'рей', 'ева.* 01', 'нет.* да']
+TEXTS = ['привет', 'как дела?', 'рей, как дела', 'ева 01', 'нет, да', 'привет, рей! нет да', 'пока']
+
+
+class SQLiteMigrationTest(unittest.TestCase):
+    """
+    Checks that knowledge base with not compacted journal is migrated into the database without losing ratings
+    """
+
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.save_file_name = os.path.join(self._directory.name, 'rated_learning_model.json')
+        self.database_file_name = os.path.join(self._directory.name, 'rated_learning_model.sqlite3')
+
+    def tearDown(self) -> None:
+        self._directory.cleanup()
+
+    def test_migration(self) -> None:
+        generator = random.Random(0)
+        knowledge_base = persistence.RatedKnowledgeBase()
+        agent = texting_ai.RatingLearningAgent(self.save_file_name, journal_compaction_period=30)
+        for _ in range(50):
+            patterns, reply = generator.sample(PATTERNS, generator.randint(1, 3)), generator.choice(REPLIES)
+            rating_change = generator.randint(-3, 3)
+            agent.rating_learn_patterns(patterns, reply, rating_change)
+            for pattern in patterns:
+                knowledge_base.add_rating(pattern, reply, rating_change)
+        agent.close()
+        # the last changes are only in the journal
+        self.assertGreater(os.path.getsize(self.save_file_name + '.journal'), 100)
+
+        pattern_index = texting_ai.PatternIndex(PATTERN_DELIMITER, PATTERNS)
+        # the second agent checks that ratings aren't migrated twice
+        for _ in range(2):
+            agent = texting_ai.SQLiteRatingLearningAgent(self.database_file_name, self.save_file_name)
+            self.assertEqual(agent.get_patterns_num(), len(PATTERNS))
+            for text in TEXTS:
+                self.assertEqual(agent.get_rated_replies(text),
+                                 knowledge_base.get_top_ratings(pattern_index.find(text)), text)
+            agent.close()
+
+
+class ConcurrentCompactionTest(unittest.TestCase):
+    """
+    Checks that ratings learned while the knowledge base is being compacted are not lost
+    """
+
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.save_file_name = os.path.join(self._directory.name, 'rated_learning_model.json')
+        self.database_file_name = os.path.join(self._directory.name, 'rated_learning_model.sqlite3')
+
+        generator = random.Random(0)
+        self.patterns = [f'шаблон{i}' for i in range(1000)]
+        self.changes = [(generator.sample(self.patterns, generator.randint(1, 3)), generator.choice(REPLIES),
+                         generator.randint(-2, 2)) for _ in range(6000)]
+        # only zero ratings are removed, so compaction doesn't change non-zero ratings
+        self.policy = persistence.CompactionPolicy(drop_zero=True)
+
+    def tearDown(self) -> None:
+        self._directory.cleanup()
+
+    def get_expected_ratings(self) -> Dict[str, Dict[str, int]]:
+        knowledge = dict()
+        for patterns, reply, rating_change in self.changes:
+            for pattern in patterns:
+                pattern_knowledge = knowledge.setdefault(pattern, dict())
+                pattern_knowledge[reply] = pattern_knowledge.get(reply, 0) + rating_change
+        return remove_zero_ratings(knowledge)
+
+    def learn_while_compacting(self, agent: texting_ai.RatingLearningAgent) -> None:
+        # the knowledge base is filled before compaction, the rest is learned meanwhile
+        for patterns, reply, rating_change in self.changes[:len(self.changes) // 2]:
+            agent.rating_learn_patterns(patterns, reply, rating_change)
+
+        def learn() -> None:
+            for learned_patterns, learned_reply, learned_rating_change in self.changes[len(self.changes) // 2:]:
+                agent.rating_learn_patterns(learned_patterns, learned_reply, learned_rating_change)
+
+        learning_thread = threading.Thread(target=learn)
+        learning_thread.start()
+        compactions_num = 0
+        while learning_thread.is_alive() or not compactions_num:
+            agent.compact_knowledge_base(self.policy)
+            compactions_num += 1
+        learning_thread.join()
+        agent.close()
+
+    def test_rating_learning_agent(self) -> None:
+        agent = texting_ai.RatingLearningAgent(self.save_file_name, journal_compaction_period=2000)
+        self.learn_while_compacting(agent)
+        self.assertEqual(remove_zero_ratings(dict(agent.knowledge_base.items())), self.get_expected_ratings())
+
+        # ratings learned after the last snapshot are replayed from the journal
+        agent = texting_ai.RatingLearningAgent(self.save_file_name)
+        agent.close()
+        self.assertEqual(remove_zero_ratings(dict(agent.knowledge_base.items())), self.get_expected_ratings())
+
+    def test_sqlite_rating_learning_agent(self) -> None:
+        agent = texting_ai.SQLiteRatingLearningAgent(self.database_file_name)
+        self.learn_while_compacting(agent)
+
+        store = persistence.SQLiteKnowledgeBase(self.database_file_name)
+        knowledge = {pattern: store.get_ratings([pattern]) for pattern in store.get_patterns()}
+        store.close()
+        self.assertEqual(remove_zero_ratings(knowledge), self.get_expected_ratings())
+
+
+def remove_zero_ratings(knowledge: Dict[str, Dict[str, int]]) -> Dict[str, Dict[str, int]]:
+    """
+    Removes zero ratings that don't affect replies and can be removed by compaction
+    :param knowledge: patterns with replies and their ratings
+    :return: patterns with non-zero ratings
+    """
+    knowledge = {pattern: {reply: rating for reply, rating in pattern_knowledge.items() if rating}
+                 for pattern, pattern_knowledge in knowledge.items()}
+    return {pattern: pattern_knowledge for pattern, pattern_knowledge in knowledge.items() if pattern_knowledge}
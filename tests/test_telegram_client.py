@@ -0,0 +1,86 @@
+"""
+Tests of the asynchronous client of Telegram Bot API with a local fake Bot API server
+"""
+
+import time
+from typing import List
+
+from aiohttp import web
+from aiohttp.test_utils import AioHTTPTestCase
+
+import telegram_client
+
+TOKEN = 'test-token'
+GROUP_CHAT_ID = -100
+
+
+class TelegramClientTest(AioHTTPTestCase):
+    """
+    Checks retries and rate limits of calls made to the fake server
+    """
+
+    async def get_application(self) -> web.Application:
+        # names of called methods with times of the calls
+        self.calls: List[str] = list()
+        self.call_times: List[float] = list()
+        # how many of the next calls are answered with "Too Many Requests"
+        self.rate_limited_calls = 0
+        self.retry_after = 1
+
+        async def handle(request: web.Request) -> web.Response:
+            method = request.match_info['method']
+            self.calls.append(method)
+            self.call_times.append(time.monotonic())
+            if self.rate_limited_calls > 0:
+                self.rate_limited_calls -= 1
+                return web.json_response({'ok': False, 'error_code': 429,
+                                          'description': f'Too Many Requests: retry after {self.retry_after}',
+                                          'parameters': {'retry_after': self.retry_after}})
+
+            params = await request.json()
+            return web.json_response({'ok': True, 'result': {'message_id': 1, 'chat': {'id': params['chat_id']}}
+                                      if method == 'sendMessage' else True})
+
+        app = web.Application()
+        app.router.add_post(f'/bot{TOKEN}/{{method}}', handle)
+        return app
+
+    async def asyncSetUp(self) -> None:
+        await super().asyncSetUp()
+        self.client = telegram_client.TelegramClient(TOKEN, str(self.server.make_url('')),
+                                                     group_chat_interval=0.5)
+
+    async def asyncTearDown(self) -> None:
+        await self.client.close()
+        await super().asyncTearDown()
+
+    async def test_retry_after(self) -> None:
+        self.rate_limited_calls = 1
+
+        message = await self.client.send_message(GROUP_CHAT_ID, 'text')
+
+        self.assertEqual(message['chat']['id'], GROUP_CHAT_ID)
+        self.assertEqual(self.calls, ['sendMessage', 'sendMessage'])
+        self.assertGreaterEqual(self.call_times[1] - self.call_times[0], self.retry_after - 0.05)
+        self.assertEqual(self.client.stats['rate limited'], 1)
+        self.assertEqual(self.client.stats['errors'], 0)
+
+    async def test_retries_are_limited(self) -> None:
+        self.client.max_retries = 1
+        self.rate_limited_calls = 2
+
+        with self.assertRaises(telegram_client.TelegramError) as context:
+            await self.client.send_chat_action(GROUP_CHAT_ID, 'typing')
+
+        self.assertEqual(context.exception.error_code, 429)
+        self.assertEqual(len(self.calls), 2)
+
+    async def test_group_interval_applies_only_to_messages(self) -> None:
+        start = time.monotonic()
+        await self.client.send_chat_action(GROUP_CHAT_ID, 'typing')
+        await self.client.send_message(GROUP_CHAT_ID, 'text')
+        await self.client.edit_message_reply_markup(GROUP_CHAT_ID, 1)
+        self.assertLess(time.monotonic() - start, self.client.group_chat_interval)
+
+        await self.client.send_message(GROUP_CHAT_ID, 'text')
+        self.assertGreaterEqual(self.call_times[-1] - self.call_times[1], self.client.group_chat_interval - 0.05)
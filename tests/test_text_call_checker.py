@@ -0,0 +1,63 @@
+"""
+Tests of checking calling constructions in texts
+"""
+
+import os.path
+import random
+import re
+import tempfile
+import unittest
+from typing import Iterable
+
+import json_manager
+import texting_ai
+
+PUNCT_SYMBOLS = ',.!?'
+
+
+def check_each_name(names: Iterable[str], text: str) -> bool:
+    """
+    Checks calling constructions with each name separately
+    :param names: names the bot is called by
+    :param text: text to check
+    :return: True if text contains the construction else False
+    """
+    text = text.replace('\n', '')
+    punct_symbols_string = r'\,\.\!\?'
+    for name in names:
+        for regex_string in [f'^{name}$', f'^{name}[{punct_symbols_string}]', f'[{punct_symbols_string}] {name}\\?']:
+            if re.search(regex_string, text, re.I):
+                return True
+    return False
+
+
+class TextCallCheckerTest(unittest.TestCase):
+    """
+    Checks that one regex with all names finds the same calling constructions as checking each name
+    """
+
+    texts = [
+        'рей', 'Рей', 'РЕЙ АЯНАМИ', 'аянами рей', 'рей!', 'Рей, привет', 'рей аянами?', 'Рейка', 'рейка!',
+        'аянамир', 'аянами рейка', 'привет, рей?', 'привет,рей?', 'привет! Аянами?', 'привет. рей', 'рей ',
+        ' рей', 'ну рей?', 'Ну что, рей аянами?', 'что? аянами рей?', 'ре\nй', 'привет\n, рей?', '', '?',
+    ]
+
+    def test_default_names(self) -> None:
+        checker = texting_ai.TextCallChecker()
+        for text in self.texts:
+            self.assertEqual(checker.check(text), check_each_name(checker.names, text), text)
+        self.assertEqual(checker.check_many(self.texts), [check_each_name(checker.names, x) for x in self.texts])
+
+    def test_names_that_are_prefixes(self) -> None:
+        names = ['ева', 'ев', 'евангелион', 'ева 01']
+        with tempfile.TemporaryDirectory() as directory:
+            names_path = os.path.join(directory, 'names.json')
+            json_manager.write(names, names_path)
+            checker = texting_ai.TextCallChecker(names_path)
+
+        generator = random.Random(0)
+        words = names + ['евка', 'лев', 'привет', 'ЕВА', 'Ев']
+        for _ in range(2000):
+            text = ''.join(generator.choice(words) + generator.choice(['', ' '] + list(PUNCT_SYMBOLS) + ['? ', ', '])
+                           for _ in range(generator.randint(1, 4)))
+            self.assertEqual(checker.check(text), check_each_name(names, text), text)
@@ -0,0 +1,70 @@
+"""
+Tests of sampling items by their weights with Fenwick tree
+"""
+
+import random
+import unittest
+from typing import List
+
+import weighted_sampling
+
+
+class WeightedSamplerTest(unittest.TestCase):
+    """
+    Checks that the tree keeps sums of weights after changes and samples only items with positive weights
+    """
+
+    def check_sums(self, sampler: weighted_sampling.WeightedSampler, weights: List[int]) -> None:
+        self.assertEqual(len(sampler), len(weights))
+        self.assertEqual([sampler.get_weight(i) for i in range(len(weights))], weights)
+        self.assertEqual(sampler.get_total(), sum(weights))
+        # the tree built from scratch is the same as the changed one
+        self.assertEqual(sampler._tree, weighted_sampling.WeightedSampler(weights)._tree)
+
+    def test_changes(self) -> None:
+        generator = random.Random(0)
+        weights = [generator.randint(0, 10) for _ in range(13)]
+        sampler = weighted_sampling.WeightedSampler(weights)
+        self.check_sums(sampler, weights)
+
+        for _ in range(1000):
+            action = generator.randrange(3)
+            if action == 0:
+                weight = generator.randint(0, 10)
+                sampler.append(weight)
+                weights.append(weight)
+            elif action == 1 and weights:
+                self.assertEqual(sampler.pop(), weights.pop())
+            elif weights:
+                index, weight = generator.randrange(len(weights)), generator.randint(0, 10)
+                sampler.set_weight(index, weight)
+                weights[index] = weight
+            self.check_sums(sampler, weights)
+
+    def test_sample(self) -> None:
+        random.seed(0)
+        weights = [0, 1, 0, 3, 6, 0]
+        sampler = weighted_sampling.WeightedSampler(weights)
+
+        counts = [0] * len(weights)
+        for _ in range(10000):
+            counts[sampler.sample()] += 1
+        for count, weight in zip(counts, weights):
+            self.assertAlmostEqual(count / 10000, weight / sum(weights), delta=0.02)
+
+        for _ in range(100):
+            self.assertIn(sampler.sample({1: 0, 2: 5}, [4]), (2, 3))
+        # overrides and exclusions don't change the stored weights
+        self.check_sums(sampler, weights)
+
+        self.assertIsNone(sampler.sample(excluded=[1, 3, 4]))
+        self.assertIsNone(weighted_sampling.WeightedSampler([]).sample())
+
+    def test_sample_uniform(self) -> None:
+        random.seed(0)
+        for excluded in [set(), {0, 2}, {0, 1, 2, 4}, {-1, 7}]:
+            chosen = weighted_sampling.sample_uniform(5, excluded, 200)
+            self.assertEqual(len(chosen), 200)
+            self.assertEqual(set(chosen), set(range(5)) - excluded)
+        self.assertEqual(weighted_sampling.sample_uniform(3, {0, 1, 2}, 5), [])
+        self.assertEqual(weighted_sampling.sample_uniform(3, set(), 0), [])
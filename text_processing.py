@@ -2,10 +2,13 @@
 Module for processing Russian text
 """
 
-from typing import Set, Tuple
+import threading
+from collections import OrderedDict
+from typing import Set, Tuple, List, Union, Dict, Hashable, Any, Optional, FrozenSet
 from nltk.stem.snowball import RussianStemmer
-from nltk import pos_tag
-from nltk.tokenize import word_tokenize
+from nltk import pos_tag, pos_tag_sents
+from nltk.tokenize import word_tokenize, sent_tokenize
+import json_manager
 import logger
 
 # object which will stem the word
@@ -18,6 +21,70 @@ PARTICULAR_STEMMED_CASES = {
 }
 
 
+class LRUCache:
+    """
+    Size-bounded cache that drops the least recently used values first
+    """
+
+    def __init__(self, max_size: int):
+        """
+        :param max_size: maximum number of cached values
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._values: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Gets cached value and counts hit or miss
+        :param key: key of the value
+        :return: cached value or None if there is no such one
+        """
+        with self._lock:
+            value = self._values.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._values.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Caches value dropping the least recently used one if the cache is full
+        :param key: key of the value
+        :param value: value to cache, None values are not cached
+        :return: None
+        """
+        if value is None:
+            return
+
+        with self._lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+            if len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+
+    def info(self) -> Dict[str, int]:
+        """
+        Gets cache statistics
+        :return: numbers of hits, misses, cached values and maximum size
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._values), 'max size': self.max_size}
+
+
+# cached stemmed forms of words
+STEM_CACHE = LRUCache(50000)
+# cached nouns of sentences
+NOUNS_CACHE = LRUCache(10000)
+
+
 def stem(word: str) -> str:
     """
     Stems given word using snowball algorithm.
@@ -32,7 +99,15 @@ def stem(word: str) -> str:
         LOGGER.error("input value is not a string")
         return None
 
-    return PARTICULAR_STEMMED_CASES.get(word.lower(), STEMMER.stem(word))
+    if word.lower() in PARTICULAR_STEMMED_CASES:
+        return PARTICULAR_STEMMED_CASES[word.lower()]
+
+    stemmed = STEM_CACHE.get(word)
+    if stemmed is None:
+        stemmed = STEMMER.stem(word)
+        STEM_CACHE.put(word, stemmed)
+
+    return stemmed
 
 
 def get_nouns(sentence: str) -> Set[str]:
@@ -50,13 +125,173 @@ def get_nouns(sentence: str) -> Set[str]:
         LOGGER.error("input value is not a string")
         return set()
 
-    words = word_tokenize(sentence)
-    tagged: Tuple[str, str] = pos_tag(words, lang='rus')
+    nouns: FrozenSet[str] = NOUNS_CACHE.get(sentence)
+    if nouns is None:
+        words = word_tokenize(sentence)
+        tagged: Tuple[str, str] = pos_tag(words, lang='rus')
 
-    nouns = set()
-    for word, tag in tagged:
         # Checking if a word is a noun because for a noun the tag will be "S"
-        if tag == 'S':
-            nouns.add(word.lower())
+        nouns = frozenset(word.lower() for word, tag in tagged if tag == 'S')
+        NOUNS_CACHE.put(sentence, nouns)
+
+    return set(nouns)
+
+
+def get_sentences_nouns(sentences: List[str]) -> List[Set[str]]:
+    """
+    Produces nouns of each sentence as get_nouns() does
+    but tags all sentences that are not cached at once
+    :param sentences: text strings each of which contains one sentence
+    :return: found nouns of each sentence
+    """
+
+    sentences_nouns: List[Optional[FrozenSet[str]]] = [NOUNS_CACHE.get(sentence) if sentence else frozenset()
+                                                       for sentence in sentences]
+    not_cached = [i for i, nouns in enumerate(sentences_nouns) if nouns is None]
+
+    tagged_sentences = pos_tag_sents([word_tokenize(sentences[i]) for i in not_cached], lang='rus')
+    for i, tagged in zip(not_cached, tagged_sentences):
+        # Checking if a word is a noun because for a noun the tag will be "S"
+        sentences_nouns[i] = frozenset(word.lower() for word, tag in tagged if tag == 'S')
+        NOUNS_CACHE.put(sentences[i], sentences_nouns[i])
+
+    return [set(nouns) for nouns in sentences_nouns]
+
+
+def seed_caches(nouns_json_path: str, sentences_json_path: Optional[str] = None) -> None:
+    """
+    Fills caches of stem() and get_nouns() with known results
+    :param nouns_json_path: path to json with nouns and their stemmed forms
+    :param sentences_json_path: path to json with sentences and their nouns
+    :return: None
+    """
+    for noun, stemmed in json_manager.read(nouns_json_path).items():
+        # particular cases are not cached for being always taken from PARTICULAR_STEMMED_CASES
+        if noun.lower() not in PARTICULAR_STEMMED_CASES:
+            STEM_CACHE.put(noun, stemmed)
+
+    if sentences_json_path:
+        for sentence, nouns in json_manager.read(sentences_json_path).items():
+            NOUNS_CACHE.put(sentence, frozenset(nouns))
+
+    LOGGER.info(f'stem cache is seeded: {STEM_CACHE.info()}, nouns cache is seeded: {NOUNS_CACHE.info()}')
+
+
+def prewarm() -> None:
+    """
+    Loads models of NLTK that are loaded lazily when they are used the first time:
+    punkt sentences tokenizer, parts of speech tagger and the stemmer
+    :return: None
+    """
+    sentences = sent_tokenize('Привет. Как дела?')
+    pos_tag_sents([word_tokenize(sentence, preserve_line=True) for sentence in sentences], lang='rus')
+    STEMMER.stem('привет')
+
+
+class AnalyzedMessage:
+    """
+    Results of processing of one input text.
+    Each of them is computed only once when it's needed the first time
+    so the text is tokenized and tagged only once for all agents
+    """
+
+    def __init__(self, text: str):
+        """
+        :param text: input text
+        """
+        self.text = text
 
-    return nouns
+        self._lowered: str = None
+        self._single_line: str = None
+        self._sentences: List[str] = None
+        self._sentences_tokens: List[List[str]] = None
+        self._tokens: List[str] = None
+        self._stems: List[str] = None
+        self._tagged_sentences: List[List[Tuple[str, str]]] = None
+
+    def __str__(self) -> str:
+        return self.text
+
+    def precompute(self) -> 'AnalyzedMessage':
+        """
+        Computes results that agents use, so they aren't computed while agents are called
+        :return: this message
+        """
+        # the properties keep their results
+        _ = self.tagged_sentences, self.stems
+        return self
+
+    @property
+    def lowered(self) -> str:
+        """
+        :return: text in lower case
+        """
+        if self._lowered is None:
+            self._lowered = self.text.lower()
+        return self._lowered
+
+    @property
+    def single_line(self) -> str:
+        """
+        :return: text without line breaks
+        """
+        if self._single_line is None:
+            self._single_line = self.text.replace("\n", "")
+        return self._single_line
+
+    @property
+    def sentences(self) -> List[str]:
+        """
+        :return: sentences of the text
+        """
+        if self._sentences is None:
+            self._sentences = sent_tokenize(self.text)
+        return self._sentences
+
+    @property
+    def sentences_tokens(self) -> List[List[str]]:
+        """
+        :return: words and punctuation symbols of each sentence
+        """
+        if self._sentences_tokens is None:
+            self._sentences_tokens = [word_tokenize(sentence, preserve_line=True) for sentence in self.sentences]
+        return self._sentences_tokens
+
+    @property
+    def tokens(self) -> List[str]:
+        """
+        :return: words and punctuation symbols of the text
+        """
+        if self._tokens is None:
+            self._tokens = [token for sentence_tokens in self.sentences_tokens for token in sentence_tokens]
+        return self._tokens
+
+    @property
+    def stems(self) -> List[str]:
+        """
+        :return: stemmed tokens of the text
+        """
+        if self._stems is None:
+            self._stems = list(map(stem, self.tokens))
+        return self._stems
+
+    @property
+    def tagged_sentences(self) -> List[List[Tuple[str, str]]]:
+        """
+        :return: tokens of each sentence tagged with parts of speech
+        """
+        if self._tagged_sentences is None:
+            # the tagger is loaded once for all sentences
+            self._tagged_sentences = pos_tag_sents(self.sentences_tokens, lang='rus')
+        return self._tagged_sentences
+
+
+def analyze(text: Union[str, AnalyzedMessage]) -> AnalyzedMessage:
+    """
+    Makes analyzed message out of text if it's not analyzed yet
+    :param text: input text or analyzed message
+    :return: analyzed message
+    """
+    if isinstance(text, AnalyzedMessage):
+        return text
+    return AnalyzedMessage(text)
@@ -6,20 +6,40 @@ import os.path
 import random
 import math
 import re
-from typing import List, Dict, Optional, Type, Tuple
+import threading
+from functools import lru_cache
+from typing import List, Dict, Optional, Type, Tuple, Set, Iterable, Union, Sequence, Mapping
 import time
 
+import numpy
 from nltk import pos_tag
-from nltk.tokenize import sent_tokenize, word_tokenize
+from nltk.tokenize import word_tokenize
 
 import json_manager
 import logger
+import metrics
+import persistence
 import text_processing
+import weighted_sampling
+from language_pack import LanguagePack
 
 LOGGER = logger.get_logger(__file__)
 
 random.seed(int(time.time()))
 
+AGENT_CALLS = metrics.Counter('agent_calls_total', 'Number of calls of agents in pipeline', ['agent'])
+AGENT_ERRORS = metrics.Counter('agent_errors_total', 'Number of calls of agents that raised errors', ['agent'])
+AGENT_CANDIDATES = metrics.Counter('agent_candidates_total',
+                                   'Number of reply candidates or replies produced by agents', ['agent'])
+AGENT_LATENCY = metrics.Histogram('agent_latency_seconds', 'Duration of calls of agents', label_names=['agent'])
+MESSAGES = metrics.Counter('controller_messages_total', 'Number of messages processed by controller', ['result'])
+MESSAGE_LATENCY = metrics.Histogram('controller_latency_seconds', 'Duration of processing of a message by controller')
+PATTERN_MATCHES = metrics.Histogram('pattern_matches', 'Number of learned patterns found in a message',
+                                    (0, 1, 2, 3, 5, 10, 20, 50, 100))
+LEARN_LATENCY = metrics.Histogram('learn_latency_seconds', 'Duration of learning rating changes')
+COMPACTION_REMOVED = metrics.Counter('knowledge_base_compaction_removed_total',
+                                     'Number of patterns, ratings, replies and bytes removed by compaction', ['kind'])
+
 
 class NounsFindingAgent:
     """
@@ -27,75 +47,247 @@ class NounsFindingAgent:
     depending on nouns in the input
     """
 
-    def __init__(self, phrases_json_path: str, nouns_json_path: str):
+    def __init__(self, phrases_json_path: str, nouns_json_path: str,
+                 language_pack: Optional[LanguagePack] = None):
+        """
+        :param phrases_json_path: path to json with sentences and their nouns
+        :param nouns_json_path: path to json with nouns and their stemmed forms
+        :param language_pack: pack with the same data that is used instead of json files if it's given
+        """
+        self._language_pack = language_pack
+        if language_pack:
+            # the pack is searched directly and its data are read only when a diff is applied
+            self._phrases_data: Optional[Dict[str, List[str]]] = None
+            self._nouns_data: Optional[Dict[str, str]] = None
+            self.noun_sentences: Optional[Dict[Optional[str], List[str]]] = None
+            self.stemmed_nouns: Optional[Dict[str, List[str]]] = None
+            self._sentences, self._sentences_ids, self._stem_sentences = \
+                language_pack.sentences, language_pack.sentences_ids, language_pack.stem_sentences
+            return
+
         # load data from input json
-        phrases_data = json_manager.read(phrases_json_path)
+        # sentences with lists of their nouns and nouns with their stemmed forms
+        self._phrases_data = json_manager.read(phrases_json_path)
+        self._nouns_data = json_manager.read(nouns_json_path)
+
+        self._build_index()
+
+    def _build_index(self) -> None:
+        """
+        Builds dictionaries for searching sentences from sentences and nouns data
+        :return: None
+        """
 
         # dictionary with words as keys
         # and array of sentences that contain these words
-        self.noun_sentences: Dict[Optional[str], List[str]] = dict()
+        noun_sentences: Dict[Optional[str], List[str]] = dict()
 
         # for sentences without nouns
-        self.noun_sentences[None] = list()
+        noun_sentences[None] = list()
 
         # iterating through phrases data and storing nouns with sentences
-        for sentence, nouns in phrases_data.items():
+        for sentence, nouns in self._phrases_data.items():
             if nouns:
                 for noun in nouns:
                     # if the noun occurs the first time set an empty array
-                    if noun not in self.noun_sentences:
-                        self.noun_sentences[noun] = list()
-                    self.noun_sentences[noun].append(sentence)
+                    if noun not in noun_sentences:
+                        noun_sentences[noun] = list()
+                    noun_sentences[noun].append(sentence)
             else:
                 # add sentence without nouns
-                self.noun_sentences[None].append(sentence)
-
-        # load data from input json
-        nouns_data = json_manager.read(nouns_json_path)
+                noun_sentences[None].append(sentence)
 
         # dictionary with stemmed forms as keys
         # and lists of possible nouns that can have this stemmed form as values
-        self.stemmed_nouns: Dict[str, List[str]] = dict()
+        stemmed_nouns: Dict[str, List[str]] = dict()
 
-        for noun, stemmed in nouns_data.items():
+        for noun, stemmed in self._nouns_data.items():
             # if the stemmed form occurs the first time
             # add entry with an empty list
-            if stemmed not in self.stemmed_nouns:
-                self.stemmed_nouns[stemmed] = list()
-            self.stemmed_nouns[stemmed].append(noun)
+            if stemmed not in stemmed_nouns:
+                stemmed_nouns[stemmed] = list()
+            stemmed_nouns[stemmed].append(noun)
+
+        # sentences are identified by their indices in this list
+        sentences: List[str] = list(self._phrases_data.keys())
+        sentences_ids: Dict[str, int] = {sentence: i for i, sentence in enumerate(sentences)}
+
+        # dictionary with stemmed forms as keys and ids of sentences containing nouns with this form as values
+        # with the number of such nouns in the sentence
+        stem_sentences: Dict[str, Dict[int, int]] = dict()
+        for stemmed, nouns in stemmed_nouns.items():
+            sentences_counts: Dict[int, int] = dict()
+            for noun in nouns:
+                for sentence in noun_sentences.get(noun, ()):
+                    sentence_id = sentences_ids[sentence]
+                    sentences_counts[sentence_id] = sentences_counts.get(sentence_id, 0) + 1
+            if sentences_counts:
+                stem_sentences[stemmed] = sentences_counts
+
+        # replacing all at once so replies being searched at the same time use consistent data
+        self.noun_sentences, self.stemmed_nouns = noun_sentences, stemmed_nouns
+        self._sentences, self._sentences_ids, self._stem_sentences = sentences, sentences_ids, stem_sentences
+
+    def _count_sentence(self, sentence_id: int, nouns: List[str], change: int) -> None:
+        """
+        Changes numbers of nouns of sentence in sentences of stemmed forms of the nouns
+        :param sentence_id: id of the sentence
+        :param nouns: nouns of the sentence
+        :param change: how much the numbers should be changed
+        :return: None
+        """
+        for noun in nouns or ():
+            self._count_noun(noun, sentence_id, change)
+
+    def _count_noun(self, noun: str, sentence_id: int, change: int) -> None:
+        """
+        Changes number of nouns with the same stemmed form as noun in a sentence
+        :param noun: noun of the sentence
+        :param sentence_id: id of the sentence
+        :param change: how much the number should be changed
+        :return: None
+        """
+        stemmed = self._nouns_data.get(noun)
+        if stemmed is None:
+            return
+
+        sentences_counts = self._stem_sentences.setdefault(stemmed, dict())
+        count = sentences_counts.get(sentence_id, 0) + change
+        if count > 0:
+            sentences_counts[sentence_id] = count
+        else:
+            sentences_counts.pop(sentence_id, None)
+            if not sentences_counts:
+                del self._stem_sentences[stemmed]
 
-    def get_replies(self, input_text: str,
-                    black_list: Optional[List[str]] = None) -> Tuple[List[str]]:
+    def _remove_sentence(self, sentence: str) -> None:
+        """
+        Removes sentence from the index, the last sentence takes its id
+        :param sentence: known sentence
+        :return: None
+        """
+        nouns = self._phrases_data.pop(sentence)
+        sentence_id = self._sentences_ids.pop(sentence)
+        self._count_sentence(sentence_id, nouns, -1)
+        for noun in nouns or (None,):
+            self.noun_sentences[noun].remove(sentence)
+            if noun is not None and not self.noun_sentences[noun]:
+                del self.noun_sentences[noun]
+
+        last_sentence = self._sentences.pop()
+        if sentence_id < len(self._sentences):
+            last_nouns = self._phrases_data[last_sentence]
+            self._count_sentence(len(self._sentences), last_nouns, -1)
+            self._sentences[sentence_id] = last_sentence
+            self._sentences_ids[last_sentence] = sentence_id
+            self._count_sentence(sentence_id, last_nouns, 1)
+
+    def _add_sentence(self, sentence: str, nouns: List[str]) -> None:
+        """
+        Adds sentence to the index
+        :param sentence: new sentence
+        :param nouns: nouns of the sentence
+        :return: None
+        """
+        self._phrases_data[sentence] = nouns
+        self._sentences_ids[sentence] = len(self._sentences)
+        self._sentences.append(sentence)
+        for noun in nouns or (None,):
+            self.noun_sentences.setdefault(noun, list()).append(sentence)
+        self._count_sentence(self._sentences_ids[sentence], nouns, 1)
+
+    def _remove_noun(self, noun: str) -> None:
+        """
+        Removes noun with its stemmed form from the index
+        :param noun: known noun
+        :return: None
+        """
+        for sentence in self.noun_sentences.get(noun, ()):
+            self._count_noun(noun, self._sentences_ids[sentence], -1)
+
+        stemmed = self._nouns_data.pop(noun)
+        self.stemmed_nouns[stemmed].remove(noun)
+        if not self.stemmed_nouns[stemmed]:
+            del self.stemmed_nouns[stemmed]
+
+    def _add_noun(self, noun: str, stemmed: str) -> None:
+        """
+        Adds noun with its stemmed form to the index
+        :param noun: new noun
+        :param stemmed: stemmed form of the noun
+        :return: None
+        """
+        self._nouns_data[noun] = stemmed
+        self.stemmed_nouns.setdefault(stemmed, list()).append(noun)
+        for sentence in self.noun_sentences.get(noun, ()):
+            self._count_noun(noun, self._sentences_ids[sentence], 1)
+
+    def apply_diff(self, diff: Dict[str, Dict[str, Dict]]) -> None:
+        """
+        Applies changes of sentences and nouns files made by rebuilding them
+        by updating the index only for changed sentences and nouns.
+        Must be called in the thread that searches replies
+        :param diff: dictionary with "sentences" and "nouns" keys
+        and dictionaries with "added" and "removed" entries of the files as values
+        :return: None
+        """
+        if self._phrases_data is None:
+            # the pack can't be changed so its data are read once to be changed in memory
+            self._phrases_data = self._language_pack.read_sentences_nouns()
+            self._nouns_data = self._language_pack.read_nouns_stems()
+            self._build_index()
+
+        # sentences are counted by stemmed forms of their current nouns so they are removed first
+        # and added after nouns are changed, added ones that are known already are replaced
+        for sentence in set(diff['sentences']['removed']).union(diff['sentences']['added']):
+            if sentence in self._sentences_ids:
+                self._remove_sentence(sentence)
+        for noun in set(diff['nouns']['removed']).union(diff['nouns']['added']):
+            if noun in self._nouns_data:
+                self._remove_noun(noun)
+        for noun, stemmed in diff['nouns']['added'].items():
+            self._add_noun(noun, stemmed)
+        for sentence, nouns in diff['sentences']['added'].items():
+            self._add_sentence(sentence, nouns)
+
+        LOGGER.info(f'{len(diff["sentences"]["added"])} sentences are added and '
+                    f'{len(diff["sentences"]["removed"])} are removed')
+
+    def get_replies(self, input_text: Union[str, text_processing.AnalyzedMessage],
+                    black_list: Optional[List[str]] = None) -> Tuple[List[str], Dict[str, int]]:
         """
         Returns possible text outputs by
         searching known nouns in the input text
         and giving predefined phrases as a reply
-        :param input_text: text containing natural language
+        :param input_text: text containing natural language or its analysis
         :param black_list: replies to be omitted from possible variants
-        :return: possible reply variants
+        :return: possible reply variants without repetitions
+        and numbers of found nouns each of the variants was found by
         """
 
         if not input_text:
-            return list(),
+            return list(), dict()
 
-        words = word_tokenize(input_text)
+        analyzed_message = text_processing.analyze(input_text)
+        input_text = analyzed_message.text
 
-        stemmed_words = list(map(text_processing.stem, words))
+        stemmed_words = analyzed_message.stems
 
-        reply_variants = list()
+        variants_counts: Dict[int, int] = dict()
 
         # getting reply variants by checking each word if it is known
         for stemmed_word in stemmed_words:
-            if stemmed_word in self.stemmed_nouns:
+            if stemmed_word in self._stem_sentences:
                 LOGGER.info(f'"{stemmed_word}" is found in "{input_text}" text')
-                for noun in self.stemmed_nouns[stemmed_word]:
-                    # adding sentences with this noun
-                    reply_variants += self.noun_sentences[noun]
+                for sentence_id, count in self._stem_sentences[stemmed_word].items():
+                    variants_counts[sentence_id] = variants_counts.get(sentence_id, 0) + count
 
         # omitting variants from black list
-        reply_variants = list(filter(lambda x: x not in black_list, reply_variants))
+        black_list_ids = {self._sentences_ids[x] for x in black_list or () if x in self._sentences_ids}
+        variants_ids = [x for x in variants_counts.keys() if x not in black_list_ids]
 
-        return reply_variants,
+        reply_variants = [self._sentences[x] for x in variants_ids]
+        return reply_variants, dict(zip(reply_variants, (variants_counts[x] for x in variants_ids)))
 
 
 class LearningAgent:
@@ -109,20 +301,65 @@ class LearningAgent:
         'other': 'NONLEX'
     }
 
-    def __init__(self, save_file_name: str):
+    def __init__(self, save_file_name: str, flush_period: Optional[float] = None, flush_changes: int = 100):
         """
         :param save_file_name: name of a json file to write learned information
+        :param flush_period: [seconds] if it is given then learned information is written
+        in background not later than this period after learning, otherwise it's written immediately
+        :param flush_changes: number of learned changes that makes learned information
+        to be written in background immediately
         """
 
         self.pattern_delimiter = '.* '
 
         self.save_file_name = save_file_name
 
-        if os.path.isfile(save_file_name):
-            self.knowledge_base = json_manager.read(save_file_name)
+        self.knowledge_base = self._read_knowledge_base()
+
+        # for not writing knowledge base while it's changing
+        self._knowledge_lock = threading.RLock()
+
+        self._flusher = persistence.BackgroundFlusher(self._write_knowledge_base, flush_period, flush_changes) \
+            if flush_period else None
+
+    def _read_knowledge_base(self) -> Dict:
+        """
+        Reads knowledge base from the save file or creates the save file with an empty one
+        :return: knowledge base
+        """
+        if os.path.isfile(self.save_file_name):
+            return json_manager.read(self.save_file_name)
+
+        knowledge_base: Dict[str, Dict[str, List[str]]] = dict()
+        json_manager.write(knowledge_base, self.save_file_name)
+        return knowledge_base
+
+    def _write_knowledge_base(self) -> None:
+        """
+        Writes knowledge base to the save file
+        :return: None
+        """
+        with self._knowledge_lock:
+            persistence.write_json(self.knowledge_base, self.save_file_name)
+
+    def _save_knowledge_base(self, changes_num: int) -> None:
+        """
+        Writes knowledge base immediately or marks it to be written in background
+        :param changes_num: number of changes made in knowledge base
+        :return: None
+        """
+        if self._flusher:
+            self._flusher.mark_dirty(changes_num)
         else:
-            self.knowledge_base: Dict[str, Dict[str, List[str]]] = dict()
-            json_manager.write(self.knowledge_base, save_file_name)
+            self._write_knowledge_base()
+
+    def close(self) -> None:
+        """
+        Writes learned information that is not written yet and releases files of the knowledge base
+        :return: None
+        """
+        if self._flusher:
+            self._flusher.drain()
 
     def _is_simple(self, tagged_words: List[Tuple[str, str]]) -> bool:
         # are there any punctuation symbols other than in the end?
@@ -173,9 +410,29 @@ class LearningAgent:
         :return: regex string or None if it's impossible to make one
         """
 
-        patterns = list()
+        return self._make_patterns_from_tagged(pos_tag(word_tokenize(sentence), lang='rus'))
 
-        tagged = pos_tag(word_tokenize(sentence), lang='rus')
+    def _make_patterns(self, input_message: text_processing.AnalyzedMessage) -> List[str]:
+        """
+        Makes regex patterns out of each sentence of analyzed text
+        :param input_message: analyzed input text
+        :return: regex strings
+        """
+
+        return [pattern for tagged in input_message.tagged_sentences
+                for pattern in self._make_patterns_from_tagged(tagged)]
+
+    def _make_patterns_from_tagged(self, tagged: List[Tuple[str, str]]) -> List[str]:
+        """
+        Makes regex patterns out of sentence tagged with parts of speech
+        by splitting sentence into parts,
+        getting all nouns, verbs and personal pronouns out of each one
+        and joining them into one string
+        :param tagged: words of the sentence with their parts of speech
+        :return: regex strings
+        """
+
+        patterns = list()
 
         # splitting sentence into parts and making a pattern out of each one
         sub_sentence = list()
@@ -198,10 +455,10 @@ class LearningAgent:
 
         return patterns
 
-    def learn(self, input_text: str, reply: str, right: bool) -> None:
+    def learn(self, input_text: Union[str, text_processing.AnalyzedMessage], reply: str, right: bool) -> None:
         """
         learns what is right or wrong to say
-        :param input_text: text of input message
+        :param input_text: text of input message or its analysis
         :param reply: reply given by replying agent
         :param right: True if agent should learn that given combination of
         sentence pattern and reply is right or False if wrong
@@ -212,13 +469,11 @@ class LearningAgent:
         key = 'replies' if right else 'black list'
         other_key = 'black list' if right else 'replies'
 
-        sentences = sent_tokenize(input_text)
-
         # each sentence in the text is converted to regex pattern and the information
         # about right/wrong reply is added to knowledge base with this pattern as key
-        for sentence in sentences:
-            patterns = self._make_patterns_from_sentence(sentence)
+        patterns = self._make_patterns(text_processing.analyze(input_text))
 
+        with self._knowledge_lock:
             for pattern in patterns:
                 if right:
                     LOGGER.info(f'"{pattern}" is learned with reply "{reply}"')
@@ -239,17 +494,19 @@ class LearningAgent:
                     # remove ALL occurrences of reply
                     knowledge[other_key] = list(filter(lambda a: a != reply, knowledge[other_key]))
 
-        json_manager.write(self.knowledge_base, self.save_file_name)
+        self._save_knowledge_base(len(patterns))
 
-    def get_replies(self, input_text: str) -> Tuple[List[str], List[str]]:
+    def get_replies(self, input_text: Union[str, text_processing.AnalyzedMessage]) -> Tuple[List[str], List[str]]:
         """
         Gets allowed and prohibited replies by searching for patterns in knowledge base
         that match input text
-        :param input_text: input text to search in
+        :param input_text: input text to search in or its analysis
         :return: allowed and prohibited replies
         """
 
-        sentences = sent_tokenize(input_text)
+        analyzed_message = text_processing.analyze(input_text)
+        input_text = analyzed_message.text
+        sentences = analyzed_message.sentences
         patterns = self.knowledge_base.keys()
 
         replies = list()
@@ -277,6 +534,112 @@ class LearningAgent:
         return replies, black_list
 
 
+@lru_cache(maxsize=None)
+def _fold_char(char: str) -> str:
+    """
+    Gets the character that represents all characters
+    matched by the given one in case insensitive regex search
+    :param char: one character
+    :return: folded character
+    """
+    for folded in (char.upper().lower(), char.lower(), char.lower()[:1]):
+        if len(folded) == 1 and re.fullmatch(re.escape(folded), char, re.I):
+            return folded
+    return char
+
+
+class PatternIndex:
+    """
+    Inverted index of patterns made by LearningAgent.
+    Each pattern is indexed by the beginning of its rarest stem
+    so only a small set of candidates has to be checked with regex search
+    """
+
+    # maximum length of stem beginning used as index key
+    _gram_length = 4
+
+    def __init__(self, pattern_delimiter: str, patterns: Iterable[str] = ()):
+        """
+        :param pattern_delimiter: string that joins stems in patterns
+        :param patterns: patterns to index
+        """
+        self._pattern_delimiter = pattern_delimiter
+
+        # beginnings of stems as keys and patterns indexed by them as values
+        self._postings: Dict[str, Set[str]] = dict()
+
+        # patterns with regex special symbols that are checked for every text
+        self._unindexed: Set[str] = set()
+
+        # order numbers of patterns for giving them in order they were added
+        self._order: Dict[str, int] = dict()
+
+        for pattern in patterns:
+            self.add(pattern)
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __contains__(self, pattern: str) -> bool:
+        return pattern in self._order
+
+    def _make_gram(self, stem: str) -> Optional[str]:
+        """
+        Makes index key out of stem
+        :param stem: stem from the pattern
+        :return: beginning of the stem or None if the stem can't be indexed
+        """
+        if not stem:
+            return None
+
+        # the stem must be a literal that finds only itself in folded text
+        for char in stem:
+            if re.escape(char) != char or _fold_char(char) != char:
+                return None
+
+        return stem[:self._gram_length]
+
+    def add(self, pattern: str) -> None:
+        """
+        Adds pattern to the index
+        :param pattern: pattern made by LearningAgent
+        :return: None
+        """
+        if pattern in self._order:
+            return
+
+        self._order[pattern] = len(self._order)
+
+        grams = list(map(self._make_gram, pattern.split(self._pattern_delimiter)))
+        if None in grams:
+            self._unindexed.add(pattern)
+            return
+
+        # the rarest gram gives the smallest candidates set,
+        # from equally rare ones the longest is the most selective
+        gram = min(grams, key=lambda x: (len(self._postings.get(x, ())), -len(x)))
+
+        if gram not in self._postings:
+            self._postings[gram] = set()
+        self._postings[gram].add(pattern)
+
+    def find(self, text: str) -> List[str]:
+        """
+        Finds patterns that match text
+        :param text: text to search in
+        :return: matched patterns in order they were added
+        """
+        candidates = set(self._unindexed)
+
+        folded_text = ''.join(map(_fold_char, text))
+        for start in range(len(folded_text)):
+            for end in range(start + 1, min(start + self._gram_length, len(folded_text)) + 1):
+                candidates.update(self._postings.get(folded_text[start:end], ()))
+
+        return [pattern for pattern in sorted(candidates, key=self._order.get)
+                if re.search(pattern, text, re.I)]
+
+
 class AgentPipeline:
     """
     Pipeline that iteratively uses agents in order to get reply on input text
@@ -300,16 +663,51 @@ class AgentPipeline:
 
         updated_kwargs = kwargs.copy()
 
-        agent_type = type(kwargs.get('agent', None))
+        # agents are processed as the nearest of their base classes that is known by the pipeline
+        agent_type = next(x for x in type(kwargs.get('agent', None)).__mro__ if x in self._agent_callers)
+        agent_name = type(kwargs['agent']).__name__
+
+        start_time = time.perf_counter()
+        try:
+            output = self._agent_callers[agent_type](**kwargs)
+        except Exception:
+            AGENT_ERRORS.inc(agent_name)
+            raise
+        finally:
+            AGENT_LATENCY.observe(time.perf_counter() - start_time, agent_name)
+            AGENT_CALLS.inc(agent_name)
+
+        # the first output value is either a collection of candidates or a reply
+        candidates = output[0]
+        AGENT_CANDIDATES.inc(agent_name, amount=len(candidates) if isinstance(candidates, (list, dict)) else
+                             int(candidates is not None))
+
         # value to be updated in kwargs
-        result = self._kwargs_converter[agent_type](*(self._agent_callers[agent_type](**kwargs)),
-                                                    kwargs)
+        result = self._kwargs_converter[agent_type](*output, kwargs)
 
         for key, value in result.items():
             updated_kwargs[key] = value
 
         return updated_kwargs
 
+    @staticmethod
+    def _merge_reply_variants(replies: List[str], replies_counts: Dict[str, int], kwargs) -> Dict:
+        """
+        Adds reply variants to ones from kwargs without repetitions summing up their counts
+        :param replies: new reply variants
+        :param replies_counts: counts of new reply variants
+        :param kwargs: arguments for agent caller
+        :return: updated reply variants and their counts
+        """
+        known_replies = set(kwargs['reply_variants'])
+        reply_variants = kwargs['reply_variants'] + [x for x in replies if x not in known_replies]
+
+        reply_variants_counts = dict(kwargs['reply_variants_counts'])
+        for reply, count in replies_counts.items():
+            reply_variants_counts[reply] = reply_variants_counts.get(reply, 0) + count
+
+        return {'reply_variants': reply_variants, 'reply_variants_counts': reply_variants_counts}
+
     def __init__(self, *args: [LearningAgent, NounsFindingAgent]):
         """
         :param args: agents that will be in pipeline
@@ -319,18 +717,20 @@ class AgentPipeline:
         # for adapting kwargs to arguments used by agents
         self._agent_adapters: Dict[Type, 'function'] = dict()
         self._agent_adapters[NounsFindingAgent] = lambda **kwargs: \
-            (kwargs.get('input_text', None),
+            (kwargs.get('analyzed_message', None),
              kwargs.get('black_list', None))
-        self._agent_adapters[LearningAgent] = lambda **kwargs: (kwargs.get('input_text', None),)
+        self._agent_adapters[LearningAgent] = lambda **kwargs: (kwargs.get('analyzed_message', None),)
         self._agent_adapters[RandomReplyAgent] = lambda **kwargs: \
             (kwargs.get('reply_variants', None),
              kwargs.get('black_list', None),
-             kwargs.get('no_empty_reply', False))
-        self._agent_adapters[RatingLearningAgent] = lambda **kwargs: (kwargs.get('input_text', None),)
+             kwargs.get('no_empty_reply', False),
+             kwargs.get('reply_variants_counts', None))
+        self._agent_adapters[RatingLearningAgent] = lambda **kwargs: (kwargs.get('analyzed_message', None),)
         self._agent_adapters[RatingRandomReplyAgent] = lambda **kwargs: (kwargs.get('rated_replies', None),
                                                                          kwargs.get('reply_variants', None),
                                                                          kwargs.get('black_list', None),
-                                                                         kwargs.get('no_empty_reply', False))
+                                                                         kwargs.get('no_empty_reply', False),
+                                                                         kwargs.get('excluded_replies', None))
 
         # for calling agents' methods that process input message
         self._agent_callers: Dict[Type, 'function'] = dict()
@@ -347,23 +747,23 @@ class AgentPipeline:
 
         # for converting agent's output to kwargs parameter(s)
         self._kwargs_converter: Dict[Type, 'function'] = dict()
-        self._kwargs_converter[NounsFindingAgent] = lambda replies, kwargs: \
-            {'reply_variants': kwargs['reply_variants'] + replies}
+        self._kwargs_converter[NounsFindingAgent] = self._merge_reply_variants
         self._kwargs_converter[LearningAgent] = lambda replies, black_list, kwargs: \
             {'reply_variants': kwargs['reply_variants'] + replies,
              'black_list': kwargs['black_list'] + black_list}
         self._kwargs_converter[RandomReplyAgent] = lambda reply, kwargs: \
             {'reply': reply}
-        self._kwargs_converter[RatingLearningAgent] = lambda rated_replies, kwargs: \
-            {'rated_replies': rated_replies}
+        self._kwargs_converter[RatingLearningAgent] = lambda rated_replies, excluded_replies, kwargs: \
+            {'rated_replies': rated_replies, 'excluded_replies': excluded_replies}
         self._kwargs_converter[RatingRandomReplyAgent] = lambda reply, kwargs: \
             {'reply': reply}
 
-    def get_reply(self, input_text: str, no_empty_reply: bool = False) -> Optional[str]:
+    def get_reply(self, input_text: Union[str, text_processing.AnalyzedMessage],
+                  no_empty_reply: bool = False) -> Optional[str]:
         """
         Passes arguments through each of agents and
         returns reply on input text
-        :param input_text: input text
+        :param input_text: input text or its analysis that is shared by all agents
         :param no_empty_reply: flag that indicates must there be a mandatory non-empty reply or not
         is mandatory and False otherwise
         :return: text reply on input text or None if there are no reply on given input
@@ -373,8 +773,10 @@ class AgentPipeline:
         init_kwargs = {
             'reply': None,
             'reply_variants': list(),
+            'reply_variants_counts': dict(),
             'rated_replies': dict(),
-            'input_text': input_text,
+            'excluded_replies': dict(),
+            'analyzed_message': text_processing.analyze(input_text),
             'no_empty_reply': no_empty_reply,
             'black_list': list()
         }
@@ -396,25 +798,65 @@ class RatingLearningAgent(LearningAgent):
     Learning agent with rating system for replies
     """
 
-    def __init__(self, save_file_name: str, predecessor_save_file: str = ""):
+    def __init__(self, save_file_name: str, predecessor_save_file: str = "",
+                 journal_compaction_period: int = 1000,
+                 flush_period: Optional[float] = None, flush_changes: int = 100,
+                 top_rated_replies: Optional[int] = None):
+        """
+        :param save_file_name: name of a json file to write learned information
+        :param predecessor_save_file: name of a json file with LearningAgent's knowledge base
+        to recreate the knowledge base from if there is no save file yet
+        :param journal_compaction_period: number of learned rating changes
+        after which they are written into the save file
+        :param flush_period: [seconds] if it is given then learned information is written
+        in background not later than this period after learning instead of appending it to the journal
+        :param flush_changes: number of learned changes that makes learned information
+        to be written in background immediately
+        :param top_rated_replies: maximum number of replies with non-negative rating
+        that are got on input text, all of them are got if it's None
+        """
+        self.top_rated_replies = top_rated_replies
+
         if not os.path.isfile(save_file_name) and os.path.isfile(predecessor_save_file):
-            super().__init__(predecessor_save_file)
+            super().__init__(predecessor_save_file, flush_period, flush_changes)
             self.__recreate_knowledge_base(save_file_name)
         else:
-            super().__init__(save_file_name)
+            super().__init__(save_file_name, flush_period, flush_changes)
+            self.knowledge_base = persistence.RatedKnowledgeBase(self.knowledge_base)
 
-    def __recreate_knowledge_base(self, path_to_base_file) -> None:
+        # rating changes are appended to the journal instead of rewriting the save file
+        self._journal = persistence.KnowledgeJournal(self.save_file_name, journal_compaction_period)
+        self._journal.replay(self.knowledge_base)
+
+        self._pattern_index = PatternIndex(self.pattern_delimiter, self.knowledge_base)
+
+        # patterns, replies and rating changes learned while the knowledge base is being compacted
+        self._learned_while_compacting: Optional[List[Tuple[str, str, int]]] = None
+
+    def _write_knowledge_base(self) -> None:
         """
-        recreates knowledge base from predecessor's base and writes it as json file
-        :param path_to_base_file: path to the new base json file
+        Writes knowledge base to the save file and empties the journal
         :return: None
         """
+        with self._knowledge_lock:
+            self._journal.compact(self.knowledge_base)
+
+    def close(self) -> None:
+        super().close()
+        self._journal.close()
+
+    @staticmethod
+    def _rate_predecessor_knowledge(old_base: Dict[str, Dict[str, List[str]]]) -> Dict[str, Dict[str, int]]:
+        """
+        Converts LearningAgent's knowledge base into rated one
+        :param old_base: knowledge base with allowed and prohibited replies
+        :return: knowledge base with rated replies
+        """
 
         # initial values for replies from predecessor
         init_good_reply_val = 5
         init_bad_reply_val = -5
 
-        old_base = self.knowledge_base
         new_knowledge_base: Dict[str, Dict[str, int]] = dict()
         for pattern, rules in old_base.items():
             if pattern not in new_knowledge_base:
@@ -423,51 +865,316 @@ class RatingLearningAgent(LearningAgent):
                 new_knowledge_base[pattern][reply] = init_good_reply_val
             for reply in rules.get('black list', []):
                 new_knowledge_base[pattern][reply] = init_bad_reply_val
-        self.knowledge_base = new_knowledge_base
+        return new_knowledge_base
+
+    def __recreate_knowledge_base(self, path_to_base_file) -> None:
+        """
+        recreates knowledge base from predecessor's base and writes it as json file
+        :param path_to_base_file: path to the new base json file
+        :return: None
+        """
+
+        self.knowledge_base = persistence.RatedKnowledgeBase(self._rate_predecessor_knowledge(self.knowledge_base))
         self.save_file_name = path_to_base_file
-        json_manager.write(self.knowledge_base, path_to_base_file)
+        persistence.write_json(self.knowledge_base.to_json(), path_to_base_file, indent=None)
 
-    def rating_learn(self, input_text: str, reply: str, rating_change: int) -> None:
+    def rating_learn(self, input_text: Union[str, text_processing.AnalyzedMessage],
+                     reply: str, rating_change: int) -> None:
         """
         Learns a patterns made from inputs text and corresponding reply
         by rating pairs of patterns and replies
-        :param input_text: text that the bot received
+        :param input_text: text that the bot received or its analysis
         :param reply: reply that the bot gave
         :param rating_change: how much rating should be increased or decreased
         :return: None
         """
 
-        sentences = sent_tokenize(input_text)
+        self.rating_learn_patterns(self.make_patterns(input_text), reply, rating_change)
 
-        for sentence in sentences:
-            patterns = self._make_patterns_from_sentence(sentence)
+    def get_patterns_num(self) -> int:
+        """
+        Gets number of learned patterns
+        :return: number of patterns
+        """
+        return len(self._pattern_index)
 
+    def make_patterns(self, input_text: Union[str, text_processing.AnalyzedMessage]) -> List[str]:
+        """
+        Makes patterns out of input text, so they can be learned later with several rating changes
+        :param input_text: text that the bot received or its analysis
+        :return: patterns
+        """
+        return self._make_patterns(text_processing.analyze(input_text))
+
+    def rating_learn_patterns(self, patterns: List[str], reply: str, rating_change: int) -> None:
+        """
+        Learns patterns made from inputs text and corresponding reply
+        by rating pairs of patterns and replies
+        :param patterns: patterns made by make_patterns()
+        :param reply: reply that the bot gave
+        :param rating_change: how much rating should be increased or decreased
+        :return: None
+        """
+
+        start_time = time.perf_counter()
+
+        with self._knowledge_lock:
             for pattern in patterns:
                 if pattern not in self.knowledge_base:
-                    self.knowledge_base[pattern] = dict()
+                    self._pattern_index.add(pattern)
 
-                knowledge = self.knowledge_base[pattern]
-                knowledge[reply] = knowledge.get(reply, 0) + rating_change
+                rating = self.knowledge_base.add_rating(pattern, reply, rating_change)
+                # changes written in background are not journaled
+                if not self._flusher:
+                    self._journal.append(pattern, reply, rating_change)
 
-                LOGGER.info(f'pattern {pattern} is learned with reply {reply} with rating {knowledge[reply]}')
+                LOGGER.info(f'pattern {pattern} is learned with reply {reply} with rating {rating}')
+            self.knowledge_base.mark_used(patterns)
+            if self._learned_while_compacting is not None:
+                self._learned_while_compacting.extend((pattern, reply, rating_change) for pattern in patterns)
 
-        json_manager.write(self.knowledge_base, self.save_file_name)
+            if self._flusher:
+                self._flusher.mark_dirty(len(patterns))
+            elif self._journal.needs_compaction():
+                self._journal.compact(self.knowledge_base)
 
-    def get_rated_replies(self, input_text: str) -> Tuple[Dict[str, int]]:
+        LEARN_LATENCY.observe(time.perf_counter() - start_time)
+
+    def get_rated_replies(self, input_text: Union[str, text_processing.AnalyzedMessage]) \
+            -> Tuple[Dict[str, int], Dict[str, int]]:
         """
         Gets rated replies on given input text
-        :param input_text: text message from user
-        :return: replies and corresponding rating
+        :param input_text: text message from user or its analysis
+        :return: replies with the highest non-negative ratings and replies with negative ratings
         """
-        result = dict()
-        all_patterns = list(self.knowledge_base.keys())
-        found_patterns = list(filter(lambda pattern: re.search(pattern, input_text, re.I), all_patterns))
+        input_text = str(input_text)
+        found_patterns = self._pattern_index.find(input_text)
+        PATTERN_MATCHES.observe(len(found_patterns))
         for found_pattern in found_patterns:
             LOGGER.info(f'pattern {found_pattern} is found in text {input_text}')
-            for reply, rating in self.knowledge_base[found_pattern].items():
-                result[reply] = result.get(reply, 0) + rating
 
-        return result,
+        knowledge_base = self.knowledge_base
+        knowledge_base.mark_used(found_patterns)
+        return knowledge_base.get_top_ratings(found_patterns, self.top_rated_replies)
+
+    def _report_compaction(self, removed: Dict[str, int], start_time: float) -> None:
+        """
+        Logs and counts knowledge removed by compaction
+        :param removed: numbers of removed patterns, ratings, replies and bytes
+        :param start_time: time when the compaction started
+        :return: None
+        """
+        for kind, number in removed.items():
+            COMPACTION_REMOVED.inc(kind, amount=number)
+        LOGGER.info(f'knowledge base is compacted in {time.perf_counter() - start_time:.2f} seconds, '
+                    f'{removed["patterns"]} patterns, {removed["ratings"]} ratings, '
+                    f'{removed["replies"]} replies and {removed["bytes"]} bytes are removed')
+
+    def compact_knowledge_base(self, policy: persistence.CompactionPolicy) -> Dict[str, int]:
+        """
+        Removes knowledge that should be removed by the policy and writes the compacted knowledge base.
+        Replies are searched and learned in the old knowledge base until the compacted one replaces it,
+        patterns learned meanwhile are merged into the compacted knowledge base before it replaces the old one
+        :param policy: rules of removing knowledge
+        :return: numbers of removed patterns, ratings and replies and [bytes] estimated memory they took
+        """
+        start_time = time.perf_counter()
+
+        with self._knowledge_lock:
+            old_base = self.knowledge_base
+            self._learned_while_compacting = list()
+
+        try:
+            knowledge_base = old_base.compact(policy)
+            with self._knowledge_lock:
+                learned, self._learned_while_compacting = self._learned_while_compacting, list()
+                knowledge_base.merge_patterns(old_base, {pattern for pattern, _, _ in learned}, policy)
+
+            # the compacted knowledge base isn't changed by learning until it replaces the old one
+            pattern_index = PatternIndex(self.pattern_delimiter, knowledge_base)
+            snapshot_hash = self._journal.write_snapshot(knowledge_base)
+        except Exception:
+            with self._knowledge_lock:
+                self._learned_while_compacting = None
+            raise
+
+        with self._knowledge_lock:
+            learned, self._learned_while_compacting = self._learned_while_compacting, None
+            for pattern, reply, rating_change in learned:
+                knowledge_base.add_rating(pattern, reply, rating_change)
+                pattern_index.add(pattern)
+            knowledge_base.mark_used({pattern for pattern, _, _ in learned})
+            self._journal.replace_snapshot(snapshot_hash, learned)
+
+            # replies being searched at the same time use either old or new knowledge
+            self.knowledge_base, self._pattern_index = knowledge_base, pattern_index
+
+        removed = {
+            'patterns': len(old_base) - len(knowledge_base),
+            'ratings': old_base.get_ratings_num() - knowledge_base.get_ratings_num(),
+            'replies': old_base.get_replies_num() - knowledge_base.get_replies_num(),
+            'bytes': old_base.get_size() - knowledge_base.get_size()
+        }
+        self._report_compaction(removed, start_time)
+        return removed
+
+
+class SQLiteRatingLearningAgent(RatingLearningAgent):
+    """
+    Rating learning agent that keeps its knowledge base in SQLite database instead of memory,
+    only patterns are kept in memory for searching them in input texts
+    """
+
+    def __init__(self, database_file_name: str, save_file_name: str = "", predecessor_save_file: str = "",
+                 top_rated_replies: Optional[int] = None):
+        """
+        :param database_file_name: name of SQLite database file to write learned information
+        :param save_file_name: name of a json file with RatingLearningAgent's knowledge base
+        to migrate into the database if it's not migrated yet
+        :param predecessor_save_file: name of a json file with LearningAgent's knowledge base
+        to migrate into the database if there is no RatingLearningAgent's save file
+        :param top_rated_replies: maximum number of replies with non-negative rating
+        that are got on input text, all of them are got if it's None
+        """
+        self.top_rated_replies = top_rated_replies
+        self._store = persistence.SQLiteKnowledgeBase(database_file_name)
+        self._migration_files = save_file_name, predecessor_save_file
+
+        # patterns with time when they were found or learned the last time
+        # and number of such times since the last compaction
+        self._usage: Dict[str, List[int]] = dict()
+        # patterns, replies and rating changes learned while the knowledge base is being compacted
+        self._learned_while_compacting: Optional[List[Tuple[str, str, int]]] = None
+
+        # RatingLearningAgent's initialization is omitted
+        # because it reads the whole knowledge base into memory
+        LearningAgent.__init__(self, database_file_name)
+
+        self._pattern_index = PatternIndex(self.pattern_delimiter, self._store.get_patterns())
+
+    def _read_knowledge_base(self) -> Dict:
+        """
+        Migrates json knowledge base into the database if it's not migrated yet
+        :return: empty knowledge base because the knowledge is kept in the database
+        """
+        if self._store.is_migrated():
+            return dict()
+
+        save_file_name, predecessor_save_file = self._migration_files
+        if save_file_name and os.path.isfile(save_file_name):
+            knowledge_base = persistence.RatedKnowledgeBase(json_manager.read(save_file_name))
+            # the journal is replayed for not losing changes that aren't compacted yet
+            journal = persistence.KnowledgeJournal(save_file_name)
+            journal.replay(knowledge_base)
+            journal.close()
+        elif predecessor_save_file and os.path.isfile(predecessor_save_file):
+            knowledge_base = self._rate_predecessor_knowledge(json_manager.read(predecessor_save_file))
+        else:
+            knowledge_base = dict()
+
+        self._store.migrate(knowledge_base)
+
+        return dict()
+
+    def _write_knowledge_base(self) -> None:
+        """
+        Does nothing because learned information is written into the database immediately
+        :return: None
+        """
+
+    def close(self) -> None:
+        LearningAgent.close(self)
+        self._store.close()
+
+    def rating_learn_patterns(self, patterns: List[str], reply: str, rating_change: int) -> None:
+        """
+        Learns patterns made from inputs text and corresponding reply
+        by rating pairs of patterns and replies
+        :param patterns: patterns made by make_patterns()
+        :param reply: reply that the bot gave
+        :param rating_change: how much rating should be increased or decreased
+        :return: None
+        """
+
+        start_time = time.perf_counter()
+
+        with self._knowledge_lock:
+            self._store.add_ratings([(pattern, reply, rating_change) for pattern in patterns])
+            self._mark_used(patterns)
+            if self._learned_while_compacting is not None:
+                self._learned_while_compacting.extend((pattern, reply, rating_change) for pattern in patterns)
+
+            for pattern in patterns:
+                self._pattern_index.add(pattern)
+                LOGGER.info(f'pattern {pattern} is learned with reply {reply} with rating change {rating_change}')
+
+        LEARN_LATENCY.observe(time.perf_counter() - start_time)
+
+    def get_rated_replies(self, input_text: Union[str, text_processing.AnalyzedMessage]) \
+            -> Tuple[Dict[str, int], Dict[str, int]]:
+        """
+        Gets rated replies on given input text
+        :param input_text: text message from user or its analysis
+        :return: replies with the highest non-negative ratings and replies with negative ratings
+        """
+        input_text = str(input_text)
+        found_patterns = self._pattern_index.find(input_text)
+        PATTERN_MATCHES.observe(len(found_patterns))
+        for found_pattern in found_patterns:
+            LOGGER.info(f'pattern {found_pattern} is found in text {input_text}')
+
+        with self._knowledge_lock:
+            self._mark_used(found_patterns)
+            return self._store.get_top_ratings(found_patterns, self.top_rated_replies)
+
+    def _mark_used(self, patterns: List[str]) -> None:
+        """
+        Remembers that patterns were found or learned now.
+        Must be called under the knowledge lock
+        :param patterns: patterns
+        :return: None
+        """
+        now = int(time.time())
+        for pattern in patterns:
+            usage = self._usage.setdefault(pattern, [0, 0])
+            usage[0] = now
+            usage[1] += 1
+
+    def compact_knowledge_base(self, policy: persistence.CompactionPolicy) -> Dict[str, int]:
+        """
+        Removes knowledge that should be removed by the policy.
+        The database is compacted by a separate connection so replies are searched meanwhile
+        :param policy: rules of removing knowledge
+        :return: numbers of removed patterns, ratings and replies and [bytes] size of freed database pages
+        """
+        start_time = time.perf_counter()
+
+        with self._knowledge_lock:
+            usage, self._usage = self._usage, dict()
+            self._learned_while_compacting = list()
+
+        try:
+            # patterns that have usage again were found or learned after the compaction started
+            removed = self._store.compact(policy, {pattern: tuple(x) for pattern, x in usage.items()},
+                                          lambda pattern: pattern in self._usage)
+            pattern_index = PatternIndex(self.pattern_delimiter, self._store.get_patterns())
+        except Exception:
+            with self._knowledge_lock:
+                self._learned_while_compacting = None
+                # usage will be written by the next compaction
+                for pattern, (last_used, uses) in usage.items():
+                    current = self._usage.setdefault(pattern, [0, 0])
+                    current[0], current[1] = max(current[0], last_used), current[1] + uses
+            raise
+
+        with self._knowledge_lock:
+            for pattern, _, _ in self._learned_while_compacting:
+                pattern_index.add(pattern)
+            self._learned_while_compacting = None
+            self._pattern_index = pattern_index
+
+        self._report_compaction(removed, start_time)
+        return removed
 
 
 class RandomReplyAgent:
@@ -475,19 +1182,122 @@ class RandomReplyAgent:
     Agent that chooses random replies from given ones
     """
 
-    def __init__(self, path_to_phrases: str):
-        if not (path_to_phrases or os.path.isfile(path_to_phrases)):
+    def __init__(self, path_to_phrases: str, language_pack: Optional[LanguagePack] = None):
+        """
+        :param path_to_phrases: path to json with phrases as keys
+        :param language_pack: pack with sentences that are used as phrases instead of json file if it's given
+        """
+        if not language_pack and not (path_to_phrases or os.path.isfile(path_to_phrases)):
             LOGGER.error('wrong phrases path for RandomReplyAgent')
             return
 
-        self._all_phrases = list(json_manager.read(path_to_phrases).keys())
         self._max_weight = 1024
         # for multiplying weight of a given reply
         self.__given_reply_multiplier = 2
         self.__random_reply_divisor = 2
-        self._phrases_weights: Dict[str, int] = dict()
-        for phrase in self._all_phrases:
-            self._phrases_weights[phrase] = self._max_weight
+        if language_pack:
+            self._set_phrases(language_pack.sentences, dict(), language_pack.sentences_ids)
+        else:
+            self._set_phrases(list(json_manager.read(path_to_phrases).keys()), dict())
+
+    def _set_phrases(self, phrases: Sequence[str], weights: Dict[str, int],
+                     phrases_ids: Optional[Mapping[str, int]] = None) -> None:
+        """
+        Sets phrases that replies are chosen from
+        :param phrases: all phrases
+        :param weights: weights of phrases, maximum weight is used for phrases that are not in it
+        :param phrases_ids: indices of phrases, they are made from phrases if it's not given
+        :return: None
+        """
+        # phrases are identified by their indices in the list of all phrases
+        self._all_phrases = phrases
+        self._phrases_ids: Mapping[str, int] = phrases_ids if phrases_ids is not None else \
+            {phrase: i for i, phrase in enumerate(phrases)}
+        self._phrases_weights = weighted_sampling.WeightedSampler(
+            [weights.get(phrase, self._max_weight) for phrase in phrases] if weights
+            else [self._max_weight] * len(phrases))
+
+    def _remove_phrase(self, phrase: str) -> None:
+        """
+        Removes phrase, the last phrase takes its id
+        :param phrase: known phrase
+        :return: None
+        """
+        phrase_id = self._phrases_ids.pop(phrase)
+        last_phrase = self._all_phrases.pop()
+        last_weight = self._phrases_weights.pop()
+        if phrase_id < len(self._all_phrases):
+            self._all_phrases[phrase_id] = last_phrase
+            self._phrases_ids[last_phrase] = phrase_id
+            self._phrases_weights.set_weight(phrase_id, last_weight)
+
+    def _add_phrase(self, phrase: str) -> None:
+        """
+        Adds phrase with maximum weight
+        :param phrase: new phrase
+        :return: None
+        """
+        self._phrases_ids[phrase] = len(self._all_phrases)
+        self._all_phrases.append(phrase)
+        self._phrases_weights.append(self._max_weight)
+
+    def apply_diff(self, diff: Dict[str, Dict[str, Dict]]) -> None:
+        """
+        Applies changes of the phrases file made by rebuilding it
+        by removing and adding only changed phrases, weights of remaining phrases are kept.
+        Must be called in the thread that chooses replies
+        :param diff: dictionary with "sentences" key and dictionary
+        with "added" and "removed" entries of the phrases file as value
+        :return: None
+        """
+        if not isinstance(self._all_phrases, list):
+            # phrases of the pack can't be changed so they are read once to be changed in memory
+            self._all_phrases = list(self._all_phrases)
+            self._phrases_ids = dict(self._phrases_ids)
+
+        # sentences that are only changed by their nouns are kept
+        added = diff['sentences']['added']
+        for phrase in diff['sentences']['removed']:
+            if phrase not in added and phrase in self._phrases_ids:
+                self._remove_phrase(phrase)
+        for phrase in added:
+            if phrase not in self._phrases_ids:
+                self._add_phrase(phrase)
+
+    def _get_weight(self, phrase: str) -> int:
+        """
+        Gets weight of a phrase
+        :param phrase: phrase
+        :return: weight or 0 if the phrase is unknown
+        """
+        phrase_id = self._phrases_ids.get(phrase)
+        return 0 if phrase_id is None else self._phrases_weights.get_weight(phrase_id)
+
+    def has_phrase(self, phrase: str) -> bool:
+        """
+        Checks if a phrase can be chosen as a reply
+        :param phrase: phrase
+        :return: True if the phrase is known else False
+        """
+        return phrase in self._phrases_ids
+
+    def _get_ids(self, phrases: Iterable[str]) -> Set[int]:
+        """
+        Gets ids of known phrases
+        :param phrases: phrases
+        :return: ids of phrases
+        """
+        return {self._phrases_ids[phrase] for phrase in phrases if phrase in self._phrases_ids}
+
+    def _choose_random_phrases(self, omitted: Iterable[str], k: int = 1) -> List[str]:
+        """
+        Chooses random phrases with equal probabilities
+        :param omitted: phrases that can't be chosen
+        :param k: number of phrases to choose
+        :return: chosen phrases
+        """
+        return [self._all_phrases[phrase_id] for phrase_id in
+                weighted_sampling.sample_uniform(len(self._all_phrases), self._get_ids(omitted), k)]
 
     def _decrease_weight(self, reply) -> None:
         """
@@ -495,46 +1305,54 @@ class RandomReplyAgent:
         :param reply: reply phrase
         :return: None
         """
-        if reply:
-            self._phrases_weights[reply] = round(math.sqrt(self._phrases_weights[reply]))
-            if self._phrases_weights[reply] < 2:
-                self._phrases_weights[reply] = self._max_weight
+        if reply in self._phrases_ids:
+            reply_id = self._phrases_ids[reply]
+            weight = round(math.sqrt(self._phrases_weights.get_weight(reply_id)))
+            if weight < 2:
+                weight = self._max_weight
+            self._phrases_weights.set_weight(reply_id, weight)
 
     def get_reply(self, replies: List[str], black_list: List[str],
-                  no_empty_reply: bool) -> Tuple[Optional[str]]:
+                  no_empty_reply: bool, replies_counts: Optional[Dict[str, int]] = None) -> Tuple[Optional[str]]:
         """
         Gets random reply or nothing if there are no possible replies
         :param replies: given replies
         :param black_list: prohibited replies
         :param no_empty_reply: flag to indicate that there must be a non-empty reply
         as a returned value
+        :param replies_counts: how many times each of given replies was found,
+        weight of a reply is multiplied by it
         :return: one chosen reply or None
         """
+        black_list = set(black_list or ())
+        replies_counts = replies_counts or dict()
+
         if replies:
             if no_empty_reply:
                 k = 1
             else:
-                k = math.floor(len(replies) / 2)
+                k = math.floor(sum(replies_counts.get(x, 1) for x in replies) / 2)
 
             # adding a random number of additional phrases
             # depending on no_empty_reply parameter
-            random_replies = random.choices(list(filter(lambda x: x not in replies,
-                                                        self._all_phrases)), k=k)
-            possible_replies = replies + random_replies
-        else:
-            possible_replies = self._all_phrases if no_empty_reply else list()
+            random_replies = self._choose_random_phrases(replies, k)
 
-        # omitting phrases from black list
-        if black_list:
-            possible_replies = list(filter(lambda x: x not in black_list, possible_replies))
+            # omitting phrases from black list
+            possible_replies = list(filter(lambda x: x not in black_list, replies + random_replies))
 
-        # choosing the reply depending on how many times it was used before
-        # and if it is in replies
-        if possible_replies:
+            # choosing the reply depending on how many times it was used before
+            # and if it is in replies
+            given_replies = set(replies)
             reply = random.choices(possible_replies, weights=list(map(
                 lambda phrase:
-                self._phrases_weights[phrase] * self.__given_reply_multiplier if phrase in replies else
-                self._phrases_weights[phrase], possible_replies)))[0]
+                self._get_weight(phrase) * self.__given_reply_multiplier * replies_counts.get(phrase, 1)
+                if phrase in given_replies else
+                self._get_weight(phrase), possible_replies)))[0] if possible_replies else None
+        elif no_empty_reply:
+            # choosing from all phrases except ones from black list
+            # depending on how many times they were used before
+            reply_id = self._phrases_weights.sample(excluded=self._get_ids(black_list))
+            reply = None if reply_id is None else self._all_phrases[reply_id]
         else:
             reply = None
 
@@ -548,8 +1366,45 @@ class RatingRandomReplyAgent(RandomReplyAgent):
     """Agent that chooses reply for and input text randomly
     and takes into account given rated replies"""
 
-    def __init__(self, path_to_phrases: str):
-        super().__init__(path_to_phrases)
+    def __init__(self, path_to_phrases: str, vectorized: bool = False,
+                 language_pack: Optional[LanguagePack] = None):
+        """
+        :param path_to_phrases: path to json with phrases as keys
+        :param vectorized: if True then replies are chosen using arrays of weights and ratings
+        aligned by phrases ids, which is faster for large number of phrases
+        :param language_pack: pack with sentences that are used as phrases instead of json file if it's given
+        """
+        super().__init__(path_to_phrases, language_pack)
+
+        self._vectorized = vectorized
+        self._update_weights_array()
+
+    def _update_weights_array(self) -> None:
+        """
+        Copies weights of phrases into array aligned by phrases ids if replies are chosen using arrays
+        :return: None
+        """
+        if self._vectorized:
+            self._weights_array = numpy.array([self._phrases_weights.get_weight(i)
+                                               for i in range(len(self._all_phrases))], dtype=numpy.int64)
+
+    def _remove_phrase(self, phrase: str) -> None:
+        phrase_id = self._phrases_ids[phrase]
+        super()._remove_phrase(phrase)
+
+        if self._vectorized:
+            phrases_num = len(self._all_phrases)
+            if phrase_id < phrases_num:
+                self._weights_array[phrase_id] = self._weights_array[phrases_num]
+            self._weights_array = self._weights_array[:phrases_num]
+
+    def apply_diff(self, diff: Dict[str, Dict[str, Dict]]) -> None:
+        super().apply_diff(diff)
+
+        # weights of added phrases are appended at once
+        if self._vectorized and len(self._weights_array) < len(self._all_phrases):
+            self._weights_array = numpy.concatenate((self._weights_array, numpy.full(
+                len(self._all_phrases) - len(self._weights_array), self._max_weight, dtype=numpy.int64)))
 
     @staticmethod
     def __get_rated_weight(rating, weight):
@@ -559,17 +1414,98 @@ class RatingRandomReplyAgent(RandomReplyAgent):
             rated_weight = round(weight * 4 ** rating)
         return 0 if rated_weight < 0 else rated_weight
 
+    @staticmethod
+    def __get_rated_weights(ratings: numpy.ndarray, weights: numpy.ndarray) -> numpy.ndarray:
+        """
+        Vectorized version of __get_rated_weight
+        :param ratings: ratings of phrases
+        :param weights: weights of phrases
+        :return: rated weights of phrases
+        """
+        rated_weights = numpy.where(ratings >= 0,
+                                    numpy.log(numpy.maximum(ratings, 0) + math.e) * weights,
+                                    weights * numpy.power(4.0, numpy.minimum(ratings, 0)))
+        return numpy.maximum(numpy.round(rated_weights), 0)
+
+    def _decrease_weight(self, reply) -> None:
+        super()._decrease_weight(reply)
+
+        if self._vectorized and reply in self._phrases_ids:
+            reply_id = self._phrases_ids[reply]
+            self._weights_array[reply_id] = self._phrases_weights.get_weight(reply_id)
+
+    def _make_mask(self, phrases: Iterable[str]) -> numpy.ndarray:
+        """
+        Makes mask of phrases aligned by phrases ids
+        :param phrases: phrases to be marked
+        :return: array with True for given phrases and False for others
+        """
+        mask = numpy.zeros(len(self._all_phrases), dtype=bool)
+        mask[list(self._get_ids(phrases))] = True
+        return mask
+
+    def _get_rated_reply_vectorized(self, rated_replies: Dict[str, int], replies: List[str], black_list: List[str],
+                                    no_empty_reply: bool) -> Optional[str]:
+        """
+        Gets random reply as get_rated_reply() does
+        but filters, weights and chooses phrases using arrays aligned by phrases ids
+        :param rated_replies: replies with rating
+        :param replies: replies without rating
+        :param black_list: replies that should not be chosen
+        :param no_empty_reply: flag that indicates must there be a mandatory non-empty reply or not
+        :return: reply on None if it's not possible to get a reply
+        """
+        ratings = numpy.zeros(len(self._all_phrases))
+        rated_ids = [self._phrases_ids[x] for x in rated_replies if x in self._phrases_ids]
+        ratings[rated_ids] = [rated_replies[self._all_phrases[i]] for i in rated_ids]
+        rated_mask = numpy.zeros(len(self._all_phrases), dtype=bool)
+        rated_mask[rated_ids] = True
+        given_mask = self._make_mask(replies or ())
+        black_mask = self._make_mask(black_list or ())
+
+        # given replies and replies with positive rating
+        possible_mask = (given_mask | rated_mask & (ratings >= 0)) & ~black_mask
+
+        if possible_mask.any():
+            # adding one random phrase
+            if random.choices([True, False], weights=[1, 4]):
+                random_ids = numpy.flatnonzero(~(black_mask | given_mask | rated_mask))
+                if random_ids.size:
+                    possible_mask[random_ids[random.randrange(random_ids.size)]] = True
+        elif no_empty_reply:
+            possible_mask = ~black_mask
+
+        weights = numpy.where(possible_mask, self.__get_rated_weights(ratings, self._weights_array), 0)
+        cumulative_weights = numpy.cumsum(weights)
+        if not cumulative_weights.size or cumulative_weights[-1] <= 0:
+            return None
+
+        reply_id = numpy.searchsorted(cumulative_weights, random.random() * cumulative_weights[-1], side='right')
+        return self._all_phrases[min(reply_id, len(self._all_phrases) - 1)]
+
     def get_rated_reply(self, rated_replies: Dict[str, int], replies: List[str], black_list: List[str],
-                        no_empty_reply: bool) -> Tuple[Optional[str]]:
+                        no_empty_reply: bool, excluded_replies: Optional[Dict[str, int]] = None) \
+            -> Tuple[Optional[str]]:
         """
         Gets random reply from given rated and regular replies and all phrases
         :param rated_replies: replies with rating
         :param replies: replies without rating
         :param black_list: replies that should not be chosen
         :param no_empty_reply: flag that indicates must there be a mandatory non-empty reply or not
+        :param excluded_replies: replies with negative rating that are not chosen from rated replies
         :return: reply on None if it's not possible to get a reply
         """
+        # replies with negative rating still lower weights of the same regular replies
+        if excluded_replies:
+            rated_replies = {**excluded_replies, **rated_replies}
+
+        if self._vectorized:
+            reply = self._get_rated_reply_vectorized(rated_replies, replies, black_list, no_empty_reply)
+            self._decrease_weight(reply)
+            return reply,
+
         possible_replies: List[str] = list()
+        black_list = set(black_list or ())
 
         # if there are no rated replies with positive rating
         # then there must be regular replies
@@ -580,20 +1516,20 @@ class RatingRandomReplyAgent(RandomReplyAgent):
 
             # adding one random phrase
             if possible_replies and random.choices([True, False], weights=[1, 4]):
-                possible_replies += random.choices(list(filter(lambda x: (not black_list or x not in black_list) and
-                                                               (not replies or x not in replies)
-                                                               and (not rated_replies or x not in rated_replies),
-                                                               self._all_phrases)))
-
-        if no_empty_reply and not possible_replies:
-            possible_replies = list(filter(lambda x: x not in black_list, self._all_phrases))
+                possible_replies += self._choose_random_phrases(black_list.union(replies, rated_replies))
 
         if possible_replies:
             reply = random.choices(possible_replies,
                                    list(map(lambda x:
-                                            self.__get_rated_weight(rated_replies.get(x, 0),
-                                                                    self._phrases_weights.get(x, 0)),
+                                            self.__get_rated_weight(rated_replies.get(x, 0), self._get_weight(x)),
                                             possible_replies)))[0]
+        elif no_empty_reply:
+            # choosing from all phrases except ones from black list
+            # with weights of rated phrases changed depending on their rating
+            rated_weights = {self._phrases_ids[x]: self.__get_rated_weight(rating, self._get_weight(x))
+                             for x, rating in rated_replies.items() if x in self._phrases_ids}
+            reply_id = self._phrases_weights.sample(rated_weights, self._get_ids(black_list))
+            reply = None if reply_id is None else self._all_phrases[reply_id]
         else:
             reply = None
 
@@ -631,37 +1567,53 @@ class TextCallChecker:
     Checks if the text contains the calling construction
     """
 
-    def __init__(self):
-        self.names = frozenset([
-            'рей',
-            'аянами',
-            'рей аянами',
-            'аянами рей'
-        ])
+    _default_names = [
+        'рей',
+        'аянами',
+        'рей аянами',
+        'аянами рей'
+    ]
 
-    def check(self, text) -> bool:
+    def __init__(self, names_json_path: Optional[str] = None):
         """
-        checks if the text contains the calling construction
-        using regex searching with names
-        :param text: text to check
-        :return: True if text contains the construction else False
+        :param names_json_path: path to json with list of names the bot is called by
         """
-        punct_symbols_string = r'\,\.\!\?'
+        if names_json_path and os.path.isfile(names_json_path):
+            names = json_manager.read(names_json_path)
+        else:
+            if names_json_path:
+                LOGGER.error(f'wrong names path {names_json_path} for TextCallChecker')
+            names = self._default_names
 
-        text = text.replace("\n", "")
+        self.names = frozenset(names)
+
+        punct_symbols_string = r'\,\.\!\?'
+        # longer names first for not stopping on a name that is a part of another one
+        names_regex = '|'.join(map(re.escape, sorted(self.names, key=len, reverse=True)))
 
-        for name in self.names:
-            regex_strings = [
-                f'^{name}$',
-                f'^{name}[{punct_symbols_string}]',
-                f'[{punct_symbols_string}] {name}\\?'
-            ]
+        # all calling constructions with all names are searched at once
+        self._call_regex = re.compile('|'.join([
+            f'^(?:{names_regex})$',
+            f'^(?:{names_regex})[{punct_symbols_string}]',
+            f'[{punct_symbols_string}] (?:{names_regex})\\?'
+        ]), re.I)
 
-            for regex_s in regex_strings:
-                if re.search(regex_s, text, re.I):
-                    return True
+    def check(self, text: Union[str, text_processing.AnalyzedMessage]) -> bool:
+        """
+        checks if the text contains the calling construction
+        using regex searching with names
+        :param text: text to check or its analysis
+        :return: True if text contains the construction else False
+        """
+        return self._call_regex.search(text_processing.analyze(text).single_line) is not None
 
-        return False
+    def check_many(self, texts: Iterable[Union[str, text_processing.AnalyzedMessage]]) -> List[bool]:
+        """
+        checks each of the texts if it contains the calling construction
+        :param texts: texts to check or their analyses
+        :return: True for each text that contains the construction else False
+        """
+        return list(map(self.check, texts))
 
 
 class ConversationController:
@@ -669,9 +1621,13 @@ class ConversationController:
     Controls how bot should reply on a given message depending on its source
     """
 
-    def __init__(self, agent_pipeline: AgentPipeline):
+    def __init__(self, agent_pipeline: AgentPipeline, call_checker: Optional[TextCallChecker] = None):
+        """
+        :param agent_pipeline: pipeline that gives replies
+        :param call_checker: checker of calling constructions, the one with default names is used if not given
+        """
         self._messages_counter = MessagesCounter()
-        self._call_checker = TextCallChecker()
+        self._call_checker = call_checker or TextCallChecker()
 
         self._agent_pipeline = agent_pipeline
 
@@ -679,27 +1635,36 @@ class ConversationController:
     def _is_question(text) -> bool:
         return True if re.search(r'\?', text) else False
 
-    def proceed_input_message(self, input_text: str,
+    def proceed_input_message(self, input_text: Union[str, text_processing.AnalyzedMessage],
                               is_private: bool = False,
                               is_call: bool = False) -> Optional[str]:
         """
         chooses parameters for agent pipeline depending on
         message source type (private or group) and message content
-        :param input_text: text of the message
+        :param input_text: text of the message or its analysis
         :param is_private: is message private?
         :param is_call: does message contains calling construction?
         :return: reply on message or None
         """
-        is_call = is_call or self._call_checker.check(input_text)
-        no_empty_reply = True if is_call or is_private and (self._is_question(input_text)
-                                                            or random.choices([True, False], weights=[2, 1])[
-                                                                0]) else False
-
-        if is_call or is_private or random.choices([True, False], [1, 29])[0]:
-            reply = self._agent_pipeline.get_reply(input_text, no_empty_reply=no_empty_reply)
-            if reply:
-                self._messages_counter.reset()
-
-            return reply
-
-        return None
+        start_time = time.perf_counter()
+        result = 'error'
+        try:
+            input_text = text_processing.analyze(input_text)
+            is_call = is_call or self._call_checker.check(input_text)
+            no_empty_reply = True if is_call or is_private and (self._is_question(input_text.text)
+                                                                or random.choices([True, False], weights=[2, 1])[
+                                                                    0]) else False
+
+            if is_call or is_private or random.choices([True, False], [1, 29])[0]:
+                reply = self._agent_pipeline.get_reply(input_text, no_empty_reply=no_empty_reply)
+                if reply:
+                    self._messages_counter.reset()
+
+                result = 'reply' if reply else 'no reply'
+                return reply
+
+            result = 'ignored'
+            return None
+        finally:
+            MESSAGE_LATENCY.observe(time.perf_counter() - start_time)
+            MESSAGES.inc(result)
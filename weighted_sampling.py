@@ -0,0 +1,164 @@
+"""
+Module for random sampling of items by their weights
+"""
+
+import random
+from typing import List, Dict, Optional, Iterable, Set
+
+
+class WeightedSampler:
+    """
+    Fenwick tree over integer weights of items identified by their indices.
+    Updating a weight and sampling an item take O(log N) time
+    """
+
+    def __init__(self, weights: List[int]):
+        """
+        :param weights: initial weights of items
+        """
+        self._weights = list(weights)
+        self._tree = [0] * (len(self._weights) + 1)
+
+        # building the tree in linear time
+        for i, weight in enumerate(self._weights, 1):
+            self._tree[i] += weight
+            parent = i + (i & -i)
+            if parent < len(self._tree):
+                self._tree[parent] += self._tree[i]
+
+        # the highest power of two that is not greater than number of items
+        self._top_bit = 1 << (len(self._weights).bit_length() - 1) if self._weights else 0
+
+    def __len__(self) -> int:
+        return len(self._weights)
+
+    def _add(self, index: int, delta: int) -> None:
+        i = index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def get_weight(self, index: int) -> int:
+        """
+        Gets weight of an item
+        :param index: index of the item
+        :return: weight
+        """
+        return self._weights[index]
+
+    def set_weight(self, index: int, weight: int) -> None:
+        """
+        Sets weight of an item
+        :param index: index of the item
+        :param weight: new non-negative weight
+        :return: None
+        """
+        self._add(index, weight - self._weights[index])
+        self._weights[index] = weight
+
+    def append(self, weight: int) -> None:
+        """
+        Adds an item after the last one
+        :param weight: non-negative weight of the item
+        :return: None
+        """
+        self._weights.append(weight)
+        i = len(self._weights)
+        # the new node sums up weights of the items it covers
+        self._tree.append(weight + self._get_prefix_sum(i - 1) - self._get_prefix_sum(i - (i & -i)))
+        self._top_bit = 1 << (len(self._weights).bit_length() - 1)
+
+    def pop(self) -> int:
+        """
+        Removes the last item, nodes of other items don't cover it
+        :return: weight of the removed item
+        """
+        self._tree.pop()
+        weight = self._weights.pop()
+        self._top_bit = 1 << (len(self._weights).bit_length() - 1) if self._weights else 0
+        return weight
+
+    def _get_prefix_sum(self, items_num: int) -> int:
+        """
+        Gets sum of weights of the first items
+        :param items_num: number of the first items
+        :return: sum of their weights
+        """
+        total = 0
+        i = items_num
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def get_total(self) -> int:
+        """
+        Gets sum of all weights
+        :return: total weight
+        """
+        return self._get_prefix_sum(len(self._weights))
+
+    def _find(self, value: int) -> int:
+        """
+        Finds the first item whose weights prefix sum is greater than value
+        :param value: value less than total weight
+        :return: index of the item
+        """
+        position = 0
+        bit = self._top_bit
+        while bit:
+            next_position = position + bit
+            if next_position < len(self._tree) and self._tree[next_position] <= value:
+                position = next_position
+                value -= self._tree[next_position]
+            bit >>= 1
+        return position
+
+    def sample(self, weights_overrides: Optional[Dict[int, int]] = None,
+               excluded: Iterable[int] = ()) -> Optional[int]:
+        """
+        Chooses random item with probability proportional to its weight.
+        Overrides and exclusions are applied temporarily only for this sampling
+        :param weights_overrides: weights to be used instead of the stored ones
+        :param excluded: indices of items that can't be chosen
+        :return: index of the chosen item or None if all weights are zero
+        """
+        overrides = dict(weights_overrides) if weights_overrides else dict()
+        for index in excluded:
+            overrides[index] = 0
+
+        old_weights = {index: self._weights[index] for index in overrides}
+        for index, weight in overrides.items():
+            self.set_weight(index, weight)
+
+        try:
+            total = self.get_total()
+            return self._find(random.randrange(total)) if total > 0 else None
+        finally:
+            for index, weight in old_weights.items():
+                self.set_weight(index, weight)
+
+
+def sample_uniform(items_num: int, excluded: Set[int], k: int = 1) -> List[int]:
+    """
+    Chooses k random indices with replacement uniformly
+    from range of items_num omitting excluded ones
+    :param items_num: number of items
+    :param excluded: indices of items that can't be chosen
+    :param k: number of indices to choose
+    :return: chosen indices, empty if there are no allowed items
+    """
+    excluded = {index for index in excluded if 0 <= index < items_num}
+    if k <= 0 or len(excluded) >= items_num:
+        return list()
+
+    # rejection sampling is fast while most of items are allowed
+    if len(excluded) * 2 <= items_num:
+        chosen = list()
+        while len(chosen) < k:
+            index = random.randrange(items_num)
+            if index not in excluded:
+                chosen.append(index)
+        return chosen
+
+    return random.choices([index for index in range(items_num) if index not in excluded], k=k)